@@ -1,6 +1,11 @@
 from .core.core import Interpreter
 import sys
 
+# Interpreter imports most of its modules when they're first used (see core.py).
+# Once we replace ourselves below, "interpreter" is no longer a package, so `interpreter.llm` etc. couldn't be found then.
+# Importing the subpackages now (they're empty) lets their modules still be imported later
+from . import cli, llm, terminal_interface
+
 # This is done so when users `import interpreter`,
 # they get an instance of interpreter:
 
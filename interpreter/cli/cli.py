@@ -1,10 +1,10 @@
 import argparse
 import subprocess
+import sys
 import os
 import platform
 import appdirs
-from ..utils.display_markdown_message import display_markdown_message
-from ..terminal_interface.conversation_navigator import conversation_navigator
+from .daemon_client import attach
 
 arguments = [
     {
@@ -31,6 +31,12 @@ arguments = [
         "help_text": "run in debug mode",
         "type": bool
     },
+    {
+        "name": "multiple_code_blocks",
+        "nickname": "mcb",
+        "help_text": "run every code block in a response (LLMs without function calling only)",
+        "type": bool
+    },
     {
         "name": "model",
         "nickname": "m",
@@ -89,6 +95,13 @@ def cli(interpreter):
     # Add special arguments
     parser.add_argument('--config', dest='config', action='store_true', help='open config.yaml file in text editor')
     parser.add_argument('--conversations', dest='conversations', action='store_true', help='list conversations to resume')
+    parser.add_argument('--serve_local_models', dest='serve_local_models', action='store_true', help='run a server that loads local models once for every `interpreter --local` on this machine')
+    parser.add_argument('--max_batch_size', dest='max_batch_size', type=int, help='with --serve_local_models, completions to run at once per model (above 1 batches them)')
+    parser.add_argument('--max_batch_tokens', dest='max_batch_tokens', type=int, help='with --serve_local_models, tokens to evaluate per batch step')
+    parser.add_argument('--batch_wait', dest='batch_wait', type=float, help='with --serve_local_models, milliseconds to wait for a fuller batch')
+    parser.add_argument('--daemon', dest='daemon', action='store_true', help='run a daemon that keeps Open Interpreter loaded, so `interpreter` starts instantly (with `use_daemon: true` in the config)')
+    parser.add_argument('--daemon_socket', dest='daemon_socket', help=argparse.SUPPRESS)
+    parser.add_argument('--no_daemon', dest='no_daemon', action='store_true', help='run here, even if `use_daemon` is on')
     parser.add_argument('-f', '--fast', dest='fast', action='store_true', help='(depracated) runs `interpreter --model gpt-3.5-turbo`')
 
     # TODO: Implement model explorer
@@ -112,6 +125,22 @@ def cli(interpreter):
                 # Fallback to using 'open' on macOS if 'xdg-open' is not available
                 subprocess.call(['open', config_path])
         return
+
+    # If --daemon is used, keep Open Interpreter loaded for other `interpreter`s until it's idle for an hour (or CTRL-C)
+    if args.daemon:
+        from .daemon import run_daemon
+        run_daemon(interpreter, args.daemon_socket)
+        return
+
+    # If the daemon is on, run this there (it'll take over this terminal). If there isn't one yet, this starts it for next time
+    if interpreter.use_daemon and not args.no_daemon:
+        exit_code = attach(sys.argv[1:], args.daemon_socket)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    if interpreter.use_daemon:
+        # We're running it here after all, so start what Interpreter() leaves to the daemon
+        interpreter._warm_code_interpreters()
+        interpreter._start_update_check()
     
     # TODO Implement model explorer
     """
@@ -132,8 +161,18 @@ def cli(interpreter):
         # This will cause the terminal_interface to walk the user through setting up a local LLM
         interpreter.model = ""
 
+    # If --serve_local_models is used, run the local model server until CTRL-C
+    if args.serve_local_models:
+        from ..llm.local_model_client import server_command
+        try:
+            subprocess.call(server_command(max_batch_size=args.max_batch_size, max_batch_tokens=args.max_batch_tokens, batch_wait=args.batch_wait))
+        except KeyboardInterrupt:
+            pass
+        return
+
     # If --conversations is used, run conversation_navigator
     if args.conversations:
+        from ..terminal_interface.conversation_navigator import conversation_navigator
         conversation_navigator(interpreter)
         return
     
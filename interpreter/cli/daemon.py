@@ -0,0 +1,318 @@
+"""
+A per-user daemon that keeps Open Interpreter loaded, so the `interpreter` CLI starts instantly.
+
+Every `interpreter` would otherwise pay for Python starting up, importing litellm, rich and inquirer, loading the config and setting up the LLM.
+The daemon does all that once, then listens on a Unix socket. `interpreter` (with `use_daemon: true` in the config)
+sends it its terminal (stdin, stdout and stderr, as SCM_RIGHTS), arguments, cwd and environment, see daemon_client.py.
+We fork a session for it, which takes over that terminal and runs the CLI exactly as `interpreter` would have.
+
+Sessions are forks, so they start with everything already imported and the LLM already set up, and can't affect each other.
+Code interpreters are started by each session (in the background, as soon as it starts) because they need its cwd and environment.
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from .daemon_client import daemon_socket_path, code_version
+from ..utils.get_config import get_config
+from ..code_interpreters.code_interpreter_pool import code_interpreter_pool
+
+# Environment variables read when the LLM libraries are imported (like OPENAI_API_KEY), so a daemon can't pick up changes to them.
+# A client whose values differ from ours gets a fresh daemon instead
+environment_markers = ("KEY", "TOKEN", "SECRET", "API_BASE", "OPENAI", "AZURE", "ANTHROPIC", "LITELLM", "HUGGINGFACE", "HF_")
+
+# Warmed for each session if `warm_languages` isn't set
+default_warm_languages = ["python", "shell"]
+
+# We exit after this long (in seconds) without a new session. Sessions that are running keep running
+idle_timeout = 60 * 60
+
+
+def captured_environment(env):
+    return {name: value for name, value in env.items() if any(marker in name.upper() for marker in environment_markers)}
+
+
+def recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def recv_request(sock):
+    """
+    Receives a client's stdin, stdout and stderr, then `<number of bytes>\\n` and a JSON request.
+    """
+    _, fds, _, _ = socket.recv_fds(sock, 1, 3)
+    try:
+        if len(fds) != 3:
+            raise EOFError
+        length = b""
+        while not length.endswith(b"\n"):
+            length += recv_exactly(sock, 1)
+        return fds, json.loads(recv_exactly(sock, int(length)))
+    except:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+class CLIDaemon:
+
+    def __init__(self, interpreter, socket_path=None):
+        self.interpreter = interpreter
+        self.socket_path = socket_path or daemon_socket_path()
+        self.code_version = code_version()
+        self.environment = captured_environment(os.environ)
+        self.sock = None
+
+    def is_running(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+    def warm(self):
+        """
+        Does everything a session would otherwise do before its first prompt, except what depends on its terminal or cwd.
+        """
+        interpreter = self.interpreter
+
+        # The terminal interface and the LLM libraries
+        # (If one fails, sessions will import it themselves, and show the error then)
+        setup_llm = None
+        try:
+            from . import cli
+            from ..terminal_interface import terminal_interface, validate_llm_settings, conversation_navigator
+            from ..core import respond
+            from ..llm import setup_llm
+        except Exception:
+            traceback.print_exc()
+
+        # The LLM, if it can be set up without asking the user anything (see Interpreter._streaming_chat)
+        if setup_llm and not interpreter.local and interpreter.model:
+            try:
+                interpreter._llm = setup_llm.setup_llm(interpreter)
+                interpreter._llm_settings = interpreter.llm_settings()
+            except Exception:
+                traceback.print_exc()
+
+        # A fork only has the thread that forked it, so nothing may be running in another one (like warming code interpreters).
+        # Sessions warm their own
+        code_interpreter_pool.terminate()
+        deadline = time.time() + 10
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(max(0, deadline - time.time()))
+
+    def listen(self):
+        """
+        Returns False if another daemon is already listening.
+        """
+        if self.is_running():
+            return False
+        if os.path.exists(self.socket_path):
+            # Left behind by one that didn't shut down cleanly
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+
+        # Only this user can connect (they'd be running code as us)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(16)
+        return True
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        # Sessions are reaped automatically, so they never linger as zombies
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        self.sock.settimeout(idle_timeout)
+
+        while self.sock:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                return
+            except InterruptedError:
+                continue
+
+            try:
+                conn.settimeout(5)
+                fds, request = recv_request(conn)
+                conn.settimeout(None)
+            except (OSError, EOFError, ValueError):
+                conn.close()
+                continue
+
+            try:
+                if (request.get("code_version") != self.code_version
+                    or captured_environment(request.get("env", {})) != self.environment):
+                    # Stop listening first, so the client can start a fresh daemon right away
+                    self.close()
+                    conn.sendall(json.dumps({"attached": False}).encode("utf-8") + b"\n")
+                    return
+
+                if os.fork() == 0:
+                    self.close_listener()
+                    run_session(self.interpreter, conn, fds, request)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+
+    def close_listener(self):
+        # (A session's copy of the listening socket. Closing it mustn't remove the socket file)
+        self.sock.close()
+        self.sock = None
+
+
+def run_session(interpreter, conn, fds, request):
+    """
+    Runs in a fork of the daemon: takes over the client's terminal, runs the CLI, then exits.
+    """
+    exit_code = 1
+    try:
+        stdin, stdout, stderr = fds
+        os.dup2(stdin, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        sys.stdin = io.TextIOWrapper(open(0, "rb", closefd=False))
+        sys.stdout = io.TextIOWrapper(open(1, "wb", closefd=False), line_buffering=True)
+        sys.stderr = io.TextIOWrapper(open(2, "wb", closefd=False), line_buffering=True)
+
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = ["interpreter"] + request["argv"]
+
+        # Undo what we changed for the daemon itself
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        # Our code interpreters are in the daemon's session, not the terminal's, so closing the terminal won't stop them.
+        # So SIGTERM and SIGHUP (forwarded by the client, or sent by receive_signals when it goes away) exit through our `finally`,
+        # and everything we started is in a process group of its own, which we take down with us if we're stopped like that
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        signal.signal(signal.SIGHUP, exit_on_signal)
+
+        conn.sendall(json.dumps({"attached": True}).encode("utf-8") + b"\n")
+        threading.Thread(target=receive_signals, args=(conn,), daemon=True).start()
+
+        # Pick up config changes since the daemon started (it'd have to restart for anything the LLM libraries read when they're imported)
+        interpreter.__dict__.update(get_config())
+        interpreter.use_daemon = False
+
+        # Code interpreters need this session's cwd and environment, so they're started here, while the user types
+        if interpreter.preload_modules:
+            from ..code_interpreters.languages.python import set_preload_modules
+            set_preload_modules(interpreter.preload_modules)
+        code_interpreter_pool.warm(interpreter.warm_languages or default_warm_languages, interpreter.warm_pool_size)
+
+        # (The daemon itself doesn't check, see start_daemon. Sessions do, like `interpreter` would)
+        interpreter._start_update_check()
+
+        from .cli import cli
+        try:
+            cli(interpreter)
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except KeyboardInterrupt:
+            exit_code = 130
+    except SystemExit as e:
+        # (A signal before the CLI started)
+        exit_code = e.code
+    except:
+        traceback.print_exc()
+    finally:
+        # (So another signal can't interrupt cleaning up)
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_IGN)
+        try:
+            for stream in (sys.stdout, sys.stderr):
+                stream.flush()
+            for code_interpreter in interpreter._code_interpreters.values():
+                code_interpreter.terminate()
+            code_interpreter_pool.terminate()
+            conn.sendall(json.dumps({"exit": exit_code}).encode("utf-8") + b"\n")
+        except:
+            pass
+        if exit_code in (128 + signal.SIGTERM, 128 + signal.SIGHUP):
+            # Whatever's left (like a program the code started, or the Python zygote's kernels) goes too, as if the terminal closed
+            try:
+                os.killpg(0, signal.SIGTERM)
+            except OSError:
+                pass
+        # (Not sys.exit, which would run the daemon's exit handlers too)
+        os._exit(exit_code)
+
+
+def exit_on_signal(signum, frame):
+    sys.exit(128 + signum)
+
+
+def receive_signals(conn):
+    """
+    Raises the signals the client forwards (like CTRL-C) in this session. If the client goes away, so do we.
+    """
+    with conn.makefile("rb") as stream:
+        for line in stream:
+            try:
+                signum = json.loads(line)["signal"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            os.kill(os.getpid(), signum)
+    os.kill(os.getpid(), signal.SIGHUP)
+
+
+def run_daemon(interpreter, socket_path=None):
+    """
+    Runs a CLI daemon in the foreground, until it's been idle for an hour (or CTRL-C).
+    """
+    if not hasattr(socket, "send_fds"):
+        print("The CLI daemon needs Unix sockets that can pass file descriptors (Linux or macOS, with Python 3.9+).")
+        return
+
+    daemon = CLIDaemon(interpreter, socket_path)
+    if not daemon.listen():
+        print(f"A CLI daemon is already running at {daemon.socket_path}")
+        return
+
+    # (So the socket is removed when we're terminated, too)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        start = time.time()
+        daemon.warm()
+        print(f"Serving the CLI at {daemon.socket_path} (ready in {time.time() - start:.1f}s)", flush=True)
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
@@ -0,0 +1,102 @@
+"""
+The `interpreter` end of the CLI daemon (see daemon.py). Kept light, as it's all a daemon-backed `interpreter` imports.
+
+We send the daemon our stdin, stdout and stderr (as SCM_RIGHTS), our arguments, cwd and environment.
+It forks a session that runs the CLI right on our terminal, and we just pass on signals (like CTRL-C) until it tells us it's done.
+"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import appdirs
+
+def daemon_socket_path():
+    return os.path.join(appdirs.user_data_dir("Open Interpreter"), "cli.sock")
+
+def daemon_command(socket_path=None):
+    """
+    The command that starts a CLI daemon (in the foreground).
+    """
+    command = [sys.executable, "-c", "import interpreter; interpreter.cli()", "--daemon"]
+    if socket_path:
+        command += ["--daemon_socket", socket_path]
+    return command
+
+def code_version():
+    # If Open Interpreter is upgraded (or edited), a daemon that's been running since would run the old code
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return f"{package}:{os.path.getmtime(os.path.join(package, '__init__.py'))}"
+
+
+def start_daemon(socket_path=None):
+    """
+    Starts a CLI daemon in the background, in its own session, so it outlives this terminal.
+    """
+    log_path = os.path.join(appdirs.user_data_dir("Open Interpreter"), "cli_daemon.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "ab") as log:
+        subprocess.Popen(daemon_command(socket_path),
+                         stdin=subprocess.DEVNULL,
+                         stdout=log,
+                         stderr=log,
+                         start_new_session=True,
+                         env={**os.environ, "OPEN_INTERPRETER_NO_UPDATE_CHECK": "1"})
+
+
+def attach(argv, socket_path=None):
+    """
+    Runs `interpreter <argv>` in a daemon session on this terminal. Returns its exit code,
+    or None if there's no daemon we can use (then the caller should run it here).
+    """
+    if not hasattr(socket, "send_fds"):
+        return None
+    socket_path = socket_path or daemon_socket_path()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        request = json.dumps({
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "code_version": code_version(),
+        }).encode("utf-8")
+        socket.send_fds(sock, [b"\0"], [0, 1, 2])
+        sock.sendall(f"{len(request)}\n".encode("utf-8") + request)
+        stream = sock.makefile("rb")
+        reply = json.loads(stream.readline() or b"{}")
+    except (OSError, ValueError):
+        sock.close()
+        reply = {}
+
+    if not reply.get("attached"):
+        # There's no daemon yet, or it's running old code (or a different environment) and is shutting down.
+        # Start a fresh one for next time
+        sock.close()
+        start_daemon(socket_path)
+        return None
+
+    # The terminal sends CTRL-C (etc.) to us, not the session, so pass them on
+    def forward(signum, frame):
+        try:
+            sock.sendall(json.dumps({"signal": signum}).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+    forwarded = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]
+    previous = {signum: signal.signal(signum, forward) for signum in forwarded}
+
+    try:
+        for line in stream:
+            event = json.loads(line)
+            if "exit" in event:
+                return event["exit"]
+        # The session died without saying how
+        return 1
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        stream.close()
+        sock.close()
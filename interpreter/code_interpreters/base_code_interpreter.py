@@ -7,6 +7,12 @@ class BaseCodeInterpreter:
     def __init__(self):
         pass
 
+    def prestart(self):
+        """
+        Optionally starts up in the background, so the first .run doesn't have to wait
+        """
+        pass
+
     def run(self, code):
         pass
 
@@ -0,0 +1,99 @@
+"""
+A pool of code interpreters whose processes are already running.
+
+Starting an interpreter (Python with site packages, Node, R...) costs hundreds of milliseconds,
+which every session would otherwise pay the first time it uses a language.
+The pool spawns them ahead of time, hands a ready one to whoever asks, and refills itself in the background.
+"""
+
+import threading
+import atexit
+from .create_code_interpreter import create_code_interpreter
+
+class CodeInterpreterPool:
+    def __init__(self):
+        self.sizes = {}
+        self.ready = {}
+        self.lock = threading.Lock()
+
+    def warm(self, languages, size=1):
+        """
+        Keeps `size` started interpreters ready for each language in `languages`, spawning them in the background.
+        """
+        with self.lock:
+            for language in languages:
+                language = language.lower()
+                self.sizes[language] = max(size, self.sizes.get(language, 0))
+                self.ready.setdefault(language, [])
+
+        for language in languages:
+            self.refill(language.lower())
+
+    def get(self, language):
+        """
+        Returns a started interpreter for `language`, or a new one if none are ready.
+        """
+        language = language.lower()
+        code_interpreter = None
+
+        with self.lock:
+            ready = self.ready.get(language, [])
+            while ready and code_interpreter is None:
+                code_interpreter = ready.pop(0)
+                # It might have died (or been killed) while it was waiting
+                process = getattr(code_interpreter, "process", None)
+                if process and process.poll() is not None:
+                    code_interpreter = None
+
+        if language in self.sizes:
+            self.refill(language)
+
+        if code_interpreter is None:
+            code_interpreter = create_code_interpreter(language)
+        return code_interpreter
+
+    def refill(self, language):
+        threading.Thread(target=self.fill, args=(language,), daemon=True).start()
+
+    def fill(self, language):
+        while True:
+            with self.lock:
+                if len(self.ready.get(language, [])) >= self.sizes.get(language, 0):
+                    return
+
+            try:
+                code_interpreter = create_code_interpreter(language)
+                # (Not every interpreter has a process, HTML for example)
+                if hasattr(code_interpreter, "start_process"):
+                    code_interpreter.start_process()
+            except Exception:
+                # Unknown language, or it's not installed. Stop trying, get() will surface the error
+                with self.lock:
+                    self.sizes.pop(language, None)
+                return
+
+            with self.lock:
+                if language in self.ready and len(self.ready[language]) < self.sizes.get(language, 0):
+                    self.ready[language].append(code_interpreter)
+                    continue
+
+            # Another refill got there first
+            code_interpreter.terminate()
+            return
+
+    def terminate(self):
+        """
+        Stops warming, and terminates every interpreter that hasn't been handed out.
+        """
+        with self.lock:
+            ready = [code_interpreter for language in self.ready.values() for code_interpreter in language]
+            self.sizes = {}
+            self.ready = {}
+
+        for code_interpreter in ready:
+            code_interpreter.terminate()
+
+
+# Shared by every Interpreter in this process, so many short sessions draw from the same warm processes
+code_interpreter_pool = CodeInterpreterPool()
+atexit.register(code_interpreter_pool.terminate)
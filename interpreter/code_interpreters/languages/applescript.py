@@ -23,13 +23,17 @@ class AppleScript(SubprocessCodeInterpreter):
         code = "osascript -e " + code
 
         # Append end of execution indicator
-        code += '; echo "## end_of_execution ##"'
+        if self.control_fd is None:
+            code += '; echo "## end_of_execution ##"'
+        else:
+            code += f"; echo '{{\"end_of_execution\": true}}' >&{self.control_fd}"
         
         return code
 
     def add_active_line_indicators(self, code):
         """
         Adds log commands to indicate the active line of execution in the AppleScript.
+        (AppleScript can only `log` to stderr, so these stay in-band even when we have a control fd.)
         """
         modified_lines = []
         lines = code.split('\n')
@@ -58,4 +62,4 @@ class AppleScript(SubprocessCodeInterpreter):
         """
         Detects end of execution marker in the output.
         """
-        return "## end_of_execution ##" in line
\ No newline at end of file
+        return self.control_fd is None and "## end_of_execution ##" in line
\ No newline at end of file
@@ -1,4 +1,5 @@
 from ..subprocess_code_interpreter import SubprocessCodeInterpreter
+import json
 import re
 
 class JavaScript(SubprocessCodeInterpreter):
@@ -7,33 +8,41 @@ class JavaScript(SubprocessCodeInterpreter):
         self.start_cmd = "node -i"
         
     def preprocess_code(self, code):
-        return preprocess_javascript(code)
+        return preprocess_javascript(code, self.control_fd)
     
     def line_postprocessor(self, line):
         # Node's interactive REPL outputs a billion things
         # So we clean it up:
         if "Welcome to Node.js" in line:
             return None
-        if line.strip() in ["undefined", 'Type ".help" for more information.']:
+        # Remove the prompts (">" and "..."), which end up in front of the next output,
+        # or after output that didn't end with a newline
+        stripped = re.sub(r'^\s*((>|\.\.\.)( |$))+', '', line)
+        if not stripped.endswith("\n"):
+            stripped = re.sub(r'(> ?)+$', '', stripped)
+        # Then the echoed results, and what's left of a line that was only prompts
+        if stripped.strip() in ["undefined", 'Type ".help" for more information.']:
             return None
-        # Remove trailing ">"s
-        line = re.sub(r'^\s*(>\s*)+', '', line)
-        return line
+        if not line or (stripped != line and not stripped.strip()):
+            return None
+        return stripped
 
     def detect_active_line(self, line):
-        if "## active_line " in line:
+        if self.control_fd is None and "## active_line " in line:
             return int(line.split("## active_line ")[1].split(" ##")[0])
         return None
 
     def detect_end_of_execution(self, line):
-        return "## end_of_execution ##" in line
+        return self.control_fd is None and "## end_of_execution ##" in line
     
 
-def preprocess_javascript(code):
+def preprocess_javascript(code, control_fd=None):
     """
     Add active line markers
     Wrap in a try catch
     Add end of execution marker
+
+    If `control_fd` is given, markers are written there instead of being logged to stdout.
     """
 
     # Split code into lines
@@ -42,20 +51,71 @@ def preprocess_javascript(code):
 
     for i, line in enumerate(lines, 1):
         # Add active line print
-        processed_lines.append(f'console.log("## active_line {i} ##");')
+        if control_fd is None:
+            processed_lines.append(f'console.log("## active_line {i} ##");')
+        else:
+            # (void, so the REPL doesn't echo how many bytes it wrote after a line that has no value of its own)
+            processed_lines.append(f'void require("fs").writeSync({control_fd}, \'{{"active_line": {i}}}\\n\');')
         processed_lines.append(line)
 
     # Join lines to form the processed code
     processed_code = "\n".join(processed_lines)
 
-    # Wrap in a try-catch and add end of execution marker
+    # Add end of execution marker
+    if control_fd is None:
+        end_of_execution = 'console.log("## end_of_execution ##");'
+
+        # Wrap in a try-catch and add end of execution marker
+        return f"""
+try {{
+{processed_code}
+}} catch (e) {{
+    console.log(e);
+}}
+{end_of_execution}
+"""
+
     processed_code = f"""
 try {{
 {processed_code}
 }} catch (e) {{
     console.log(e);
 }}
-console.log("## end_of_execution ##");
 """
 
-    return processed_code
\ No newline at end of file
+    # The end marker is written outside the code we compile, so it's written even if it doesn't compile.
+    # Code that uses `await` (which only compiles in an async function) runs in one, and we write the marker when it's done.
+    # Writes to stdout/stderr pipes can be asynchronous, so we wait for them to be flushed before reporting that we're done.
+    # (setImmediate, so the REPL has echoed the result first)
+    runner = """(() => {
+        const vm = require('vm'), code = CODE;
+        const done = () => setImmediate(() => process.stdout.write('', () => process.stderr.write('', () => require('fs').writeSync(FD, '{"end_of_execution": true}\\n'))));
+        let script;
+        try {
+            script = new vm.Script(code);
+        } catch (e) {
+            let wrapped;
+            if (e instanceof SyntaxError && /\\bawait\\b/.test(code)) {
+                try { wrapped = new vm.Script('(async () => {' + code + '})()'); } catch (_) {}
+            }
+            if (!wrapped) {
+                console.log(e);
+                done();
+                return;
+            }
+            wrapped.runInThisContext().catch((e) => console.log(e)).finally(done);
+            return;
+        }
+        try {
+            return script.runInThisContext();
+        } catch (e) {
+            console.log(e);
+        } finally {
+            done();
+        }
+    })()"""
+    runner = runner.replace("FD", str(control_fd)).replace("CODE", json.dumps(processed_code))
+
+    # Sent to the REPL as one line, so it doesn't print a "..." prompt for every line of the code.
+    # It still echoes the result, unless that's undefined
+    return "(require('repl').repl || {}).ignoreUndefined = true; " + " ".join(line.strip() for line in runner.split("\n")) + "\n"
@@ -1,30 +1,194 @@
 import sys
+import os
+import json
+import platform
+import signal
+import socket
+import subprocess
+import threading
 from ..subprocess_code_interpreter import SubprocessCodeInterpreter
 import ast
 import re
 
+# Modules the zygote imports once, so every new Python interpreter starts with them already loaded.
+# Empty means no zygote: each interpreter is a fresh process. See `set_preload_modules`.
+preload_modules = []
+
+def set_preload_modules(modules):
+    global preload_modules
+    if list(modules) == preload_modules:
+        return
+    preload_modules = list(modules)
+
+    # Zygotes for other module lists won't be used again (interpreters they already started keep running)
+    with zygotes_lock:
+        for key in [key for key in zygotes if list(key) != preload_modules]:
+            zygotes.pop(key).terminate()
+
+
 class Python(SubprocessCodeInterpreter):
     def __init__(self):
         super().__init__()
-        self.start_cmd = sys.executable + " -i -q -u"
+
+        if platform.system() == 'Windows':
+            # Without a control fd we drive the interactive interpreter, and scrape its output for markers
+            self.start_cmd = sys.executable + " -i -q -u"
+        else:
+            # A small kernel that runs each block in a persistent namespace (see python_kernel.py)
+            self.start_cmd = [sys.executable, "-u", os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_kernel.py")]
+
+        # "sampled" reports the active line every `active_line_interval` seconds, at near-native speed.
+        # "statement" reports every statement as it runs, which is exact but slows down tight loops a lot.
+        # (Sampling needs the kernel, so without one we always fall back to "statement")
+        self.active_line_tracing = "sampled"
+        self.active_line_interval = 0.05
         
+    def spawn_process(self, start_cmd, control_fd):
+        if preload_modules:
+            return get_zygote(preload_modules).spawn(control_fd)
+        return super().spawn_process(start_cmd, control_fd)
+
     def preprocess_code(self, code):
-        return preprocess_python(code)
+        if self.control_fd is None:
+            return preprocess_python(code)
+        return frame_python(code, self.control_fd, self.active_line_tracing, self.active_line_interval)
     
     def line_postprocessor(self, line):
-        if re.match(r'^(\s*>>>\s*|\s*\.\.\.\s*)', line):
+        # (The kernel has no prompts)
+        if self.control_fd is None and re.match(r'^(\s*>>>\s*|\s*\.\.\.\s*)', line):
             return None
         return line
 
     def detect_active_line(self, line):
-        if "## active_line " in line:
+        if self.control_fd is None and "## active_line " in line:
             return int(line.split("## active_line ")[1].split(" ##")[0])
         return None
 
     def detect_end_of_execution(self, line):
-        return "## end_of_execution ##" in line
+        return self.control_fd is None and "## end_of_execution ##" in line
     
 
+class ZygoteProcess:
+    """
+    A child of the zygote. It isn't our child, so this is just enough of Popen for SubprocessCodeInterpreter.
+    """
+
+    def __init__(self, pid, stdin, stdout, stderr):
+        self.pid = pid
+        self.stdin = os.fdopen(stdin, "wb", buffering=0)
+        self.stdout = os.fdopen(stdout, "rb", buffering=0)
+        self.stderr = os.fdopen(stderr, "rb", buffering=0)
+
+    def poll(self):
+        try:
+            os.kill(self.pid, 0)
+            return None
+        except ProcessLookupError:
+            return -1
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        self.stdin.close()
+
+
+class PythonZygote:
+    """
+    Starts python_zygote.py, which imports `modules` once and then forks a python_kernel.py per interpreter.
+    """
+
+    def __init__(self, modules):
+        self.modules = list(modules)
+        self.process = None
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.sock:
+            self.sock.close()
+        self.sock, child_sock = socket.socketpair()
+        zygote_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_zygote.py")
+        try:
+            self.process = subprocess.Popen([sys.executable, "-u", zygote_path, str(child_sock.fileno())] + self.modules,
+                                            stdin=subprocess.DEVNULL,
+                                            pass_fds=(child_sock.fileno(),))
+        finally:
+            child_sock.close()
+
+    def spawn(self, control_fd):
+        """
+        Forks a new interpreter that writes control events to (its copy of) `control_fd`.
+        """
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        child_fds = [stdin_read, stdout_write, stderr_write]
+
+        try:
+            request = json.dumps({"cwd": os.getcwd(), "env": dict(os.environ)}).encode()
+            with self.lock:
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                socket.send_fds(self.sock, [b"\0"], child_fds + [control_fd])
+                self.sock.sendall(f"{len(request)}\n".encode() + request)
+
+                reply = b""
+                while not reply.endswith(b"\n"):
+                    chunk = self.sock.recv(64)
+                    if not chunk:
+                        raise RuntimeError("The Python zygote exited unexpectedly.")
+                    reply += chunk
+        except:
+            for fd in (stdin_write, stdout_read, stderr_read):
+                os.close(fd)
+            raise
+        finally:
+            # The child has its own copies now
+            for fd in child_fds:
+                os.close(fd)
+
+        return ZygoteProcess(int(reply), stdin_write, stdout_read, stderr_read)
+
+    def terminate(self):
+        if self.process:
+            self.process.terminate()
+        if self.sock:
+            self.sock.close()
+
+
+zygotes = {}
+zygotes_lock = threading.Lock()
+
+def get_zygote(modules):
+    """
+    Returns the (shared) zygote that preloads `modules`.
+    """
+    key = tuple(modules)
+    with zygotes_lock:
+        if key not in zygotes:
+            zygotes[key] = PythonZygote(modules)
+        return zygotes[key]
+
+
+def frame_python(code, control_fd, active_line_tracing="sampled", active_line_interval=0.05):
+    """
+    Wraps code in a length-prefixed frame for python_kernel.py.
+
+    The kernel runs it exactly as written, so there's nothing to rewrite
+    (no blank line or indentation problems, and no ast.unparse).
+    """
+    payload = json.dumps({
+        "code": code,
+        "control_fd": control_fd,
+        "active_line_tracing": active_line_tracing,
+        "active_line_interval": active_line_interval,
+    })
+    # (The length is in bytes. json.dumps escapes non-ASCII, so that's also the length in characters)
+    return f"{len(payload)}\n{payload}"
+
+
 def preprocess_python(code):
     """
     Add active line markers
@@ -0,0 +1,65 @@
+"""
+This file is the Python code interpreter's process (`python -u python_kernel.py`), not part of Open Interpreter.
+It can only use the standard library.
+
+It reads length-prefixed frames from stdin. Each frame is `<number of bytes>\n` followed by a JSON object:
+
+    {"code": "...", "control_fd": 5, "active_line_tracing": "sampled", "active_line_interval": 0.05}
+
+The code runs in a persistent `__main__` namespace. Its stdout and stderr are passed through untouched,
+while the active line, results, tracebacks and the end of execution are written to `control_fd` (see python_tracer.py).
+"""
+
+import json
+import os
+import sys
+import types
+
+# We're run as a script, so our own directory is at the front of sys.path.
+# Import what we need from it, then put back what the interactive interpreter would have (the cwd),
+# so the user's imports can't pick up Open Interpreter's files by accident
+from python_tracer import run_cell
+sys.path[0] = ""
+
+
+def read_frames(stream):
+    while True:
+        try:
+            header = stream.readline()
+        except KeyboardInterrupt:
+            # CTRL-C while we're idle. Nothing to interrupt
+            continue
+
+        if not header:
+            return
+        if not header.strip():
+            continue
+
+        yield json.loads(stream.read(int(header)))
+
+
+def main(control_fd=None):
+    """
+    Runs frames from stdin until it closes. If `control_fd` is given, events go there instead of the frames' `control_fd`.
+    """
+    # Read frames from a private copy of stdin, and point fd 0 at /dev/null,
+    # so nothing the user runs (input(), subprocesses...) can swallow our frames
+    frames = os.fdopen(os.dup(0), "rb")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    # Give the user's code a clean `__main__`, instead of this module's globals
+    main_module = types.ModuleType("__main__")
+    sys.modules["__main__"] = main_module
+
+    for request in read_frames(frames):
+        run_cell(request["code"],
+                 main_module.__dict__,
+                 request["control_fd"] if control_fd is None else control_fd,
+                 request.get("active_line_tracing", "sampled"),
+                 request.get("active_line_interval", 0.05))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+This file runs *inside* the Python code interpreter's process (see python_kernel.py), not inside Open Interpreter.
+It can only use the standard library.
+
+It runs a block of code and reports what happened as JSON lines on the control fd:
+the active line, the value of a trailing expression, any traceback, and the end of execution.
+
+By default the active line is sampled: instead of tracing every line, a background thread looks at
+the main thread's stack every `interval` seconds, so the user's code runs at full speed
+no matter how many lines it executes.
+"""
+
+import ast
+import json
+import linecache
+import os
+import sys
+import threading
+import time
+import traceback
+
+cell_count = 0
+
+
+def send(control_fd, event):
+    data = (json.dumps(event) + "\n").encode()
+    while data:
+        written = os.write(control_fd, data)
+        data = data[written:]
+
+
+class ActiveLineSampler:
+    """
+    Reports the line of `filename` that `thread_id` is currently running, at most once per `interval`.
+    """
+
+    def __init__(self, control_fd, interval=0.05):
+        self.control_fd = control_fd
+        self.interval = interval
+        self.filename = None
+        self.thread_id = None
+        self.last_line = None
+        self.active = threading.Event()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.sample_forever, daemon=True).start()
+
+    def start(self, filename):
+        with self.lock:
+            self.filename = filename
+            self.thread_id = threading.get_ident()
+            self.last_line = None
+            self.active.set()
+
+    def stop(self):
+        # Holding the lock means no report can be written after we return
+        with self.lock:
+            self.active.clear()
+
+    def sample_forever(self):
+        while True:
+            self.active.wait()
+            with self.lock:
+                if self.active.is_set():
+                    self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+
+        # Walk out from the innermost frame until we find one running the user's code
+        while frame is not None and frame.f_code.co_filename != self.filename:
+            frame = frame.f_back
+
+        if frame is not None and frame.f_lineno != self.last_line:
+            self.last_line = frame.f_lineno
+            send(self.control_fd, {"active_line": self.last_line})
+
+
+class StatementTracer:
+    """
+    Reports every line of `filename` as it runs, using sys.settrace. Exact, but slow for tight loops.
+    """
+
+    def __init__(self, control_fd):
+        self.control_fd = control_fd
+        self.filename = None
+
+    def start(self, filename):
+        self.filename = filename
+        sys.settrace(self.trace_calls)
+
+    def stop(self):
+        sys.settrace(None)
+
+    def trace_calls(self, frame, event, arg):
+        # Only trace frames running the user's code, everything else runs untraced
+        if frame.f_code.co_filename == self.filename:
+            return self.trace_lines
+        return None
+
+    def trace_lines(self, frame, event, arg):
+        if event == "line":
+            send(self.control_fd, {"active_line": frame.f_lineno})
+        return self.trace_lines
+
+
+samplers = {}
+
+
+def run_cell(code, namespace, control_fd, active_line_tracing="sampled", interval=0.05):
+    """
+    Runs `code` in `namespace`, then writes its result, any traceback and the end of execution to `control_fd`.
+    """
+    global cell_count
+    cell_count += 1
+
+    # A unique filename per block lets us find the user's frames,
+    # and lets tracebacks show the source of functions defined in earlier blocks
+    filename = f"<oi-cell-{cell_count}>"
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+    if active_line_tracing == "statement":
+        tracer = StatementTracer(control_fd)
+    else:
+        if control_fd not in samplers:
+            samplers[control_fd] = ActiveLineSampler(control_fd)
+        tracer = samplers[control_fd]
+        tracer.interval = interval
+
+    result = None
+    error = None
+
+    try:
+        tree = ast.parse(code, filename)
+
+        # Like the REPL, show the value of a trailing expression
+        last_expression = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last_expression = ast.Expression(tree.body.pop().value)
+
+        tracer.start(filename)
+        try:
+            exec(compile(tree, filename, "exec"), namespace)
+            if last_expression:
+                result = eval(compile(last_expression, filename, "eval"), namespace)
+        finally:
+            tracer.stop()
+    except SyntaxError as e:
+        error = "".join(traceback.format_exception_only(type(e), e))
+    except (Exception, KeyboardInterrupt) as e:
+        # Skip our own frame, so the traceback starts at the user's code
+        error = "".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if result is not None:
+        send(control_fd, {"output": repr(result)})
+    if error:
+        send(control_fd, {"output": error})
+    send(control_fd, {"end_of_execution": True})
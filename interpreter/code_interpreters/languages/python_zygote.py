@@ -0,0 +1,102 @@
+"""
+This file is a forkserver ("zygote") for the Python code interpreter, not part of Open Interpreter.
+It can only use the standard library.
+
+`python -u python_zygote.py <socket fd> <module> <module>...` imports the modules once, then waits on the socket.
+Each request is one byte carrying four fds (stdin, stdout, stderr and the control fd) followed by
+`<number of bytes>\n` and a JSON object with the cwd and environment to use.
+We fork a child that runs python_kernel.py on those fds, and reply with its pid as `<pid>\n`.
+
+Children start with the preloaded modules already imported, sharing their memory with us copy-on-write.
+"""
+
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+
+# Also sets sys.path[0] back to the cwd, see python_kernel.py
+import python_kernel
+
+
+def recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def recv_line(sock):
+    line = b""
+    while not line.endswith(b"\n"):
+        line += recv_exactly(sock, 1)
+    return line
+
+
+def run_child(fds, request):
+    stdin, stdout, stderr, control_fd = fds
+    os.dup2(stdin, 0)
+    os.dup2(stdout, 1)
+    os.dup2(stderr, 2)
+    for fd in (stdin, stdout, stderr):
+        os.close(fd)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+
+    # Undo what we changed for the zygote itself
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    python_kernel.main(control_fd)
+
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+
+    for name in sys.argv[2:]:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # Not installed (or broken). The user's code will find out when it imports it
+            pass
+
+    # CTRL-C goes to the whole process group, and is for the children, not us.
+    # Children are reaped automatically, so they never linger as zombies
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        try:
+            _, fds, _, _ = socket.recv_fds(sock, 1, 4)
+            if len(fds) != 4:
+                # Open Interpreter went away
+                return
+            request = json.loads(recv_exactly(sock, int(recv_line(sock))))
+        except EOFError:
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            try:
+                run_child(fds, request)
+            finally:
+                os._exit(0)
+
+        for fd in fds:
+            os.close(fd)
+        sock.sendall(f"{pid}\n".encode())
+
+
+if __name__ == "__main__":
+    main()
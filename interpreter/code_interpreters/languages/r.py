@@ -16,21 +16,40 @@ class R(SubprocessCodeInterpreter):
         lines = code.split("\n")
         processed_lines = []
 
+        if self.control_fd is None:
+            control = ""
+        else:
+            # Markers go to our control pipe instead of stdout
+            control = f', file="/dev/fd/{self.control_fd}", append=TRUE'
+
         for i, line in enumerate(lines, 1):
             # Add active line print
-            processed_lines.append(f'cat("## active_line {i} ##\\n");{line}')
+            if self.control_fd is None:
+                processed_lines.append(f'cat("## active_line {i} ##\\n");{line}')
+            else:
+                processed_lines.append(f'cat(\'{{"active_line": {i}}}\\n\'{control});{line}')
 
         # Join lines to form the processed code
         processed_code = "\n".join(processed_lines)
 
         # Wrap in a tryCatch for error handling and add end of execution marker
-        processed_code = f"""
+        if self.control_fd is None:
+            processed_code = f"""
 tryCatch({{
 {processed_code}
 }}, error=function(e){{
     cat("## execution_error ##\\n", conditionMessage(e), "\\n");
 }})
 cat("## end_of_execution ##\\n");
+"""
+        else:
+            processed_code = f"""
+tryCatch({{
+{processed_code}
+}}, error=function(e){{
+    cat(conditionMessage(e), "\\n");
+}})
+cat('{{"end_of_execution": true}}\\n'{control});
 """
         # Count the number of lines of processed_code
         # (R echoes all code back for some reason, but we can skip it if we track this!)
@@ -56,9 +75,11 @@ cat("## end_of_execution ##\\n");
         return line
 
     def detect_active_line(self, line):
-        if "## active_line " in line:
+        if self.control_fd is None and "## active_line " in line:
             return int(line.split("## active_line ")[1].split(" ##")[0])
         return None
 
     def detect_end_of_execution(self, line):
+        if self.control_fd is not None:
+            return False
         return "## end_of_execution ##" in line or "## execution_error ##" in line
@@ -14,47 +14,55 @@ class Shell(SubprocessCodeInterpreter):
             self.start_cmd = os.environ.get('SHELL', 'bash')
 
     def preprocess_code(self, code):
-        return preprocess_shell(code)
+        return preprocess_shell(code, self.control_fd)
     
     def line_postprocessor(self, line):
         return line
 
     def detect_active_line(self, line):
-        if "## active_line " in line:
+        if self.control_fd is None and "## active_line " in line:
             return int(line.split("## active_line ")[1].split(" ##")[0])
         return None
 
     def detect_end_of_execution(self, line):
-        return "## end_of_execution ##" in line
+        return self.control_fd is None and "## end_of_execution ##" in line
         
 
-def preprocess_shell(code):
+def preprocess_shell(code, control_fd=None):
     """
     Add active line markers
     Wrap in a try except (trap in shell)
     Add end of execution marker
+
+    If `control_fd` is given, markers are written there instead of being echoed to stdout.
     """
     
     # Add commands that tell us what the active line is
-    code = add_active_line_prints(code)
+    code = add_active_line_prints(code, control_fd)
     
     # Wrap in a trap for errors
     code = wrap_in_trap(code)
     
     # Add end command (we'll be listening for this so we know when it ends)
-    code += '\necho "## end_of_execution ##"'
+    if control_fd is None:
+        code += '\necho "## end_of_execution ##"'
+    else:
+        code += f"\necho '{{\"end_of_execution\": true}}' >&{control_fd}"
     
     return code
 
 
-def add_active_line_prints(code):
+def add_active_line_prints(code, control_fd=None):
     """
     Add echo statements indicating line numbers to a shell string.
     """
     lines = code.split('\n')
     for index, line in enumerate(lines):
         # Insert the echo command before the actual line
-        lines[index] = f'echo "## active_line {index + 1} ##"\n{line}'
+        if control_fd is None:
+            lines[index] = f'echo "## active_line {index + 1} ##"\n{line}'
+        else:
+            lines[index] = f"echo '{{\"active_line\": {index + 1}}}' >&{control_fd}\n{line}"
     return '\n'.join(lines)
 
 
@@ -0,0 +1,79 @@
+"""
+A queue between a code interpreter's output pump and `run()`, with a bound on how much unread output it holds.
+
+If a program prints faster than we consume, we keep the first `max_head_chars` of unread output and a rolling tail
+of the last `max_tail_chars`, and count what falls out of the middle. Or, with `backpressure`, `put()` waits for the
+consumer instead, which (as the pump stops reading) eventually blocks the program on its next write.
+Either way, memory stays flat no matter how much a program prints.
+"""
+
+import threading
+from collections import deque
+
+class OutputQueue:
+    def __init__(self, max_head_chars=1_000_000, max_tail_chars=100_000, backpressure=False):
+        self.max_head_chars = max_head_chars
+        self.max_tail_chars = max_tail_chars
+        self.backpressure = backpressure
+
+        self.head = deque()
+        self.head_chars = 0
+        self.tail = deque()
+        self.tail_chars = 0
+        self.dropped_lines = 0
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        """
+        Queues an item: `{"output": ...}`, another event, or `None` for the end of a run.
+        """
+        size = self.size(item)
+
+        with self.condition:
+            if self.backpressure:
+                # (An item bigger than the whole limit still gets through once the queue is empty)
+                while self.head and self.head_chars + size > self.max_head_chars:
+                    self.condition.wait()
+
+            # Once we've started a tail, everything goes there until it's been read, to keep the order
+            if self.backpressure or (not self.tail and self.head_chars + size <= self.max_head_chars):
+                self.head.append(item)
+                self.head_chars += size
+            else:
+                self.tail.append(item)
+                self.tail_chars += size
+                # Drop from the middle (the oldest part of the tail), but never the newest item
+                while self.tail_chars > self.max_tail_chars and len(self.tail) > 1:
+                    dropped = self.tail.popleft()
+                    self.tail_chars -= self.size(dropped)
+                    if dropped and "output" in dropped:
+                        self.dropped_lines += 1
+
+            self.condition.notify_all()
+
+    def get(self):
+        """
+        Waits for the next item. After the head, reports how much was dropped (if anything), then continues with the tail.
+        """
+        with self.condition:
+            while not (self.head or self.tail or self.dropped_lines):
+                self.condition.wait()
+
+            if self.head:
+                item = self.head.popleft()
+                self.head_chars -= self.size(item)
+            elif self.dropped_lines:
+                item = {"output": f"[Output truncated: skipped {self.dropped_lines} lines]\n"}
+                self.dropped_lines = 0
+            else:
+                item = self.tail.popleft()
+                self.tail_chars -= self.size(item)
+
+            self.condition.notify_all()
+            return item
+
+    def size(self, item):
+        if item and "output" in item:
+            return len(item["output"])
+        # Events are small, but not free
+        return 16
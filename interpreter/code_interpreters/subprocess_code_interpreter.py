@@ -2,37 +2,58 @@
 
 import subprocess
 import threading
-import queue
-import time
+import io
+import json
+import codecs
+import os
+import platform
+import selectors
 import traceback
 from .base_code_interpreter import BaseCodeInterpreter
+from .output_queue import OutputQueue
 
 class SubprocessCodeInterpreter(BaseCodeInterpreter):
     def __init__(self):
         self.start_cmd = ""
         self.process = None
         self.debug_mode = False
-        self.output_queue = queue.Queue()
+
+        # Limits on output we haven't yielded yet (see OutputQueue), so a chatty program can't eat all our memory.
+        # With `output_backpressure`, the program waits for us instead of its output being dropped
+        self.max_queued_output_chars = 1_000_000
+        self.max_queued_tail_chars = 100_000
+        self.output_backpressure = False
+        # Longer lines are split, so a program that never prints a newline can't grow a line forever
+        self.max_line_chars = 100_000
+
+        self.output_queue = self.create_output_queue()
         self.done = threading.Event()
+        self.start_lock = threading.Lock()
+        # Why prestart() couldn't start the process (run() reports it)
+        self.start_error = None
+
+        # File descriptor the child writes control events to (None means in-band markers)
+        self.control_fd = None
 
     def detect_active_line(self, line):
         return None
-    
+
     def detect_end_of_execution(self, line):
         return None
-    
+
     def line_postprocessor(self, line):
         return line
-    
+
     def preprocess_code(self, code):
         """
-        This needs to insert an end_of_execution marker of some kind,
-        which can be detected by detect_end_of_execution.
+        This needs to insert an end_of_execution marker of some kind.
+        If `self.control_fd` is set, write `{"end_of_execution": true}` to it as a JSON line.
+        Otherwise, print something to stdout which can be detected by detect_end_of_execution.
 
-        Optionally, add active line markers for detect_active_line.
+        Optionally, add active line markers the same way (`{"active_line": 3}` or detect_active_line).
         """
         return code
-    
+
     def terminate(self):
         self.process.terminate()
 
@@ -40,19 +61,79 @@ class SubprocessCodeInterpreter(BaseCodeInterpreter):
         if self.process:
             self.terminate()
 
-        self.process = subprocess.Popen(self.start_cmd.split(),
-                                        stdin=subprocess.PIPE,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        text=True,
-                                        bufsize=0,
-                                        universal_newlines=True)
-        threading.Thread(target=self.handle_stream_output,
-                            args=(self.process.stdout, False),
-                            daemon=True).start()
-        threading.Thread(target=self.handle_stream_output,
-                            args=(self.process.stderr, True),
-                            daemon=True).start()
+        # Fresh queue, so nothing left over from a dead process leaks into the next run
+        self.output_queue = self.create_output_queue()
+
+        # (A list lets the command contain paths with spaces)
+        start_cmd = self.start_cmd.split() if isinstance(self.start_cmd, str) else self.start_cmd
+
+        if platform.system() == 'Windows':
+            # We can't hand extra pipes to the child or select on pipes on Windows,
+            # so we fall back to in-band markers and a thread per stream
+            self.control_fd = None
+            self.process = subprocess.Popen(start_cmd,
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            bufsize=0)
+            threading.Thread(target=self.handle_stream_output,
+                                args=(self.process.stdout, False),
+                                daemon=True).start()
+            threading.Thread(target=self.handle_stream_output,
+                                args=(self.process.stderr, True),
+                                daemon=True).start()
+        else:
+            # The child reports active lines and the end of execution on its own pipe,
+            # so stdout and stderr only ever carry the user's output
+            control_read_fd, control_write_fd = os.pipe()
+            try:
+                self.process = self.spawn_process(start_cmd, control_write_fd)
+            except:
+                os.close(control_read_fd)
+                raise
+            finally:
+                os.close(control_write_fd)
+
+            # `pass_fds` keeps the descriptor number, so this is also the child's fd
+            self.control_fd = control_write_fd
+            threading.Thread(target=self.pump_output,
+                                args=(self.process, control_read_fd),
+                                daemon=True).start()
+
+    def create_output_queue(self):
+        return OutputQueue(self.max_queued_output_chars,
+                           self.max_queued_tail_chars,
+                           self.output_backpressure)
+
+    def spawn_process(self, start_cmd, control_fd):
+        """
+        Starts the child with `control_fd` open in it. Returns a Popen (or something that quacks like one).
+        """
+        return subprocess.Popen(start_cmd,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                bufsize=0,
+                                pass_fds=(control_fd,))
+
+    def prestart(self):
+        threading.Thread(target=self.ensure_process, kwargs={"background": True}, daemon=True).start()
+
+    def ensure_process(self, background=False):
+        # (The lock stops run() from starting a second process while prestart() is starting one)
+        with self.start_lock:
+            if self.start_error:
+                # prestart() already tried, so report why it failed (once) instead of trying again
+                start_error, self.start_error = self.start_error, None
+                raise start_error
+            if not self.process:
+                try:
+                    self.start_process()
+                except Exception as e:
+                    if not background:
+                        raise
+                    # (Not printed from this thread, where it'd land over the UI. run() yields it as output)
+                    self.start_error = e
 
     def run(self, code):
         retry_count = 0
@@ -60,22 +141,22 @@ class SubprocessCodeInterpreter(BaseCodeInterpreter):
 
         # Setup
         try:
-            code = self.preprocess_code(code)
-            if not self.process:
-                self.start_process()
+            self.ensure_process()
+            # (Preprocessing needs the process, as the markers it adds are written to our control fd)
+            processed_code = self.preprocess_code(code)
         except:
             yield {"output": traceback.format_exc()}
             return
-            
+
 
         while retry_count <= max_retries:
             if self.debug_mode:
-                print(f"Running code:\n{code}\n---")
+                print(f"Running code:\n{processed_code}\n---")
 
             self.done.clear()
 
             try:
-                self.process.stdin.write(code + "\n")
+                self.process.stdin.write((processed_code + "\n").encode())
                 self.process.stdin.flush()
                 break
             except:
@@ -88,51 +169,164 @@ class SubprocessCodeInterpreter(BaseCodeInterpreter):
                     yield {"output": "Restarting process."}
 
                 self.start_process()
+                processed_code = self.preprocess_code(code)
 
                 retry_count += 1
                 if retry_count > max_retries:
                     yield {"output": "Maximum retries reached. Could not execute code."}
                     return
 
+        # Block until the pump hands us something. `None` means execution is over.
         while True:
-            if not self.output_queue.empty():
-                yield self.output_queue.get()
-            else:
-                time.sleep(0.1)
+            output = self.output_queue.get()
+            if output is None:
+                break
+            yield output
+
+    def pump_output(self, process, control_fd):
+        """
+        Reads stdout, stderr and the control pipe from a single thread, waking up the moment any has data.
+
+        Control events are JSON lines like `{"active_line": 3}` or `{"end_of_execution": true}`.
+        Before handling the end of execution, we drain whatever the child already wrote to stdout and stderr,
+        so all of its output reaches the queue before `None` does, without any sleeps.
+        """
+        selector = selectors.DefaultSelector()
+        output_queue = self.output_queue
+
+        for fd, kind in ((process.stdout.fileno(), "stdout"), (process.stderr.fileno(), "stderr"), (control_fd, "control")):
+            # Non-blocking, because draining before a control event can empty a stream
+            # that select() already reported as ready
+            os.set_blocking(fd, False)
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True)
+            selector.register(fd, selectors.EVENT_READ,
+                              {"decoder": decoder, "buffer": "", "kind": kind})
+
+        def read(key):
+            """Reads whatever is available on a stream. Returns True if execution ended."""
+            state = key.data
             try:
-                output = self.output_queue.get(timeout=0.3)  # Waits for 0.3 seconds
-                yield output
-            except queue.Empty:
-                if self.done.is_set():
-                    # Try to yank 3 more times from it... maybe there's something in there...
-                    # (I don't know if this actually helps. Maybe we just need to yank 1 more time)
-                    for _ in range(3):
-                        if not self.output_queue.empty():
-                            yield self.output_queue.get()
-                        time.sleep(0.2)
-                    break
+                data = os.read(key.fd, 65536)
+            except BlockingIOError:
+                return False
+            if data:
+                state["buffer"] += state["decoder"].decode(data)
+            else:
+                # EOF. Flush any partial line and stop watching this stream
+                state["buffer"] += state["decoder"].decode(b"", final=True)
+                if state["buffer"]:
+                    state["buffer"] += "\n"
+                selector.unregister(key.fd)
 
-    def handle_stream_output(self, stream, is_error_stream):
-        for line in iter(stream.readline, ''):
-            if self.debug_mode:
-                print(f"Received output line:\n{line}\n---")
+            *lines, state["buffer"] = state["buffer"].split("\n")
 
-            line = self.line_postprocessor(line)
+            ended = False
+            for line in lines:
+                if state["kind"] == "control":
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "active_line" not in event:
+                        # Anything printed before this event (like output that didn't end a line, before a result) should reach the queue first
+                        drain(flush_partial_lines=True)
+                    if self.handle_control_event(event, output_queue):
+                        ended = True
+                elif self.handle_line(line + "\n", state["kind"] == "stderr", output_queue):
+                    ended = True
 
-            if line is None:
-                continue # `line = None` is the postprocessor's signal to discard completely
+            # Output that never ends a line. Pass it on in pieces (after the lines that came before it)
+            while len(state["buffer"]) > self.max_line_chars and state["kind"] != "control":
+                line, state["buffer"] = state["buffer"][:self.max_line_chars], state["buffer"][self.max_line_chars:]
+                self.handle_line(line, state["kind"] == "stderr", output_queue)
+            return ended
 
-            if self.detect_active_line(line):
-                active_line = self.detect_active_line(line)
-                self.output_queue.put({"active_line": active_line})
-            elif self.detect_end_of_execution(line):
-                self.output_queue.put({"active_line": None})
-                time.sleep(0.1)
+        def drain(flush_partial_lines=False):
+            """Reads everything the child has already written to stdout and stderr."""
+            while True:
+                ready = [key for key, _ in selector.select(timeout=0) if key.data["kind"] != "control"]
+                if not ready:
+                    break
+                for key in ready:
+                    read(key)
+
+            if flush_partial_lines:
+                # Output that doesn't end in a newline is still output
+                for key in list(selector.get_map().values()):
+                    state = key.data
+                    if state["kind"] != "control" and state["buffer"].strip():
+                        line, state["buffer"] = state["buffer"], ""
+                        self.handle_line(line, state["kind"] == "stderr", output_queue)
+
+        while selector.get_map():
+            ended = False
+            # Control events first, so an active line is reported before the output it produced
+            ready = sorted((key for key, _ in selector.select()), key=lambda key: key.data["kind"] != "control")
+            for key in ready:
+                if key.fd in selector.get_map() and read(key):
+                    ended = True
+
+            if ended:
+                # (Also covers executions that ended in-band, like a KeyboardInterrupt on stderr)
+                drain()
                 self.done.set()
-            elif is_error_stream and "KeyboardInterrupt" in line:
-                self.output_queue.put({"output": "KeyboardInterrupt"})
-                time.sleep(0.1)
+                output_queue.put(None)
+
+        # The process closed its streams (it exited or was terminated). Don't leave run() waiting.
+        selector.close()
+        os.close(control_fd)
+        self.done.set()
+        output_queue.put(None)
+
+    def handle_control_event(self, event, output_queue):
+        """
+        Puts a control event onto the queue. Returns True if it marked the end of execution.
+        """
+        if self.debug_mode:
+            print(f"Received control event:\n{event}\n---")
+
+        if event.get("end_of_execution"):
+            output_queue.put({"active_line": None})
+            return True
+
+        output_queue.put(event)
+        return False
+
+    def handle_line(self, line, is_error_stream, output_queue):
+        """
+        Puts a line of output onto the queue. Returns True if it marked the end of execution.
+        """
+        if self.debug_mode:
+            print(f"Received output line:\n{line}\n---")
+
+        line = self.line_postprocessor(line)
+
+        if line is None:
+            return False # `line = None` is the postprocessor's signal to discard completely
+
+        active_line = self.detect_active_line(line)
+        if active_line:
+            output_queue.put({"active_line": active_line})
+        elif self.detect_end_of_execution(line):
+            output_queue.put({"active_line": None})
+            return True
+        elif self.control_fd is None and is_error_stream and "KeyboardInterrupt" in line:
+            # (With a control fd, the end of execution is always reported there)
+            output_queue.put({"output": "KeyboardInterrupt"})
+            return True
+        else:
+            output_queue.put({"output": line})
+        return False
+
+    def handle_stream_output(self, stream, is_error_stream):
+        output_queue = self.output_queue
+        for line in io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8", errors="replace"):
+            if self.handle_line(line, is_error_stream, output_queue):
                 self.done.set()
-            else:
-                self.output_queue.put({"output": line})
+                output_queue.put(None)
+
+        if not is_error_stream:
+            self.done.set()
+            output_queue.put(None)
 
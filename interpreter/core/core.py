@@ -2,28 +2,40 @@
 This file defines the Interpreter class.
 It's the main file. `import interpreter` will import an instance of this class.
 """
-from interpreter.utils import display_markdown_message
-from ..cli.cli import cli
+
+# Only what library mode needs is imported up here, because `import interpreter` creates an Interpreter.
+# The LLM backends (litellm), the UI (rich, inquirer) and the CLI are imported when they're first used.
+# tests/test_import_time.py keeps an eye on this
+
 from ..utils.get_config import get_config
-from .respond import respond
-from ..llm.setup_llm import setup_llm
-from ..terminal_interface.terminal_interface import terminal_interface
-from ..terminal_interface.validate_llm_settings import validate_llm_settings
 import appdirs
 import os
 from datetime import datetime
 import json
-from ..utils.check_for_update import check_for_update
-from ..utils.display_markdown_message import display_markdown_message
+from ..utils.check_for_update import check_for_update_in_background, update_checks_disabled, newer
+from ..code_interpreters.code_interpreter_pool import code_interpreter_pool
+from ..code_interpreters.languages.python import set_preload_modules
+from ..utils.convert_to_openai_messages import OpenAIMessageCache
+from ..utils.prompt_prefix_metrics import PromptPrefixMetrics
+from ..rag.procedures_retriever import ProceduresRetriever, query_messages
+
+# The settings `setup_llm` uses. Changing one sets the LLM up again.
+# (Not debug_mode, so %debug doesn't reload a local model)
+llm_settings = ("local", "model", "temperature", "system_message", "context_window", "max_tokens",
+                "api_base", "api_key", "max_budget", "multiple_code_blocks")
 
 class Interpreter:
     def cli(self):
+        from ..cli.cli import cli
         cli(self)
 
     def __init__(self):
         # State
         self.messages = []
         self._code_interpreters = {}
+        self._message_cache = OpenAIMessageCache() # The OpenAI form of each message, so we only convert new ones
+        self.prompt_metrics = PromptPrefixMetrics() # How much of each prompt repeats the last one's start
+        self._procedures = ProceduresRetriever() # Looks procedures up in the background, and caches them
 
         # Settings
         self.local = False
@@ -31,6 +43,32 @@ class Interpreter:
         self.debug_mode = False
         self.max_output = 2000
 
+        # Run every code block in a response, instead of going back to the LLM after the first one
+        self.multiple_code_blocks = False
+
+        # Languages whose code interpreters are started ahead of time, so the first block doesn't wait for them
+        self.warm_languages = []
+        self.warm_pool_size = 1
+
+        # Python modules (like pandas) to import once in a forkserver, so new Python interpreters start with them loaded.
+        # Like the warm pool, this is shared by every Interpreter in the process
+        self.preload_modules = []
+
+        # A directory of procedure markdown files (one per file) to search offline, instead of Open Procedures
+        self.procedures_dir = os.path.join(appdirs.user_data_dir("Open Interpreter"), "procedures")
+
+        # How long (in seconds) a response waits for procedures before going on without them.
+        # Searching `procedures_dir` takes milliseconds. Asking Open Procedures (if it's empty) takes a round trip or two
+        self.procedures_deadline = 0.15
+        self.remote_procedures_deadline = 3
+
+        # Check PyPI (once a day, in the background) for a newer Open Interpreter
+        self.check_for_updates = True
+        self._update_check = None
+
+        # Run the CLI in a daemon that keeps all this loaded (starting one if needed), so `interpreter` starts instantly
+        self.use_daemon = False
+
         # Conversation history
         self.conversation_history = True
         self.conversation_filename = None
@@ -46,16 +84,35 @@ class Interpreter:
         self.api_key = None
         self.max_budget = None
         self._llm = None
+        self._llm_settings = None # What `_llm` was set up with
 
         # Load config defaults
         config = get_config()
         self.__dict__.update(config)
 
-        # Check for update
-        if not self.local:
-            # This should actually be pushed into the utility
-            if check_for_update():
+        # Start warming code interpreters and checking for updates in the background
+        # (Unless the CLI daemon runs our chats. Then we're just its client, and its sessions do this)
+        if not self.use_daemon:
+            self._warm_code_interpreters()
+            self._start_update_check()
+
+    def _warm_code_interpreters(self):
+        if self.preload_modules:
+            set_preload_modules(self.preload_modules)
+        if self.warm_languages:
+            code_interpreter_pool.warm(self.warm_languages, self.warm_pool_size)
+
+    def _start_update_check(self):
+        if not self.local and self.check_for_updates and not update_checks_disabled() and not self._update_check:
+            # (The notice is shown by the first chat that finds it done, so creating an Interpreter never prints or waits)
+            self._update_check = check_for_update_in_background()
+
+    def _display_update_notice(self):
+        if self._update_check and self._update_check.done():
+            if newer(self._update_check.result()):
+                from ..utils.display_markdown_message import display_markdown_message
                 display_markdown_message("> **A new version of Open Interpreter is available.**\n>Please run: `pip install --upgrade open-interpreter`\n\n---")
+            self._update_check = None
 
     def chat(self, message=None, display=True, stream=False):
         if stream:
@@ -69,20 +126,28 @@ class Interpreter:
     
     def _streaming_chat(self, message=None, display=True):
 
+        # (In case these were set after we were created)
+        self._warm_code_interpreters()
+
         # If we have a display,
         # we can validate our LLM settings w/ the user first
         if display:
+            from ..terminal_interface.validate_llm_settings import validate_llm_settings
+            self._display_update_notice()
             validate_llm_settings(self)
 
-        # Setup the LLM
-        if not self._llm:
+        # Setup the LLM (again, if its settings changed since)
+        if not self._llm or self._llm_settings != self.llm_settings():
+            from ..llm.setup_llm import setup_llm
             self._llm = setup_llm(self)
+            self._llm_settings = self.llm_settings()
 
         # Sometimes a little more code -> a much better experience!
         # Display mode actually runs interpreter.chat(display=False, stream=True) from within the terminal_interface.
         # wraps the vanilla .chat(display=False) generator in a display.
         # Quite different from the plain generator stuff. So redirect to that
         if display:
+            from ..terminal_interface.terminal_interface import terminal_interface
             yield from terminal_interface(self, message)
             return
         
@@ -91,6 +156,11 @@ class Interpreter:
             if message == "":
                 message = "No entry from user - please suggest something to enter"
             self.messages.append({"role": "user", "message": message})
+
+            # Start looking up procedures now, so they're (hopefully) ready by the time we build the system message
+            if not self.local:
+                self._procedures.prefetch(query_messages(self.messages), self.procedures_dir)
+
             yield from self._respond()
 
             # Save conversation
@@ -116,11 +186,20 @@ class Interpreter:
             return
         raise Exception("`interpreter.chat()` requires a display. Set `display=True` or pass a message into `interpreter.chat(message)`.")
 
+    def llm_settings(self):
+        return tuple(getattr(self, name) for name in llm_settings)
+
     def _respond(self):
+        from .respond import respond
         yield from respond(self)
             
+    def load(self, messages):
+        self.messages = messages
+        self._message_cache.clear()
+
     def reset(self):
         self.messages = []
+        self._message_cache.clear()
         self.conversation_filename = None
         for code_interpreter in self._code_interpreters.values():
             code_interpreter.terminate()
@@ -1,9 +1,8 @@
-from ..code_interpreters.create_code_interpreter import create_code_interpreter
-from ..utils.merge_deltas import merge_deltas
-from ..utils.get_user_info_string import get_user_info_string
+from ..code_interpreters.code_interpreter_pool import code_interpreter_pool
+from ..utils.streaming_message import StreamingMessage
+from ..utils.build_system_message import build_system_message, build_turn_context
 from ..utils.display_markdown_message import display_markdown_message
-from ..rag.get_relevant_procedures import get_relevant_procedures
-from ..utils.truncate_output import truncate_output
+from ..utils.output_accumulator import OutputAccumulator
 import traceback
 import litellm
 
@@ -17,46 +16,54 @@ def respond(interpreter):
 
         ### PREPARE MESSAGES ###
 
-        system_message = interpreter.system_message
-        
-        # Open Procedures is an open-source database of tiny, up-to-date coding tutorials.
-        # We can query it semantically and append relevant tutorials/procedures to our system message
-        if not interpreter.local:
-            try:
-                system_message += "\n\n" + get_relevant_procedures(interpreter.messages[-2:])
-            except:
-                # This can fail for odd SLL reasons. It's not necessary, so we can continue
-                pass
-        
-        # Add user info to system_message, like OS, CWD, etc
-        system_message += "\n\n" + get_user_info_string()
+        # The base prompt and user info first, and what changes between turns (CWD, relevant procedures) after the conversation,
+        # so everything up to the latest messages stays the same and can be cached
+        system_message = build_system_message(interpreter)
+        turn_context = build_turn_context(interpreter)
 
         # Create message object
         system_message = {"role": "system", "message": system_message}
 
         # Create the version of messages that we'll send to the LLM
-        messages_for_llm = interpreter.messages.copy()
-        messages_for_llm = [system_message] + messages_for_llm
-
-        # It's best to explicitly tell these LLMs when they don't get an output
-        for message in messages_for_llm:
-            if "output" in message and message["output"] == "":
-                message["output"] = "No output"
+        # (Empty outputs become "No output" when the LLM converts them, so we don't change interpreter.messages here)
+        messages_for_llm = [system_message] + interpreter.messages + [turn_context]
 
+        interpreter.prompt_metrics.record(system_message["message"], messages_for_llm[1:])
+        if interpreter.debug_mode:
+            print(interpreter.prompt_metrics)
 
         ### RUN THE LLM ###
 
         # Add a new message from the assistant to interpreter's "messages" attribute
         # (This doesn't go to the LLM. We fill this up w/ the LLM's response)
-        interpreter.messages.append({"role": "assistant"})
+        # (A StreamingMessage, so merging each chunk doesn't copy everything we've received so far)
+        first_message = len(interpreter.messages)
+        interpreter.messages.append(StreamingMessage({"role": "assistant"}))
 
         # Start putting chunks into the new message
         # + yielding chunks to the user
         try:
             for chunk in interpreter._llm(messages_for_llm):
 
+                # Another code block (or text after one) starts a new message, so each message has at most one block
+                if "message" in chunk and "code" in interpreter.messages[-1] and not chunk["message"].strip():
+                    # (Just the whitespace after a block)
+                    continue
+                if (("language" in chunk and "language" in interpreter.messages[-1])
+                    or ("message" in chunk and "code" in interpreter.messages[-1])):
+                    interpreter.messages[-1] = interpreter.messages[-1].materialize()
+                    interpreter.messages.append(StreamingMessage({"role": "assistant"}))
+
                 # Add chunk to the last message
-                interpreter.messages[-1] = merge_deltas(interpreter.messages[-1], chunk)
+                interpreter.messages[-1].merge(chunk)
+
+                # Start the code interpreter while the code is still streaming, so it's ready when the code is
+                if "language" in chunk:
+                    try:
+                        get_code_interpreter(interpreter, chunk["language"]).prestart()
+                    except:
+                        # (Unknown language, probably. That's reported when we try to run the code)
+                        pass
 
                 # This is a coding llm
                 # It will yield dict with either a message, language, or code (or language AND code)
@@ -78,31 +85,40 @@ def respond(interpreter):
                 raise Exception(f"{output}\n\nThere might be an issue with your API key(s).\n\nTo reset your OPENAI_API_KEY (for example):\n        Mac/Linux: 'export OPENAI_API_KEY=your-key-here',\n        Windows: 'setx OPENAI_API_KEY your-key-here' then restart terminal.\n\n")
             else:
                 raise
+        finally:
+            # Back to a plain dict, now that it's complete
+            if interpreter.messages and isinstance(interpreter.messages[-1], StreamingMessage):
+                interpreter.messages[-1] = interpreter.messages[-1].materialize()
         
         
         
         ### RUN CODE (if it's there) ###
 
-        if "code" in interpreter.messages[-1]:
+        # (With multiple_code_blocks, one response can hold several, each in its own message. We run them in order)
+        code_messages = [message for message in interpreter.messages[first_message:] if "code" in message]
+
+        if not code_messages:
+            # Doesn't want to run code. We're done
+            break
+
+        for message in code_messages:
             
             if interpreter.debug_mode:
-                print("Running code:", interpreter.messages[-1])
+                print("Running code:", message)
 
             try:
                 # What code do you want to run?
-                code = interpreter.messages[-1]["code"]
+                code = message["code"]
 
                 # Fix a common error where the LLM thinks it's in a Jupyter notebook
-                if interpreter.messages[-1]["language"] == "python" and code.startswith("!"):
+                if message["language"] == "python" and code.startswith("!"):
                     code = code[1:]
-                    interpreter.messages[-1]["code"] = code
-                    interpreter.messages[-1]["language"] = "shell"
+                    message["code"] = code
+                    message["language"] = "shell"
 
                 # Get a code interpreter to run it
-                language = interpreter.messages[-1]["language"]
-                if language not in interpreter._code_interpreters:
-                    interpreter._code_interpreters[language] = create_code_interpreter(language)
-                code_interpreter = interpreter._code_interpreters[language]
+                language = message["language"]
+                code_interpreter = get_code_interpreter(interpreter, language)
 
                 # Yield a message, such that the user can stop code execution if they want to
                 try:
@@ -110,30 +126,32 @@ def respond(interpreter):
                 except GeneratorExit:
                     # The user might exit here.
                     # We need to tell python what we (the generator) should do if they exit
-                    break
-
-                # Yield each line, also append it to last messages' output
-                interpreter.messages[-1]["output"] = ""
-                for line in code_interpreter.run(code):
-                    yield line
-                    if "output" in line:
-                        output = interpreter.messages[-1]["output"]
-                        output += "\n" + line["output"]
-
-                        # Truncate output
-                        output = truncate_output(output, interpreter.max_output)
+                    return
 
-                        interpreter.messages[-1]["output"] = output.strip()
+                # Yield each line, also append it to the message's output
+                # (The accumulator only keeps what fits in max_output, and builds the string once, at the end)
+                message["output"] = ""
+                output = OutputAccumulator(interpreter.max_output)
+                try:
+                    for line in code_interpreter.run(code):
+                        yield line
+                        if "output" in line:
+                            output.append(line["output"])
+                finally:
+                    message["output"] = output.text
 
             except:
                 output = traceback.format_exc()
                 yield {"output": output.strip()}
-                interpreter.messages[-1]["output"] = output.strip()
+                message["output"] = output.strip()
 
             yield {"end_of_execution": True}
 
-        else:
-            # Doesn't want to run code. We're done
-            break
+    return
+
 
-    return
\ No newline at end of file
+def get_code_interpreter(interpreter, language):
+    if language not in interpreter._code_interpreters:
+        # (Takes an already started one if we warmed this language)
+        interpreter._code_interpreters[language] = code_interpreter_pool.get(language)
+    return interpreter._code_interpreters[language]
@@ -1,20 +1,31 @@
 
 
 from ..utils.convert_to_openai_messages import convert_to_openai_messages
+from ..utils.build_system_message import fold_turn_context
 from .setup_text_llm import setup_text_llm
+from .fence_tokenizer import FenceTokenizer
 
-def convert_to_coding_llm(text_llm, debug_mode=False):
+def convert_to_coding_llm(text_llm, debug_mode=False, multiple_code_blocks=False, message_cache=None):
     """
     Takes a text_llm
     returns an OI Coding LLM (a generator that takes OI messages and streams deltas with `message`, 'language', and `code`).
+
+    By default we stop at the end of the first code block.
+    With `multiple_code_blocks`, the whole response streams through, and each code block starts with a `language` delta.
+
+    With a `message_cache` (an OpenAIMessageCache), messages converted on earlier turns aren't converted again.
     """
 
     def coding_llm(messages):
-        messages = convert_to_openai_messages(messages)
+        if message_cache:
+            messages = message_cache.convert(messages)
+        else:
+            messages = convert_to_openai_messages(messages)
+
+        # Providers (and our local prompt templates) don't all take a system message after the conversation
+        messages = fold_turn_context(messages)
 
-        inside_code_block = False
-        accumulated_block = ""
-        language = None
+        fences = FenceTokenizer(stop_after_block=not multiple_code_blocks)
         
         for chunk in text_llm(messages):
 
@@ -26,43 +37,13 @@ def convert_to_coding_llm(text_llm, debug_mode=False):
                 continue
             
             content = chunk['choices'][0]['delta'].get('content', "")
-            
-            accumulated_block += content
-            
-            # Did we just enter a code block?
-            if "```" in accumulated_block and not inside_code_block:
-                inside_code_block = True
-                accumulated_block = accumulated_block.split("```")[1]
 
-            # Did we just exit a code block?
-            if inside_code_block and "```" in accumulated_block:
-                return
-
-            # If we're in a code block,
-            if inside_code_block:
-                
-                # If we don't have a `language`, find it
-                if language is None and "\n" in accumulated_block:
-                    language = accumulated_block.split("\n")[0]
-
-                    # Default to python if not specified
-                    if language == "":
-                        language = "python"
+            yield from fences.feed(content or "")
 
-                    output = {"language": language}
+            # Did we just exit the code block?
+            if fences.state == "done":
+                return
 
-                    # If we recieved more than just the language in this chunk, send that
-                    if content.split("\n")[1]:
-                        output["code"] = content.split("\n")[1]
-                    
-                    yield output
-                
-                # If we do have a `language`, send the output as code
-                elif language:
-                    yield {"code": content}
-            
-            # If we're not in a code block, send the output as a message
-            if not inside_code_block:
-                yield {"message": content}
+        yield from fences.finish()
 
-    return coding_llm
\ No newline at end of file
+    return coding_llm
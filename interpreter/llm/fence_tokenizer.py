@@ -0,0 +1,138 @@
+import re
+
+# Runs of characters that can't start or end a fence
+plain_characters = re.compile(r"[^`\n]+")
+
+class FenceTokenizer:
+    """
+    Splits streamed Markdown into message text and fenced code blocks, one character at a time,
+    keeping its state between chunks (so a fence split across chunks is still a fence).
+
+    `feed` returns deltas like the ones an OI Coding LLM yields: `{"message": ...}`, `{"language": ...}` and `{"code": ...}`.
+    Every code block starts with its own `{"language": ...}` delta. `blocks` counts the code blocks that have closed.
+
+    A fence opens with three or more backticks anywhere in the text, followed by the language on the same line.
+    It closes with at least as many backticks at the start of a line.
+
+    With `stop_after_block`, everything after the first code block is ignored.
+    """
+
+    def __init__(self, stop_after_block=False):
+        self.stop_after_block = stop_after_block
+        self.state = "text"
+        self.backticks = 0 # Backticks we've seen but can't classify yet
+        self.fence_length = 0 # Backticks in the fence that opened the current block
+        self.info = "" # The rest of the opening fence's line
+        self.line_start = "" # Spaces and backticks at the start of the current line of code
+        self.at_line_start = True
+        self.blocks = 0
+        self.deltas = []
+
+    def feed(self, text):
+        self.deltas = []
+        i = 0
+        n = len(text)
+
+        while i < n and self.state != "done":
+            char = text[i]
+
+            if self.state == "text":
+                if char == "`":
+                    self.backticks += 1
+                    i += 1
+                    continue
+                if self.backticks >= 3:
+                    self.fence_length = self.backticks
+                    self.backticks = 0
+                    self.info = ""
+                    self.state = "info"
+                    continue
+                if self.backticks:
+                    self.emit("message", "`" * self.backticks)
+                    self.backticks = 0
+
+                match = plain_characters.match(text, i)
+                if match:
+                    self.emit("message", match.group())
+                    i = match.end()
+                else:
+                    self.emit("message", char)
+                    i += 1
+
+            elif self.state == "info":
+                if char == "\n":
+                    # Default to python if not specified
+                    self.emit("language", self.info.strip() or "python")
+                    self.state = "code"
+                    self.at_line_start = True
+                    self.line_start = ""
+                else:
+                    self.info += char
+                i += 1
+
+            elif self.state == "code":
+                if self.at_line_start:
+                    if char in " `" and not (char == " " and "`" in self.line_start):
+                        self.line_start += char
+                        i += 1
+                        continue
+                    if self.is_closing_fence(self.line_start):
+                        # (Whatever follows it on the line is dropped)
+                        self.line_start = ""
+                        self.blocks += 1
+                        self.state = "done" if self.stop_after_block else "after_fence"
+                        continue
+                    self.emit("code", self.line_start)
+                    self.line_start = ""
+                    self.at_line_start = False
+
+                if char == "\n":
+                    self.emit("code", char)
+                    self.at_line_start = True
+                    i += 1
+                    continue
+
+                match = plain_characters.match(text, i)
+                if match:
+                    self.emit("code", match.group())
+                    i = match.end()
+                else:
+                    self.emit("code", char)
+                    i += 1
+
+            elif self.state == "after_fence":
+                if char == "\n":
+                    self.state = "text"
+                i += 1
+
+        return self.deltas
+
+    def finish(self):
+        """
+        Flushes anything held back at the end of the stream (like backticks that turned out not to be a fence).
+        """
+        self.deltas = []
+        if self.state == "text" and self.backticks:
+            self.emit("message", "`" * self.backticks)
+        elif self.state == "code" and self.line_start:
+            if self.is_closing_fence(self.line_start):
+                self.blocks += 1
+            else:
+                self.emit("code", self.line_start)
+        self.backticks = 0
+        self.line_start = ""
+        return self.deltas
+
+    def is_closing_fence(self, line_start):
+        # (Indented by at most three spaces, like Markdown)
+        fence = line_start.lstrip(" ")
+        return len(fence) >= self.fence_length and len(line_start) - len(fence) <= 3
+
+    def emit(self, key, text):
+        if not text:
+            return
+        # Coalesce runs of the same kind, so we yield about as many deltas as we're fed chunks
+        if self.deltas and key != "language" and key in self.deltas[-1] and "language" not in self.deltas[-1]:
+            self.deltas[-1][key] += text
+        else:
+            self.deltas.append({key: text})
@@ -0,0 +1,89 @@
+import json
+import os
+import socket
+import sys
+import appdirs
+
+server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_model_server.py")
+
+def default_socket_path():
+    return os.path.join(appdirs.user_data_dir("Open Interpreter"), "local_models.sock")
+
+def server_command(socket_path=None, max_batch_size=None, max_batch_tokens=None, batch_wait=None):
+    """
+    The command that starts a local model server (in the foreground).
+    The rest are the server's options of the same names (None leaves the server's default).
+    """
+    command = [sys.executable, "-u", server_path, socket_path or default_socket_path()]
+    for name, value in [("max_batch_size", max_batch_size), ("max_batch_tokens", max_batch_tokens), ("batch_wait", batch_wait)]:
+        if value is not None:
+            command += [f"--{name}", str(value)]
+    return command
+
+
+class LocalModelClient:
+    """
+    Stands in for a llama_cpp.Llama, but runs completions on the local model server (local_model_server.py),
+    so the model is loaded once per machine instead of once per Open Interpreter.
+    """
+
+    def __init__(self, socket_path, model_path, n_ctx, n_gpu_layers):
+        self.socket_path = socket_path
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_gpu_layers = n_gpu_layers
+
+    def request(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            payload = json.dumps(request).encode("utf-8")
+            sock.sendall(f"{len(payload)}\n".encode("utf-8") + payload)
+            with sock.makefile("rb") as stream:
+                for line in stream:
+                    yield json.loads(line)
+        finally:
+            # (Closing early, like when the user presses CTRL-C, tells the server to stop generating)
+            sock.close()
+
+    def ping(self):
+        try:
+            return any(event.get("pong") for event in self.request({"type": "ping"}))
+        except (OSError, ValueError):
+            return False
+
+    def __call__(self, prompt, stream=True, temperature=0, stop=[], max_tokens=1000):
+        """
+        Yields completion chunks, like `Llama(prompt, stream=True)`.
+        """
+        request = {
+            "type": "completion",
+            "model_path": self.model_path,
+            "n_ctx": self.n_ctx,
+            "n_gpu_layers": self.n_gpu_layers,
+            "prompt": prompt,
+            "temperature": temperature,
+            "stop": stop,
+            "max_tokens": max_tokens,
+        }
+        for event in self.request(request):
+            if "error" in event:
+                raise Exception(f"The local model server failed:\n{event['error']}")
+            if event.get("done"):
+                return
+            yield event
+        raise Exception("The local model server closed the connection before the completion finished.")
+
+
+def connect_to_local_model_server(model_path, n_ctx, n_gpu_layers, socket_path=None):
+    """
+    Returns a LocalModelClient if a local model server is running, otherwise None.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    socket_path = socket_path or default_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+
+    client = LocalModelClient(socket_path, model_path, n_ctx, n_gpu_layers)
+    return client if client.ping() else None
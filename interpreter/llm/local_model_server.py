@@ -0,0 +1,537 @@
+"""
+This file is a local model server, not part of Open Interpreter.
+It can only use the standard library and llama_cpp.
+
+`python -u local_model_server.py <socket path>` listens on a Unix socket, and loads each GGUF model it's asked for once
+(memory mapped), so every `interpreter --local` on this machine shares one copy of it instead of loading their own.
+
+Each request is `<number of bytes>\n` followed by a JSON object:
+    {"type": "ping"}
+        Replies {"pong": true}.
+    {"type": "completion", "model_path": ..., "n_ctx": ..., "n_gpu_layers": ..., "prompt": ..., "temperature": ..., "stop": [...], "max_tokens": ...}
+        Streams completion chunks (like the ones `Llama(prompt, stream=True)` yields), one JSON object per line,
+        then {"done": true}. If something goes wrong, the last line is {"error": "..."} instead.
+
+By default, completions for the same model run one at a time, through Llama's own API (see SerialScheduler).
+With --max_batch_size above 1, they're batched instead: every step decodes the next token of every session that's generating
+(plus as much of new prompts as fits), so several sessions cost about as much as one. That uses llama_cpp's low-level API,
+which changes between versions, so it's opt-in. --max_batch_size, --max_batch_tokens and --batch_wait trade latency for
+throughput (see BatchScheduler).
+"""
+
+import argparse
+import codecs
+import collections
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+
+class Sequence:
+    """
+    One completion. The scheduler fills `events`, and the connection that asked for it reads them.
+    """
+
+    def __init__(self, prompt, temperature=0, stop=[], max_tokens=1000):
+        self.prompt = prompt
+        self.temperature = temperature
+        self.stop = [s for s in stop if s]
+        self.max_tokens = max_tokens
+        self.events = queue.Queue()
+        self.cancelled = False
+
+        # Set by the scheduler
+        self.slot = None
+        self.tokens = [] # The prompt, then what we've generated
+        self.evaluated = 0 # How many of `tokens` are in the KV cache
+        self.generated = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.held = "" # Text that might be the start of a stop string
+
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Slot:
+    """
+    A sequence id in the model's KV cache. It remembers the tokens it holds after its completion finishes,
+    so the next prompt that starts the same way (like the same conversation's next turn) only evaluates what's new.
+    """
+
+    def __init__(self, id):
+        self.id = id
+        self.tokens = []
+        self.last_used = 0
+
+
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class BatchScheduler:
+    """
+    Continuous batching: sessions join and leave the batch between steps, instead of waiting for each other's completions.
+
+    Each step decodes one token for every sequence that's generating (first, so they keep streaming),
+    then fills the rest of `max_batch_tokens` with chunks of prompts that are still being evaluated.
+
+    - `max_batch_size` is how many completions run at once (each gets `n_ctx` of the KV cache). More is more throughput,
+      but every step takes a bit longer, so each session streams a bit slower.
+    - `max_batch_tokens` caps the tokens per step. Lower keeps generating sessions smooth while a long prompt is evaluated.
+    - `batch_wait` is how long (in seconds) to wait for more requests before starting a step with free slots.
+      0 starts right away (lowest latency).
+    """
+
+    def __init__(self, engine, n_ctx, max_batch_size=4, max_batch_tokens=512, batch_wait=0.0):
+        self.engine = engine
+        self.n_ctx = n_ctx
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max(max_batch_tokens, max_batch_size)
+        self.batch_wait = batch_wait
+
+        self.slots = [Slot(i) for i in range(max_batch_size)]
+        self.waiting = collections.deque()
+        self.running = []
+        self.condition = threading.Condition()
+        self.steps = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt, temperature=0, stop=[], max_tokens=1000):
+        sequence = Sequence(prompt, temperature, stop, max_tokens)
+        with self.condition:
+            self.waiting.append(sequence)
+            self.condition.notify()
+        return sequence
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.waiting and not self.running:
+                    self.condition.wait()
+
+                # Trade a little latency for a fuller batch
+                if self.batch_wait and self.waiting and len(self.running) + len(self.waiting) < self.max_batch_size:
+                    deadline = time.monotonic() + self.batch_wait
+                    while len(self.running) + len(self.waiting) < self.max_batch_size and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+
+                waiting = []
+                while self.waiting and len(self.running) + len(waiting) < self.max_batch_size:
+                    waiting.append(self.waiting.popleft())
+
+            for sequence in waiting:
+                try:
+                    self.admit(sequence)
+                except Exception as e:
+                    sequence.events.put(e)
+
+            try:
+                self.step()
+            except Exception as e:
+                # Probably the model. Fail everything that was in this step, and keep serving
+                for sequence in list(self.running):
+                    sequence.events.put(e)
+                    self.finish(sequence, None)
+
+    def admit(self, sequence):
+        if sequence.cancelled:
+            return
+
+        tokens = self.engine.tokenize(sequence.prompt)
+        if not tokens:
+            raise ValueError("The prompt is empty")
+        if len(tokens) >= self.n_ctx:
+            raise ValueError(f"The prompt is {len(tokens)} tokens, but the context window is {self.n_ctx}")
+        sequence.max_tokens = min(sequence.max_tokens, self.n_ctx - len(tokens))
+
+        # The free slot that already holds most of this prompt (or, if none do, the one that's been free longest)
+        busy = {s.slot for s in self.running}
+        free = [slot for slot in self.slots if slot not in busy]
+        slot = max(free, key=lambda slot: (common_prefix_length(slot.tokens, tokens), -slot.last_used))
+
+        # Keep what matches. (Always evaluate at least the last prompt token, for its logits)
+        reused = min(common_prefix_length(slot.tokens, tokens), len(tokens) - 1)
+        self.engine.forget(slot.id, reused)
+        slot.tokens = tokens[:reused]
+
+        sequence.slot = slot
+        sequence.tokens = tokens
+        sequence.evaluated = reused
+        self.running.append(sequence)
+
+    def step(self):
+        for sequence in [s for s in self.running if s.cancelled]:
+            self.finish(sequence, None)
+        if not self.running:
+            return
+
+        # Generating sequences first (one token each), then chunks of prompts
+        entries = []
+        budget = self.max_batch_tokens
+        for sequence in sorted(self.running, key=lambda s: len(s.tokens) - s.evaluated):
+            pending = sequence.tokens[sequence.evaluated:sequence.evaluated + budget]
+            if not pending:
+                continue
+            entries.append((sequence, pending))
+            budget -= len(pending)
+            if not budget:
+                break
+
+        logits = self.engine.decode([
+            (sequence.slot.id, pending, sequence.evaluated, sequence.evaluated + len(pending) == len(sequence.tokens))
+            for sequence, pending in entries
+        ])
+        self.steps += 1
+
+        for (sequence, pending), row in zip(entries, logits):
+            sequence.evaluated += len(pending)
+            if row is not None:
+                self.add_token(sequence, self.engine.sample(row, sequence.temperature))
+
+    def add_token(self, sequence, token):
+        if token == self.engine.eos:
+            self.finish(sequence, "stop")
+            return
+
+        sequence.tokens.append(token)
+        sequence.generated += 1
+        sequence.held += sequence.decoder.decode(self.engine.detokenize(token))
+
+        for stop in sequence.stop:
+            if stop in sequence.held:
+                self.emit(sequence, sequence.held[:sequence.held.index(stop)])
+                sequence.held = ""
+                self.finish(sequence, "stop")
+                return
+
+        # Hold back anything that could be the start of a stop string
+        keep = 0
+        for stop in sequence.stop:
+            for length in range(min(len(stop) - 1, len(sequence.held)), keep, -1):
+                if sequence.held.endswith(stop[:length]):
+                    keep = length
+                    break
+        self.emit(sequence, sequence.held[:len(sequence.held) - keep])
+        sequence.held = sequence.held[len(sequence.held) - keep:]
+
+        if sequence.generated >= sequence.max_tokens:
+            self.finish(sequence, "length")
+
+    def emit(self, sequence, text, finish_reason=None):
+        if text or finish_reason:
+            sequence.events.put({
+                "object": "text_completion",
+                "created": int(time.time()),
+                "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}]
+            })
+
+    def finish(self, sequence, finish_reason):
+        if finish_reason:
+            self.emit(sequence, sequence.held + sequence.decoder.decode(b"", final=True), finish_reason)
+        sequence.events.put(None)
+
+        # The slot keeps what's in the KV cache, for the next prompt that starts the same way
+        sequence.slot.tokens = sequence.tokens[:sequence.evaluated]
+        sequence.slot.last_used = time.monotonic()
+        self.running.remove(sequence)
+
+
+class SerialScheduler:
+    """
+    Runs one completion at a time through Llama's own (public) API. Llama keeps the tokens it last evaluated,
+    so a conversation's next turn only evaluates what's new, as long as another session didn't go in between.
+    """
+
+    def __init__(self, llama):
+        self.llama = llama
+        self.waiting = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt, temperature=0, stop=[], max_tokens=1000):
+        sequence = Sequence(prompt, temperature, stop, max_tokens)
+        self.waiting.put(sequence)
+        return sequence
+
+    def run(self):
+        while True:
+            sequence = self.waiting.get()
+            try:
+                if not sequence.cancelled:
+                    for chunk in self.llama(sequence.prompt, stream=True, temperature=sequence.temperature,
+                                            stop=sequence.stop, max_tokens=sequence.max_tokens):
+                        if sequence.cancelled:
+                            break
+                        sequence.events.put(chunk)
+                sequence.events.put(None)
+            except Exception as e:
+                sequence.events.put(e)
+
+
+def load_llama(model_path, n_ctx, n_gpu_layers):
+    from llama_cpp import Llama
+    return Llama(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, use_mmap=True, verbose=False)
+
+
+class LlamaEngine:
+    """
+    Runs batches on a llama_cpp model, with each slot as its own sequence in one shared KV cache.
+    Only the scheduler's thread uses it.
+
+    This needs llama_cpp's low-level API (llama_batch_init, llama_decode, llama_kv_cache_seq_rm and llama_get_logits_ith),
+    which isn't stable between versions, so it's only used with --max_batch_size above 1.
+    """
+
+    def __init__(self, model_path, n_ctx, n_gpu_layers, max_batch_size, max_batch_tokens):
+        import numpy
+        import llama_cpp
+        from llama_cpp import Llama
+
+        missing = [name for name in ["llama_batch_init", "llama_decode", "llama_kv_cache_seq_rm", "llama_get_logits_ith"]
+                   if not hasattr(llama_cpp, name)]
+        if missing:
+            raise RuntimeError(f"This version of llama_cpp ({getattr(llama_cpp, '__version__', 'unknown')}) doesn't have "
+                               f"{', '.join(missing)}, which batching needs. Run the server with --max_batch_size 1")
+
+        self.numpy = numpy
+        self.llama_cpp = llama_cpp
+        self.llama = Llama(model_path=model_path, n_ctx=n_ctx * max_batch_size, n_batch=max_batch_tokens,
+                           n_gpu_layers=n_gpu_layers, use_mmap=True, verbose=False)
+        # (Older versions of llama_cpp have the context pointer as `ctx`. Newer ones keep it in a wrapper)
+        self.ctx = getattr(self.llama, "ctx", None) or getattr(getattr(self.llama, "_ctx", None), "ctx", None)
+        if self.ctx is None:
+            raise RuntimeError(f"Couldn't find the context of this version of llama_cpp ({getattr(llama_cpp, '__version__', 'unknown')}), "
+                               "which batching needs. Run the server with --max_batch_size 1")
+        self.n_vocab = self.llama.n_vocab()
+        self.eos = self.llama.token_eos()
+
+        self.multiple_seq_ids = "n_seq_id" in dict(llama_cpp.llama_batch._fields_)
+        if self.multiple_seq_ids:
+            self.batch = llama_cpp.llama_batch_init(max_batch_tokens, 0, 1)
+        else:
+            self.batch = llama_cpp.llama_batch_init(max_batch_tokens, 0)
+
+        self.random = numpy.random.default_rng()
+
+    def tokenize(self, text):
+        return self.llama.tokenize(text.encode("utf-8"))
+
+    def detokenize(self, token):
+        return self.llama.detokenize([token])
+
+    def forget(self, slot, start):
+        """
+        Drops this slot's tokens from position `start` on.
+        """
+        self.llama_cpp.llama_kv_cache_seq_rm(self.ctx, slot, start, -1)
+
+    def decode(self, entries):
+        """
+        `entries` are (slot, tokens, position of the first token, whether we want logits).
+        Returns the logits after each entry's last token (or None where we didn't want them).
+        """
+        batch = self.batch
+        rows = []
+        n = 0
+        for slot, tokens, start, want_logits in entries:
+            for i, token in enumerate(tokens):
+                batch.token[n] = token
+                batch.pos[n] = start + i
+                if self.multiple_seq_ids:
+                    batch.n_seq_id[n] = 1
+                    batch.seq_id[n][0] = slot
+                else:
+                    batch.seq_id[n] = slot
+                batch.logits[n] = want_logits and i == len(tokens) - 1
+                n += 1
+            rows.append(n - 1 if want_logits else None)
+        batch.n_tokens = n
+
+        result = self.llama_cpp.llama_decode(self.ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed ({result})")
+
+        return [None if row is None else
+                self.numpy.ctypeslib.as_array(self.llama_cpp.llama_get_logits_ith(self.ctx, row), shape=(self.n_vocab,)).copy()
+                for row in rows]
+
+    def sample(self, logits, temperature, top_k=40, top_p=0.95):
+        # (The same defaults as Llama's completions)
+        if temperature <= 0:
+            return int(logits.argmax())
+        candidates = self.numpy.argpartition(-logits, top_k)[:top_k]
+        candidates = candidates[self.numpy.argsort(-logits[candidates])]
+        probabilities = self.numpy.exp((logits[candidates] - logits[candidates[0]]) / temperature)
+        probabilities /= probabilities.sum()
+        keep = int(self.numpy.searchsorted(self.numpy.cumsum(probabilities), top_p)) + 1
+        probabilities = probabilities[:keep] / probabilities[:keep].sum()
+        return int(self.random.choice(candidates[:keep], p=probabilities))
+
+
+class ModelCache:
+    """
+    The models we've loaded, by (model path, context size, GPU layers), each with its own scheduler.
+    A BatchScheduler if `max_batch_size` is above 1, otherwise a SerialScheduler.
+    """
+
+    def __init__(self, create_engine=LlamaEngine, create_llama=load_llama, max_batch_size=1, max_batch_tokens=512, batch_wait=0.0):
+        self.create_engine = create_engine
+        self.create_llama = create_llama
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_wait = batch_wait
+        self.schedulers = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_path, n_ctx, n_gpu_layers):
+        key = (os.path.realpath(model_path), n_ctx, n_gpu_layers)
+        with self.lock:
+            if key not in self.schedulers:
+                if self.max_batch_size > 1:
+                    engine = self.create_engine(model_path, n_ctx, n_gpu_layers, self.max_batch_size, self.max_batch_tokens)
+                    self.schedulers[key] = BatchScheduler(engine, n_ctx, self.max_batch_size, self.max_batch_tokens, self.batch_wait)
+                else:
+                    self.schedulers[key] = SerialScheduler(self.create_llama(model_path, n_ctx, n_gpu_layers))
+            return self.schedulers[key]
+
+
+def read_request(stream):
+    header = stream.readline()
+    if not header:
+        return None
+    return json.loads(stream.read(int(header)))
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def send(self, event):
+        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        request = read_request(self.rfile)
+        if request is None:
+            return
+
+        if request.get("type") == "ping":
+            self.send({"pong": True})
+            return
+
+        try:
+            scheduler = self.server.models.get(request["model_path"], request["n_ctx"], request["n_gpu_layers"])
+        except Exception:
+            self.send({"error": traceback.format_exc()})
+            return
+
+        sequence = scheduler.submit(
+            request["prompt"],
+            temperature=request.get("temperature", 0),
+            stop=request.get("stop", []),
+            max_tokens=request.get("max_tokens", 1000)
+        )
+        try:
+            for chunk in sequence:
+                self.send(chunk)
+            self.send({"done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away (like on CTRL-C). Stop generating for it
+            pass
+        except Exception:
+            try:
+                self.send({"error": traceback.format_exc()})
+            except OSError:
+                pass
+        finally:
+            sequence.cancel()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, models):
+        self.models = models
+        super().__init__(socket_path, Handler)
+
+
+def is_running(socket_path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def create_server(socket_path, models):
+    """
+    Returns a Server listening on `socket_path`, or None if one already is.
+    """
+    if is_running(socket_path):
+        return None
+    if os.path.exists(socket_path):
+        # Left behind by one that didn't shut down cleanly
+        os.unlink(socket_path)
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    # Only this user can connect
+    old_umask = os.umask(0o077)
+    try:
+        return Server(socket_path, models)
+    finally:
+        os.umask(old_umask)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open Interpreter's local model server")
+    parser.add_argument("socket_path")
+    parser.add_argument("--max_batch_size", type=int, default=1, help="completions to run at once, per model (above 1 batches them, with llama_cpp's low-level API)")
+    parser.add_argument("--max_batch_tokens", type=int, default=512, help="tokens to evaluate per step, when batching")
+    parser.add_argument("--batch_wait", type=float, default=0, help="milliseconds to wait for a fuller batch, when batching")
+    args = parser.parse_args()
+
+    models = ModelCache(max_batch_size=args.max_batch_size, max_batch_tokens=args.max_batch_tokens, batch_wait=args.batch_wait / 1000)
+    server = create_server(args.socket_path, models)
+    if server is None:
+        print(f"A local model server is already running at {args.socket_path}")
+        return
+
+    # (So the socket is removed when we're terminated, too)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"Serving local models at {args.socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,9 @@ def setup_llm(interpreter):
         coding_llm = setup_openai_coding_llm(interpreter)
     else:
         text_llm = setup_text_llm(interpreter)
-        coding_llm = convert_to_coding_llm(text_llm, debug_mode=interpreter.debug_mode)
+        coding_llm = convert_to_coding_llm(text_llm,
+                                           debug_mode=interpreter.debug_mode,
+                                           multiple_code_blocks=interpreter.multiple_code_blocks,
+                                           message_cache=interpreter._message_cache)
 
     return coding_llm
\ No newline at end of file
@@ -14,14 +14,16 @@ from rich import print as rprint
 from rich.markdown import Markdown
 import os
 import shutil
-import tokentrim as tt
+from ..utils.trim_messages import PrefixStableTrimmer
+from ..utils.build_system_message import context_heading
+from .local_model_client import connect_to_local_model_server
 from huggingface_hub import list_files_info, hf_hub_download
 
 
-def setup_local_text_llm(interpreter):
+DEFAULT_CONTEXT_WINDOW = 2000
+DEFAULT_MAX_TOKENS = 1000
 
-    DEFAULT_CONTEXT_WINDOW = 2000
-    DEFAULT_MAX_TOKENS = 1000
+def setup_local_text_llm(interpreter):
 
     repo_id = interpreter.model.split("huggingface/")[1]
 
@@ -120,7 +122,11 @@ def setup_local_text_llm(interpreter):
             
             if len(split_files) > 1:
                 # Download splits
+                # (Except ones an interrupted combine already used, and deleted)
+                already_combined = combined_splits(default_path, selected_model)
                 for split_file in split_files:
+                    if split_file in already_combined:
+                        continue
                     # Do we already have a file split downloaded?
                     split_path = os.path.join(default_path, split_file)
                     if os.path.exists(split_path):
@@ -134,7 +140,8 @@ def setup_local_text_llm(interpreter):
                         resume_download=True)
                 
                 # Combine and delete splits
-                actually_combine_files(default_path, selected_model, split_files)
+                actually_combine_files(default_path, selected_model, split_files,
+                                       expected={model["filename"]: model for model in raw_models})
             else:
                 hf_hub_download(
                     repo_id=repo_id,
@@ -151,6 +158,18 @@ def setup_local_text_llm(interpreter):
 
     # This is helpful for folks looking to delete corrupted ones and such
     rprint(Markdown(f"Model found at `{model_path}`"))
+
+    if interpreter.context_window:
+        n_ctx = interpreter.context_window
+    else:
+        n_ctx = DEFAULT_CONTEXT_WINDOW
+
+    # If a local model server is running (`interpreter --serve_local_models`), it loads the model once for every session on this machine.
+    # So we don't load (or even need) our own copy
+    server = connect_to_local_model_server(os.path.abspath(model_path), n_ctx, n_gpu_layers)
+    if server:
+        rprint(Markdown(f"Using the local model server at `{server.socket_path}`"))
+        return create_local_text_llm(interpreter, server)
   
     try:
         from llama_cpp import Llama
@@ -241,12 +260,22 @@ def setup_local_text_llm(interpreter):
         'n_gpu_layers': n_gpu_layers,
         'verbose': interpreter.debug_mode
     }
-    if interpreter.context_window:
-        params['n_ctx'] = interpreter.context_window
-    else:
-        params['n_ctx'] = DEFAULT_CONTEXT_WINDOW
+    params['n_ctx'] = n_ctx
     llama_2 = Llama(**params)
 
+    return create_local_text_llm(interpreter, llama_2)
+
+def create_local_text_llm(interpreter, llama_2):
+    """
+    Returns a text LLM that runs on `llama_2`, a llama_cpp.Llama (or a LocalModelClient, which works the same way).
+
+    llama.cpp keeps the tokens it last evaluated, and only evaluates a prompt from where it stops matching them.
+    So we keep the start of the prompt the same between turns: the system message doesn't change,
+    and we trim old messages in batches (not one every turn), so the rest of the conversation doesn't shift.
+    """
+
+    trimmer = PrefixStableTrimmer()
+
     def local_text_llm(messages):
         """
         Returns a generator
@@ -266,24 +295,33 @@ def setup_local_text_llm(interpreter):
             max_tokens = DEFAULT_MAX_TOKENS
         
 
-        messages = tt.trim(
+        messages = trimmer.trim(
             messages,
             max_tokens=(context_window-max_tokens-25),
             system_message=system_message
         )
 
         prompt = messages_to_prompt(messages, interpreter.model)
+        # (Without the turn context that was added to it, see fold_turn_context)
+        latest = messages[-1]["content"].partition("\n\n" + context_heading)[0]
         # Lmao i can't believe this works (it does need this btw)
         if messages[-1]["role"] != "function":
-            if messages[-1]["content"].lower() not in ["hello", "hi", "hey", "helo", "hii"]: # :)
+            if latest.lower() not in ["hello", "hi", "hey", "helo", "hii"]: # :)
                 prompt += """Let's explore this. By the way, I can run code on your machine by writing the code in a markdown code block. This works if I put a newline after ```shell, ```javascript, ```python, ```R, and ```applescript then write code. I'm going to try to do this for your task, and I'll put the *correct* language after the "```" now. Anyway, """
-        elif messages[-1]["role"] == "function" and messages[-1]["content"] != "No output":
+        elif messages[-1]["role"] == "function" and latest != "No output":
             prompt += "Given the output of the code I just ran, "
-        elif messages[-1]["role"] == "function" and messages[-1]["content"] == "No output":
+        elif messages[-1]["role"] == "function" and latest == "No output":
             prompt += "Given the fact that the code I just ran produced no output, "
 
         if interpreter.debug_mode:
             print("Prompt:", prompt)
+            try:
+                # How much of this prompt llama.cpp already has evaluated
+                tokens = llama_2.tokenize(prompt.encode("utf-8"))
+                reused = llama_2.longest_token_prefix(llama_2._input_ids.tolist(), tokens)
+                print(f"Reusing {reused} of {len(tokens)} prompt tokens")
+            except:
+                pass
 
         first_token = True
 
@@ -390,6 +428,8 @@ def confirm_action(message):
 
 
 import os
+import json
+import hashlib
 import inquirer
 from huggingface_hub import list_files_info, hf_hub_download, login
 from typing import Dict, List, Union
@@ -421,10 +461,14 @@ def list_gguf_files(repo_id: str) -> List[Dict[str, Union[str, float]]]:
     for file in gguf_files:
         size_in_gb = file.size / (1024**3)
         filename = file.rfilename
+        lfs = file.lfs or {}
         result.append({
             "filename": filename,
             "Size": size_in_gb,
             "RAM": size_in_gb + 2.5,
+            # Exact, so we can check splits as we combine them
+            "bytes": file.size,
+            "sha256": lfs.get("sha256") if isinstance(lfs, dict) else getattr(lfs, "sha256", None),
         })
 
     return result
@@ -458,22 +502,120 @@ def group_and_combine_splits(models: List[Dict[str, Union[str, float]]]) -> List
     return list(grouped_files.values())
 
 
-def actually_combine_files(default_path: str, base_name: str, files: List[str]) -> None:
+COMBINE_CHUNK_SIZE = 64 * 1024 * 1024
+
+def combine_journal_path(default_path: str, base_name: str) -> str:
+    return os.path.join(default_path, base_name + ".combine.json")
+
+def combined_splits(default_path: str, base_name: str) -> List[str]:
+    """
+    The splits an interrupted `actually_combine_files` already combined (and deleted), so they don't need downloading again.
+    """
+    try:
+        with open(combine_journal_path(default_path, base_name)) as f:
+            return json.load(f)["combined"]
+    except (OSError, ValueError, KeyError):
+        return []
+
+def copy_range(infile, outfile, size: int, digest=None) -> None:
+    """
+    Appends `size` bytes of `infile` to `outfile` in bounded chunks, so memory use doesn't depend on the file's size.
+
+    If we need a checksum we have to read the data anyway, so we read it into one reused buffer, hash it and write it.
+    Otherwise the kernel copies it for us (copy_file_range, or sendfile), without it passing through Python at all.
+    """
+    in_fd, out_fd = infile.fileno(), outfile.fileno()
+    remaining = size
+
+    if digest is None:
+        for copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+            if copy is None:
+                continue
+            try:
+                while remaining:
+                    if copy is os.sendfile:
+                        copied = os.sendfile(out_fd, in_fd, None, min(remaining, COMBINE_CHUNK_SIZE))
+                    else:
+                        copied = copy(in_fd, out_fd, min(remaining, COMBINE_CHUNK_SIZE))
+                    if copied == 0:
+                        raise ValueError(f"{infile.name} ended {remaining} bytes early")
+                    remaining -= copied
+                return
+            except OSError:
+                # Not supported for these files (like across filesystems on older kernels, or sendfile to a file on macOS).
+                # Carry on from wherever it got to
+                continue
+
+    buffer = memoryview(bytearray(min(COMBINE_CHUNK_SIZE, max(remaining, 1))))
+    while remaining:
+        read = infile.readinto(buffer[:min(remaining, len(buffer))])
+        if not read:
+            raise ValueError(f"{infile.name} ended {remaining} bytes early")
+        if digest is not None:
+            digest.update(buffer[:read])
+        written = 0
+        while written < read:
+            written += outfile.write(buffer[written:read])
+        remaining -= read
+
+def actually_combine_files(default_path: str, base_name: str, files: List[str], expected: Dict[str, Dict] = {}) -> None:
     """
     Combines files together and deletes the original split files.
 
+    Each split is streamed into `<base_name>.partial` (see copy_range), checked against its size and sha256 in `expected`
+    (filename -> {"bytes", "sha256"}, like list_gguf_files returns) if we have them, then deleted.
+    A journal records each split once it's safely written, so if we're interrupted, running this again picks up where we left off.
+    The combined file only gets its real name once every split is in it.
+
     :param base_name: The base name for the combined file.
     :param files: List of files to be combined.
     """
-    files.sort()    
+    files = sorted(files)
     base_path = os.path.join(default_path, base_name)
-    with open(base_path, 'wb') as outfile:
-        for file in files:
+    partial_path = base_path + ".partial"
+    journal_path = combine_journal_path(default_path, base_name)
+
+    combined = combined_splits(default_path, base_name)
+    if combined != files[:len(combined)] or not os.path.exists(partial_path):
+        combined = []
+
+    # (Unbuffered, because copy_range also writes to it through its file descriptor)
+    with open(partial_path, "r+b" if combined else "wb", buffering=0) as outfile:
+        # Drop anything written after the last split we finished
+        offset = 0
+        if combined:
+            with open(journal_path) as f:
+                offset = json.load(f)["bytes"]
+        outfile.truncate(offset)
+        outfile.seek(offset)
+
+        for file in files[len(combined):]:
             file_path = os.path.join(default_path, file)
-            with open(file_path, 'rb') as infile:
-                outfile.write(infile.read())
+            size = os.path.getsize(file_path)
+            details = expected.get(file, {})
+
+            if details.get("bytes") is not None and size != details["bytes"]:
+                raise ValueError(f"{file} is {size} bytes, but should be {details['bytes']}. Delete it and download it again.")
+
+            digest = hashlib.sha256() if details.get("sha256") else None
+            with open(file_path, "rb", buffering=0) as infile:
+                copy_range(infile, outfile, size, digest)
+
+            if digest is not None and digest.hexdigest() != details["sha256"]:
+                raise ValueError(f"{file} doesn't match its checksum. Delete it and download it again.")
+
+            # Only record the split (and delete it) once it's on disk
+            os.fsync(outfile.fileno())
+            offset += size
+            combined.append(file)
+            with open(journal_path + ".tmp", "w") as f:
+                json.dump({"combined": combined, "bytes": offset}, f)
+            os.replace(journal_path + ".tmp", journal_path)
             os.remove(file_path)
 
+    os.replace(partial_path, base_path)
+    os.remove(journal_path)
+
 def format_quality_choice(model, name_override = None) -> str:
     """
     Formats the model choice for display in the inquirer prompt.
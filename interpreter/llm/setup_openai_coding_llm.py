@@ -1,9 +1,8 @@
 import litellm
-from ..utils.merge_deltas import merge_deltas
-from ..utils.parse_partial_json import parse_partial_json
-from ..utils.convert_to_openai_messages import convert_to_openai_messages
+from ..utils.streaming_json_parser import StreamingJsonParser
 from ..utils.display_markdown_message import display_markdown_message
-import tokentrim as tt
+from ..utils.trim_messages import trim_messages
+from ..utils.build_system_message import fold_turn_context
 
 
 function_schema = {
@@ -37,7 +36,11 @@ def setup_openai_coding_llm(interpreter):
     def coding_llm(messages):
         
         # Convert messages
-        messages = convert_to_openai_messages(messages)
+        # (Only the new ones. The rest were converted on earlier turns)
+        messages = interpreter._message_cache.convert(messages)
+
+        # Not every provider LiteLLM sends this to takes a system message after the conversation
+        messages = fold_turn_context(messages)
 
         # Add OpenAI's recommended function message
         messages[0]["content"] += "\n\nOnly use the function you have been provided with."
@@ -49,16 +52,16 @@ def setup_openai_coding_llm(interpreter):
 
         # Trim messages, preserving the system_message
         try:
-            messages = tt.trim(messages=messages, system_message=system_message, model=interpreter.model)
+            messages = trim_messages(messages=messages, system_message=system_message, model=interpreter.model)
         except:
             if interpreter.context_window:
-                messages = tt.trim(messages=messages, system_message=system_message, max_tokens=interpreter.context_window)
+                messages = trim_messages(messages=messages, system_message=system_message, max_tokens=interpreter.context_window)
             else:
                 display_markdown_message("""
                 **We were unable to determine the context window of this model.** Defaulting to 3000.
                 If your model can handle more, run `interpreter --context_window {token limit}` or `interpreter.context_window = {token limit}`.
                 """)
-                messages = tt.trim(messages=messages, system_message=system_message, max_tokens=3000)
+                messages = trim_messages(messages=messages, system_message=system_message, max_tokens=3000)
 
         if interpreter.debug_mode:
             print("Sending this to the OpenAI LLM:", messages)
@@ -93,9 +96,10 @@ def setup_openai_coding_llm(interpreter):
 
         response = litellm.completion(**params)
 
-        accumulated_deltas = {}
+        # Parses the function call's arguments as they stream in
+        arguments = StreamingJsonParser()
         language = None
-        code = ""
+        code = "" # Code we haven't yielded yet
 
         for chunk in response:
 
@@ -105,34 +109,25 @@ def setup_openai_coding_llm(interpreter):
 
             delta = chunk["choices"][0]["delta"]
 
-            # Accumulate deltas
-            accumulated_deltas = merge_deltas(accumulated_deltas, delta)
-
             if "content" in delta and delta["content"]:
                 yield {"message": delta["content"]}
 
-            if ("function_call" in accumulated_deltas 
-                and "arguments" in accumulated_deltas["function_call"]):
-
-                arguments = accumulated_deltas["function_call"]["arguments"]
-                arguments = parse_partial_json(arguments)
-
-                if arguments:
-
-                    if (language is None
-                        and "language" in arguments
-                        and "code" in arguments # <- This ensures we're *finished* typing language, as opposed to partially done
-                        and arguments["language"]):
-                        language = arguments["language"]
-                        yield {"language": language}
-                    
-                    if language is not None and "code" in arguments:
-                        # Calculate the delta (new characters only)
-                        code_delta = arguments["code"][len(code):]
-                        # Update the code
-                        code = arguments["code"]
-                        # Yield the delta
-                        if code_delta:
-                          yield {"code": code_delta}
+            if ("function_call" in delta
+                and delta["function_call"]
+                and delta["function_call"].get("arguments")):
+
+                for key, text in arguments.feed(delta["function_call"]["arguments"]):
+                    if key == "code":
+                        code += text
+
+                # (Only once it's complete, as opposed to partially typed)
+                if language is None and arguments.values.get("language"):
+                    language = arguments.values["language"]
+                    yield {"language": language}
+
+                # Code that arrives before the language waits for it
+                if language is not None and code:
+                    yield {"code": code}
+                    code = ""
             
     return coding_llm
\ No newline at end of file
@@ -3,9 +3,8 @@
 import litellm
 
 from ..utils.display_markdown_message import display_markdown_message
-from .setup_local_text_llm import setup_local_text_llm
 import os
-import tokentrim as tt
+from ..utils.trim_messages import trim_messages
 import traceback
 
 def setup_text_llm(interpreter):
@@ -42,6 +41,8 @@ def setup_text_llm(interpreter):
 
         try:
             # Download and use HF model
+            # (Imported here, so huggingface_hub is only loaded for --local)
+            from .setup_local_text_llm import setup_local_text_llm
             return setup_local_text_llm(interpreter)
         except:
             traceback.print_exc()
@@ -70,21 +71,24 @@ def setup_text_llm(interpreter):
 
         system_message += "\n\nTo execute code on the user's machine, write a markdown code block *with a language*, i.e ```python, ```shell, ```r, ```html, or ```javascript. You will recieve the code output."
 
-        # TODO swap tt.trim for litellm util
+        if interpreter.multiple_code_blocks:
+            system_message += " You can write several code blocks in one message. They will run in order, and you will recieve all of their outputs."
+
+        # TODO swap trim_messages for litellm util
         
         if interpreter.context_window and interpreter.max_tokens:
             trim_to_be_this_many_tokens = interpreter.context_window - interpreter.max_tokens - 25 # arbitrary buffer
-            messages = tt.trim(messages, system_message=system_message, max_tokens=trim_to_be_this_many_tokens)
+            messages = trim_messages(messages, system_message=system_message, max_tokens=trim_to_be_this_many_tokens)
         else:
             try:
-                messages = tt.trim(messages, system_message=system_message, model=interpreter.model)
+                messages = trim_messages(messages, system_message=system_message, model=interpreter.model)
             except:
                 display_markdown_message("""
                 **We were unable to determine the context window of this model.** Defaulting to 3000.
                 If your model can handle more, run `interpreter --context_window {token limit}` or `interpreter.context_window = {token limit}`.
                 Also, please set max_tokens: `interpreter --max_tokens {max tokens per response}` or `interpreter.max_tokens = {max tokens per response}`
                 """)
-                messages = tt.trim(messages, system_message=system_message, max_tokens=3000)
+                messages = trim_messages(messages, system_message=system_message, max_tokens=3000)
 
         if interpreter.debug_mode:
             print("Passing messages into LLM:", messages)
@@ -1,15 +1,28 @@
-import requests
 from ..utils.convert_to_openai_messages import convert_to_openai_messages
+from .procedures_index import get_index
 
-def get_relevant_procedures(messages):
+def get_relevant_procedures(messages, procedures_dir=None):
     # Open Procedures is an open-source database of tiny, up-to-date coding tutorials.
     # We can query it semantically and append relevant tutorials/procedures to our system message:
 
+    # If there's a local directory of procedures, search that instead (offline, in a few milliseconds)
+    index = get_index(procedures_dir)
+    if index:
+        query = "\n".join(str(message.get(key, "")) for message in messages for key in ("message", "code", "output"))
+        relevant_procedures = index.search(query)
+        if not relevant_procedures:
+            return ""
+        return format_procedures(relevant_procedures)
+
+    # (Imported here, so it's only loaded if we search remotely. This usually runs in a background thread anyway)
+    import requests
+
     # Convert to required OpenAI-compatible `messages` list
     query = {"query": convert_to_openai_messages(messages)}
     url = "https://open-procedures.replit.app/search/"
 
-    relevant_procedures = requests.get(url, json=query).json()["procedures"]
-    relevant_procedures = "[Recommended Procedures]\n" + "\n---\n".join(relevant_procedures) + "\nIn your plan, include steps and, if present, **EXACT CODE SNIPPETS** (especially for deprecation notices, **WRITE THEM INTO YOUR PLAN -- underneath each numbered step** as they will VANISH once you execute your first line of code, so WRITE THEM DOWN NOW if you need them) from the above procedures if they are relevant to the task. Again, include **VERBATIM CODE SNIPPETS** from the procedures above if they are relevent to the task **directly in your plan.**"
+    relevant_procedures = requests.get(url, json=query, timeout=10).json()["procedures"]
+    return format_procedures(relevant_procedures)
 
-    return relevant_procedures
+def format_procedures(relevant_procedures):
+    return "[Recommended Procedures]\n" + "\n---\n".join(relevant_procedures) + "\nIn your plan, include steps and, if present, **EXACT CODE SNIPPETS** (especially for deprecation notices, **WRITE THEM INTO YOUR PLAN -- underneath each numbered step** as they will VANISH once you execute your first line of code, so WRITE THEM DOWN NOW if you need them) from the above procedures if they are relevant to the task. Again, include **VERBATIM CODE SNIPPETS** from the procedures above if they are relevent to the task **directly in your plan.**"
@@ -0,0 +1,211 @@
+"""
+A local, offline index of procedures (tiny coding tutorials, like Open Procedures has), searched with BM25.
+
+Procedures are markdown files in a directory, one procedure per file. `build_index` turns them into one file:
+
+    b"OIPROCS1" | header length (8 bytes, little endian) | JSON header | postings | procedure texts
+
+The header has each term's postings (offset and count) and each procedure's text (offset and length).
+Postings are (procedure number, term frequency) pairs of unsigned 32 bit ints.
+`ProceduresIndex` memory maps the file, so a search only reads the postings of the query's terms.
+"""
+
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+
+MAGIC = b"OIPROCS1"
+INDEX_FILENAME = ".procedures.index"
+
+word_pattern = re.compile(r"[a-z0-9_]{2,}")
+
+# Procedures are looked up on background threads (see procedures_retriever.py), so two can want to (re)build the same index at once
+index_lock = threading.RLock()
+
+def tokenize(text):
+    return word_pattern.findall(text.lower())
+
+
+def procedure_files(procedures_dir):
+    return sorted(entry.path for entry in os.scandir(procedures_dir) if entry.is_file() and entry.name.endswith(".md"))
+
+
+def build_index(procedures_dir, index_path=None, k1=1.5, b=0.75):
+    """
+    Indexes every .md file in `procedures_dir`. Returns the index's path.
+    """
+    with index_lock:
+        index_path = index_path or os.path.join(procedures_dir, INDEX_FILENAME)
+
+        files = procedure_files(procedures_dir)
+        procedures = []
+        for path in files:
+            with open(path, encoding="utf-8") as f:
+                procedures.append(f.read().strip())
+
+        postings = {}
+        lengths = []
+        for number, procedure in enumerate(procedures):
+            terms = tokenize(procedure)
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((number, count))
+
+        postings_data = array("I")
+        terms = {}
+        for term, entries in sorted(postings.items()):
+            terms[term] = [len(postings_data) * 4, len(entries)]
+            for number, count in entries:
+                postings_data.extend((number, count))
+        if sys.byteorder != "little":
+            postings_data.byteswap()
+        postings_data = postings_data.tobytes()
+
+        texts = [procedure.encode("utf-8") for procedure in procedures]
+        documents = []
+        offset = len(postings_data)
+        for text in texts:
+            documents.append([offset, len(text)])
+            offset += len(text)
+
+        header = json.dumps({
+            "files": [os.path.basename(path) for path in files],
+            "k1": k1,
+            "b": b,
+            "lengths": lengths,
+            "average_length": sum(lengths) / len(lengths) if lengths else 0,
+            "terms": terms,
+            "documents": documents,
+        }).encode("utf-8")
+
+        # (Written to a temporary file and renamed, so readers never see half an index.
+        # Named for this process and thread, so another process building it at the same time writes its own)
+        temporary_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+                f.write(postings_data)
+                for text in texts:
+                    f.write(text)
+            os.replace(temporary_path, index_path)
+        except:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return index_path
+
+
+class ProceduresIndex:
+
+    def __init__(self, index_path):
+        with open(index_path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{index_path} isn't a procedures index")
+        header_length, = struct.unpack_from("<Q", self.data, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self.data[start:start + header_length])
+        self.body = start + header_length
+
+        self.files = header["files"]
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.lengths = header["lengths"]
+        self.average_length = header["average_length"] or 1
+        self.terms = header["terms"]
+        self.documents = header["documents"]
+
+    def postings(self, term):
+        offset, count = self.terms[term]
+        start = self.body + offset
+        entries = array("I", self.data[start:start + count * 8])
+        if sys.byteorder != "little":
+            entries.byteswap()
+        return zip(entries[0::2], entries[1::2])
+
+    def search(self, query, limit=2):
+        """
+        Returns the text of the (at most `limit`) procedures that best match `query`.
+        """
+        scores = {}
+        total = len(self.documents)
+        for term in set(tokenize(query)):
+            if term not in self.terms:
+                continue
+            frequency = self.terms[term][1]
+            idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for number, count in self.postings(term):
+                length_norm = 1 - self.b + self.b * self.lengths[number] / self.average_length
+                scores[number] = scores.get(number, 0) + idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [self.text(number) for number in best]
+
+    def text(self, number):
+        offset, length = self.documents[number]
+        start = self.body + offset
+        return self.data[start:start + length].decode("utf-8")
+
+    def close(self):
+        self.data.close()
+
+
+# index path -> (the index file's mtime, ProceduresIndex)
+loaded_indexes = {}
+
+def has_procedures(procedures_dir):
+    """
+    Whether `procedures_dir` has procedures to search (so we search it instead of Open Procedures).
+    """
+    return bool(procedures_dir) and os.path.isdir(procedures_dir) and bool(procedure_files(procedures_dir))
+
+
+def get_index(procedures_dir):
+    """
+    Returns the ProceduresIndex for `procedures_dir`, (re)building it if any procedure changed since it was built.
+    Returns None if there's no such directory, or it has no procedures.
+    """
+    if not procedures_dir or not os.path.isdir(procedures_dir):
+        return None
+    files = procedure_files(procedures_dir)
+    if not files:
+        return None
+
+    index_path = os.path.join(procedures_dir, INDEX_FILENAME)
+    with index_lock:
+        try:
+            built = os.path.getmtime(index_path)
+        except OSError:
+            built = None
+
+        loaded = loaded_indexes.get(index_path)
+        if loaded and loaded[0] == built:
+            index = loaded[1]
+        else:
+            try:
+                index = ProceduresIndex(index_path)
+            except (OSError, ValueError, KeyError):
+                # Not built yet (or broken)
+                index = None
+
+        # Rebuild it if procedures were added, removed or edited since
+        if (index is None
+            or index.files != [os.path.basename(path) for path in files]
+            or any(os.path.getmtime(path) > built for path in files)):
+            build_index(procedures_dir, index_path)
+            built = os.path.getmtime(index_path)
+            index = ProceduresIndex(index_path)
+
+        # (We don't close the index this replaces, as a search on another thread may still be using it.
+        # Its memory map is closed when it's garbage collected)
+        loaded_indexes[index_path] = (built, index)
+        return index
@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from .get_relevant_procedures import get_relevant_procedures
+
+def normalize_query(messages):
+    """
+    What we cache procedures by: the text of the messages, lowercased, with runs of whitespace collapsed.
+    """
+    text = "\n".join(str(message.get(key, "")) for message in messages for key in ("role", "message", "code", "output"))
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+def query_messages(messages):
+    """
+    The messages we look procedures up for: the user's latest message, and the one before it.
+    (The same for every response in a turn, so one that was late for the first is there for the rest)
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index]["role"] == "user":
+            return messages[max(0, index - 1):index + 1]
+    return messages[-2:]
+
+
+class ProceduresRetriever:
+    """
+    Gets relevant procedures without holding up the conversation.
+
+    `prefetch` starts looking them up in the background (we do that as soon as the user's message arrives),
+    and `get` waits at most `deadline` seconds for them. If they're late, we go on without them this time.
+    Results are cached by query for `ttl` seconds (dropping the least recently used past `max_cached`),
+    and late ones are cached when they arrive, so the next response in the turn has them (see `query_messages`).
+    """
+
+    def __init__(self, ttl=600, max_cached=128):
+        self.ttl = ttl
+        self.max_cached = max_cached
+
+        self.cache = OrderedDict() # (procedures_dir, query) -> (time, procedures)
+        self.in_flight = {} # (procedures_dir, query) -> Future
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.last_deadline = None
+        self.latencies = [] # Of the lookups themselves, in seconds
+
+    def cached(self, key):
+        # (Call with the lock held)
+        if key in self.cache:
+            stored, procedures = self.cache[key]
+            if time.monotonic() - stored < self.ttl:
+                self.cache.move_to_end(key)
+                return procedures
+            del self.cache[key]
+        return None
+
+    def prefetch(self, messages, procedures_dir=None):
+        """
+        Starts looking up procedures for `messages` (unless we have them, or already are). Returns a Future.
+        """
+        key = (procedures_dir, normalize_query(messages))
+        with self.lock:
+            procedures = self.cached(key)
+            if procedures is not None:
+                future = Future()
+                future.set_result(procedures)
+                return future
+            if key in self.in_flight:
+                return self.in_flight[key]
+            future = self.in_flight[key] = Future()
+
+        # (A daemon thread, so a hung request can't keep Open Interpreter from exiting)
+        messages = [dict(message) for message in messages]
+        threading.Thread(target=self.retrieve, args=(key, messages, future), daemon=True).start()
+        return future
+
+    def retrieve(self, key, messages, future):
+        start = time.perf_counter()
+        try:
+            procedures = get_relevant_procedures(messages, key[0])
+        except Exception as e:
+            # This can fail for odd SSL reasons. It's not necessary, so we'll try again next time
+            with self.lock:
+                self.in_flight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+            self.cache[key] = (time.monotonic(), procedures)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+            self.in_flight.pop(key, None)
+        future.set_result(procedures)
+
+    def get(self, messages, procedures_dir=None, deadline=0.15):
+        """
+        Returns procedures for `messages`, or "" if they aren't ready within `deadline` seconds.
+        Raises if looking them up failed.
+        """
+        key = (procedures_dir, normalize_query(messages))
+        with self.lock:
+            self.last_deadline = deadline
+            procedures = self.cached(key)
+            if procedures is not None:
+                self.hits += 1
+                return procedures
+            self.misses += 1
+
+        try:
+            return self.prefetch(messages, procedures_dir).result(timeout=deadline)
+        except TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            return ""
+
+    def __str__(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        median = f"{latencies[len(latencies) // 2] * 1000:.0f}ms" if latencies else "n/a"
+        slowest = f"{latencies[-1] * 1000:.0f}ms" if latencies else "n/a"
+        deadline = f" past the {self.last_deadline * 1000:.0f}ms deadline" if self.last_deadline is not None else " late"
+        return (f"Procedures: {self.hits} cache hits, {self.misses} misses ({self.timeouts}{deadline}), "
+                f"lookups: {len(latencies)}, median {median}, slowest {slowest}")
@@ -62,7 +62,7 @@ def conversation_navigator(interpreter):
     render_past_conversation(messages)
 
     # Set the interpreter's settings to the loaded messages
-    interpreter.messages = messages
+    interpreter.load(messages)
     interpreter.conversation_filename = selected_filename
 
     # Start the chat
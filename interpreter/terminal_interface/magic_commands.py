@@ -21,6 +21,7 @@ def handle_undo(self, arguments):
     if last_user_index is not None:
         removed_messages = self.messages[last_user_index:]
         self.messages = self.messages[:last_user_index]
+        self._message_cache.forget(removed_messages)
 
     print("") # Aesthetics.
 
@@ -7,7 +7,7 @@ from .components.code_block import CodeBlock
 from .components.message_block import MessageBlock
 from .magic_commands import handle_magic_command
 from ..utils.display_markdown_message import display_markdown_message
-from ..utils.truncate_output import truncate_output
+from ..utils.output_accumulator import OutputAccumulator
 
 def terminal_interface(interpreter, message):
     if not interpreter.auto_run:
@@ -18,6 +18,10 @@ def terminal_interface(interpreter, message):
     
     active_block = None
 
+    # The block we're showing output in, and its output so far
+    output_block = None
+    output = None
+
     if message:
         interactive = False
     else:
@@ -64,9 +68,9 @@ def terminal_interface(interpreter, message):
                 if "code" in chunk or "language" in chunk:
                     if active_block is None:
                         active_block = CodeBlock()
-                    if active_block.type != "code" or ran_code_block:
+                    if active_block.type != "code" or ran_code_block or ("language" in chunk and active_block.code):
                         # If the last block wasn't a code block,
-                        # or it was, but we already ran it:
+                        # or it was, but we already ran it (or this is the next block in the same response):
                         active_block.end()
                         active_block = CodeBlock()
                     ran_code_block = False
@@ -81,6 +85,18 @@ def terminal_interface(interpreter, message):
 
                 # Execution notice
                 if "executing" in chunk:
+                    code = chunk["executing"]["code"]
+                    # (respond() can drop a leading "!" from what we streamed)
+                    if (active_block is None or active_block.type != "code" or ran_code_block
+                        or active_block.code.strip() not in (code.strip(), "!" + code.strip())):
+                        # A response with several code blocks. Show the one we're running
+                        # (so it's what the user approves below, and where its output will go)
+                        if active_block:
+                            active_block.end()
+                        active_block = CodeBlock()
+                        active_block.language = chunk["executing"]["language"]
+                        active_block.code = code
+
                     if not interpreter.auto_run:
                         # OI is about to execute code. The user wants to approve this
 
@@ -109,11 +125,12 @@ def terminal_interface(interpreter, message):
                 if "output" in chunk:
                     ran_code_block = True
                     render_cursor = False
-                    active_block.output += "\n" + chunk["output"]
-                    active_block.output = active_block.output.strip() # <- Aesthetic choice
-                    
-                    # Truncate output
-                    active_block.output = truncate_output(active_block.output, interpreter.max_output)
+                    # (Stripped and truncated to max_output, see OutputAccumulator)
+                    if output_block is not active_block:
+                        output_block = active_block
+                        output = OutputAccumulator(interpreter.max_output)
+                    output.append(chunk["output"])
+                    active_block.output = output.text
 
                 if active_block:
                     active_block.refresh(cursor=render_cursor)
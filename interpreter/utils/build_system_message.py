@@ -0,0 +1,59 @@
+"""
+Builds the prompt so that it starts with the same bytes every turn.
+
+LLM providers (and local backends, with their KV cache) can skip re-processing a prompt's prefix if it's unchanged since the last request.
+So the system message only has what doesn't change (the base prompt and user info), and everything that changes between turns
+(the CWD, and the procedures we found for the latest messages) goes in a turn context message after the conversation, at the very end.
+"""
+
+import os
+from .get_user_info_string import get_user_info_string
+from ..rag.procedures_index import has_procedures
+from ..rag.procedures_retriever import query_messages
+
+context_heading = "[Turn Context]\n"
+
+def build_system_message(interpreter):
+    system_message = interpreter.system_message
+
+    # Add user info to system_message, like OS, SHELL, etc
+    system_message += "\n\n" + get_user_info_string()
+
+    return system_message
+
+def build_turn_context(interpreter):
+    """
+    Returns the message that goes after the conversation, with what changes between turns.
+    """
+    context = f"CWD: {os.getcwd()}"
+
+    # Open Procedures is an open-source database of tiny, up-to-date coding tutorials.
+    # We can query it semantically and append relevant tutorials/procedures to our prompt
+    # (Usually prefetched when the user's message arrived. If it's not back within the deadline, we go on without it)
+    if not interpreter.local:
+        try:
+            if has_procedures(interpreter.procedures_dir):
+                deadline = interpreter.procedures_deadline
+            else:
+                deadline = interpreter.remote_procedures_deadline
+            procedures = interpreter._procedures.get(query_messages(interpreter.messages), interpreter.procedures_dir, deadline)
+            if procedures:
+                context += "\n\n" + procedures
+        except:
+            # This can fail for odd SLL reasons. It's not necessary, so we can continue
+            pass
+        if interpreter.debug_mode:
+            print(interpreter._procedures)
+
+    return {"role": "system", "message": context_heading + context}
+
+def fold_turn_context(messages):
+    """
+    Moves a trailing turn context (OpenAI) message into the message before it, as LLMs generally only take a system message first.
+    Returns a new list.
+    """
+    if len(messages) < 2 or messages[-1]["role"] != "system" or not messages[-1]["content"].startswith(context_heading):
+        return messages
+    last = dict(messages[-2])
+    last["content"] = (last.get("content") or "") + "\n\n" + messages[-1]["content"]
+    return messages[:-2] + [last]
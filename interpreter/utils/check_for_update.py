@@ -1,13 +1,106 @@
-import requests
-import pkg_resources
-from packaging import version
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+import appdirs
 
-def check_for_update():
+# We ask PyPI at most once a day, and remember the answer here
+update_check_interval = 24 * 60 * 60
+# If we couldn't reach PyPI (like when we're offline), we try again after this long instead
+failed_update_check_interval = 60 * 60
+update_check_path = os.path.join(appdirs.user_data_dir("Open Interpreter"), "update_check.json")
+
+def update_checks_disabled():
+    # OPEN_INTERPRETER_NO_UPDATE_CHECK=1 turns them off (like `check_for_updates: false` in the config)
+    return os.environ.get("OPEN_INTERPRETER_NO_UPDATE_CHECK", "").lower() not in ("", "0", "false", "no")
+
+def fetch_latest_version():
     # Fetch the latest version from the PyPI API
-    response = requests.get(f'https://pypi.org/pypi/open-interpreter/json')
-    latest_version = response.json()['info']['version']
+    import requests
+    response = requests.get('https://pypi.org/pypi/open-interpreter/json', timeout=5)
+    return response.json()['info']['version']
+
+def read_update_check(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_update_check(path, checked):
+    # (Written to a temporary file and renamed, so two Open Interpreters can't interleave it)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + f".{os.getpid()}.tmp", "w") as f:
+        json.dump(checked, f)
+    os.replace(path + f".{os.getpid()}.tmp", path)
+
+def is_fresh(checked):
+    """
+    Whether a cached check (which has no latest_version if it failed) is recent enough to use.
+    """
+    if not checked:
+        return False
+    interval = update_check_interval if checked.get("latest_version") else failed_update_check_interval
+    return 0 <= time.time() - checked.get("checked", 0) < interval
+
+def newer(latest_version):
+    """
+    Whether `latest_version` (from a check) is newer than the Open Interpreter we're running.
+    False if it's None (the check failed) or we can't tell.
+    """
+    if not latest_version:
+        return False
+    try:
+        # (importlib.metadata, because pkg_resources takes ages to import)
+        from importlib import metadata
+        from packaging import version
+        current_version = metadata.version("open-interpreter")
+        return version.parse(latest_version) > version.parse(current_version)
+    except Exception:
+        return False
+
+def get_latest_version(path=None):
+    """
+    Returns the latest version on PyPI, asking PyPI only if we haven't in a day.
+    If we can't reach PyPI, it's None, and we don't ask again for an hour.
+    """
+    path = path or update_check_path
+    checked = read_update_check(path)
+
+    if not is_fresh(checked):
+        try:
+            latest_version = fetch_latest_version()
+        except Exception:
+            latest_version = None
+        checked = {"checked": time.time(), "latest_version": latest_version}
+        write_update_check(path, checked)
+
+    return checked["latest_version"]
+
+def check_for_update(path=None):
+    """
+    Returns whether there's a newer Open Interpreter on PyPI (see `get_latest_version`).
+    """
+    return newer(get_latest_version(path))
+
+def check_for_update_in_background(path=None):
+    """
+    Same as `get_latest_version`, but returns a Future, so we don't wait on PyPI. Pass its result to `newer`.
+    If we checked recently it's already done (and only read our cache, so it imports nothing).
+    """
+    path = path or update_check_path
+    future = Future()
 
-    # Get the current version using pkg_resources
-    current_version = pkg_resources.get_distribution("open-interpreter").version
+    def check():
+        try:
+            future.set_result(get_latest_version(path))
+        except Exception:
+            future.set_result(None)
 
-    return version.parse(latest_version) > version.parse(current_version)
\ No newline at end of file
+    if is_fresh(read_update_check(path)):
+        check()
+    else:
+        # (A daemon thread, so a slow PyPI can't keep Open Interpreter from exiting)
+        threading.Thread(target=check, daemon=True).start()
+    return future
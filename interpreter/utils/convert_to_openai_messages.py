@@ -3,39 +3,99 @@ import json
 def convert_to_openai_messages(messages):
     new_messages = []
 
-    for message in messages:  
-        new_message = {
-            "role": message["role"],
-            "content": ""
-        }
+    for message in messages:
+        new_messages += convert_message(message)
+
+    return new_messages
+
+def convert_message(message):
+    """
+    Returns the OpenAI messages for one OI message (a code block's output becomes a second, `function` message).
+    """
+    new_messages = []
+
+    new_message = {
+        "role": message["role"],
+        "content": ""
+    }
 
-        if "message" in message:
-            new_message["content"] = message["message"]
-
-        if "code" in message:
-            new_message["function_call"] = {
-                "name": "run_code",
-                "arguments": json.dumps({
-                    "language": message["language"],
-                    "code": message["code"]
-                }),
-                # parsed_arguments isn't actually an OpenAI thing, it's an OI thing.
-                # but it's soo useful! we use it to render messages to text_llms
-                "parsed_arguments": {
-                    "language": message["language"],
-                    "code": message["code"]
-                }
+    if "message" in message:
+        new_message["content"] = message["message"]
+
+    if "code" in message:
+        new_message["function_call"] = {
+            "name": "run_code",
+            "arguments": json.dumps({
+                "language": message["language"],
+                "code": message["code"]
+            }),
+            # parsed_arguments isn't actually an OpenAI thing, it's an OI thing.
+            # but it's soo useful! we use it to render messages to text_llms
+            "parsed_arguments": {
+                "language": message["language"],
+                "code": message["code"]
             }
+        }
+
+    new_messages.append(new_message)
+
+    if "output" in message:
+        output = message["output"]
+
+        # It's best to explicitly tell these LLMs when they don't get an output
+        if output == "":
+            output = "No output"
+
+        new_messages.append({
+            "role": "function",
+            "name": "run_code",
+            "content": output
+        })
+
+    return new_messages
+
+# The fields convert_message reads
+converted_fields = ("role", "message", "language", "code", "output")
+
+class OpenAIMessageCache:
+    """
+    Same as `convert_to_openai_messages`, but remembers what each message converted to,
+    so each turn only converts the messages that are new (like the one the LLM just wrote).
+
+    A cached conversion is used only while its message is the same dict holding the same field values
+    (checked by identity, so it costs nothing however long they are). Any edit to a message, like setting its output, converts it again.
+    """
+
+    def __init__(self):
+        # id(message) -> (message, its field values, its OpenAI messages)
+        self.entries = {}
+
+    def convert(self, messages):
+        entries = {}
+        new_messages = []
+
+        for message in messages:
+            fields = tuple(message.get(field) for field in converted_fields)
+            entry = self.entries.get(id(message))
+
+            if entry is None or entry[0] is not message or any(a is not b for a, b in zip(entry[1], fields)):
+                entry = (message, fields, convert_message(message))
+            entries[id(message)] = entry
+
+            # (Copies, because the LLMs edit what we give them, like adding to the system message or trimming content)
+            new_messages += [dict(new_message) for new_message in entry[2]]
 
-        new_messages.append(new_message)
+        # Only keep what this conversation still has in it
+        self.entries = entries
 
-        if "output" in message:
-            output = message["output"]
+        return new_messages
 
-            new_messages.append({
-                "role": "function",
-                "name": "run_code",
-                "content": output
-            })
+    def forget(self, messages):
+        """
+        Drops the conversions of `messages` (like the ones %undo removed).
+        """
+        for message in messages:
+            self.entries.pop(id(message), None)
 
-    return new_messages
\ No newline at end of file
+    def clear(self):
+        self.entries = {}
@@ -3,10 +3,13 @@ import os
 import platform
 
 def get_user_info_string():
+    """
+    The user info that doesn't change during a session, so it can stay in the stable part of the system message.
+    (The CWD does change, so it's in the turn context. See build_system_message)
+    """
 
     username = getpass.getuser()
-    current_working_directory = os.getcwd()
     operating_system = platform.system()
     default_shell = os.environ.get('SHELL')
 
-    return f"[User Info]\nName: {username}\nCWD: {current_working_directory}\nSHELL: {default_shell}\nOS: {operating_system}"
\ No newline at end of file
+    return f"[User Info]\nName: {username}\nSHELL: {default_shell}\nOS: {operating_system}"
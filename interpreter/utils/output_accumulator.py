@@ -0,0 +1,55 @@
+from collections import deque
+from .truncate_output import truncation_message
+
+class OutputAccumulator:
+    """
+    Collects a code block's output, keeping only the lines needed to show the last `max_output_chars`.
+
+    Appending is O(1) (amortized), and `text` is built in O(max_output_chars) when it's read,
+    instead of rebuilding and re-truncating the whole output string for every line.
+    `text` is every output with its trailing whitespace stripped, joined with newlines,
+    and (if it's too long) the last `max_output_chars` of that, after a note that it was truncated.
+    """
+
+    def __init__(self, max_output_chars=2000):
+        self.max_output_chars = max_output_chars
+        self.lines = deque()
+        self.chars = 0 # Characters in self.lines, including the newlines that will join them
+        self.truncated = False
+        self._text = ""
+
+    def append(self, output):
+        # (Stripping after every line means whitespace-only outputs disappear and trailing whitespace never survives)
+        output = output.rstrip()
+        if not output:
+            return
+        if not self.lines and not self.truncated:
+            output = output.lstrip()
+
+        if len(output) > self.max_output_chars:
+            output = output[-self.max_output_chars:]
+            self.truncated = True
+
+        if self.lines:
+            self.chars += 1
+        self.lines.append(output)
+        self.chars += len(output)
+
+        # Drop lines we'll never show again
+        while len(self.lines) > 1 and self.chars - len(self.lines[0]) - 1 >= self.max_output_chars:
+            self.chars -= len(self.lines.popleft()) + 1
+            self.truncated = True
+
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            text = "\n".join(self.lines)
+            if self.truncated or len(text) > self.max_output_chars:
+                text = truncation_message(self.max_output_chars) + text[-self.max_output_chars:]
+            self._text = text
+        return self._text
+
+    def __str__(self):
+        return self.text
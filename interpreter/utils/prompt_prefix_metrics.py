@@ -0,0 +1,64 @@
+class PromptPrefixMetrics:
+    """
+    Measures how much of each turn's prompt starts the same way as the last turn's,
+    which is the most a provider's prefix cache (or a local backend's KV cache) can reuse.
+
+    The prompt is the system message followed by the conversation (which ends with the turn context). We compare the system message character by character,
+    then count the messages that are unchanged (the same dicts, holding the same strings) until the first one that isn't.
+    """
+
+    def __init__(self):
+        self.turns = 0
+        self.prompt_chars = 0 # Over every turn
+        self.reused_chars = 0
+        self.last_prompt_chars = 0
+        self.last_reused_chars = 0
+
+        self.previous_system_message = ""
+        self.previous_messages = []
+
+    def record(self, system_message, messages):
+        fields = [(message, tuple(message.values())) for message in messages]
+
+        prompt_chars = len(system_message) + sum(message_chars(message) for message in messages)
+        reused_chars = common_prefix_length(system_message, self.previous_system_message)
+
+        if reused_chars == len(system_message) == len(self.previous_system_message):
+            for (message, values), (previous, previous_values) in zip(fields, self.previous_messages):
+                if message is not previous or len(values) != len(previous_values) or any(a is not b for a, b in zip(values, previous_values)):
+                    break
+                reused_chars += message_chars(message)
+
+        self.turns += 1
+        self.prompt_chars += prompt_chars
+        self.reused_chars += reused_chars
+        self.last_prompt_chars = prompt_chars
+        self.last_reused_chars = reused_chars
+
+        self.previous_system_message = system_message
+        self.previous_messages = fields
+
+    @property
+    def reuse_ratio(self):
+        """
+        The share of every prompt so far that repeated the previous one's prefix.
+        """
+        return self.reused_chars / self.prompt_chars if self.prompt_chars else 0.0
+
+    def __str__(self):
+        return (f"Prompt prefix reused: {self.last_reused_chars}/{self.last_prompt_chars} chars this turn, "
+                f"{self.reuse_ratio:.0%} over {self.turns} turns")
+
+def message_chars(message):
+    return sum(len(value) for value in message.values() if isinstance(value, str))
+
+def common_prefix_length(a, b):
+    # Compare in halves, so long equal stretches are compared in C rather than character by character
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
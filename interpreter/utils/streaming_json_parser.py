@@ -0,0 +1,195 @@
+import json
+import re
+
+# Runs of string characters that need no decoding
+plain_string_characters = re.compile(r'[^"\\]+')
+
+escapes = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class StreamingJsonParser:
+    """
+    Parses a JSON object (like a function call's `arguments`) as it streams in, keeping its state between chunks,
+    so each character is only looked at once.
+
+    `feed` returns the new text of the object's top level string values as `(key, text)` pairs.
+    `values` holds every top level value that's complete, and `partial` the strings that aren't yet.
+
+    Like `parse_partial_json`, it accepts raw newlines inside strings, which LLMs often send.
+    If the input stops being valid JSON, it stops producing output (`failed` is set).
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.partial = {}
+        self.failed = False
+
+        self.state = "start"
+        self.key = None
+        self.buffer = "" # The current key, or the raw text of a non-string value
+        self.escape = None # The escape sequence we're in the middle of, if any
+        self.high_surrogate = None
+
+        # For nested objects and arrays, which we don't stream
+        self.depth = 0
+        self.in_nested_string = False
+        self.nested_escaped = False
+
+    def feed(self, chunk):
+        deltas = []
+        i = 0
+        n = len(chunk)
+
+        while i < n and not self.failed and self.state != "done":
+            state = self.state
+            char = chunk[i]
+
+            if state in ("key", "string"):
+                if self.escape is not None:
+                    i = self.read_escape(chunk, i, deltas)
+                    continue
+
+                match = plain_string_characters.match(chunk, i)
+                if match:
+                    if state == "key":
+                        self.buffer += match.group()
+                    else:
+                        self.emit(match.group(), deltas)
+                    i = match.end()
+                    continue
+
+                if char == "\\":
+                    self.escape = ""
+                elif state == "key":
+                    self.key = self.buffer
+                    self.buffer = ""
+                    self.state = "colon"
+                else:
+                    if self.high_surrogate:
+                        self.emit("", deltas)
+                    self.values[self.key] = self.partial.pop(self.key)
+                    self.state = "comma"
+                i += 1
+                continue
+
+            if state == "nested":
+                self.buffer += char
+                if self.in_nested_string:
+                    if self.nested_escaped:
+                        self.nested_escaped = False
+                    elif char == "\\":
+                        self.nested_escaped = True
+                    elif char == '"':
+                        self.in_nested_string = False
+                elif char == '"':
+                    self.in_nested_string = True
+                elif char in "{[":
+                    self.depth += 1
+                elif char in "}]":
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.finish_value()
+                i += 1
+                continue
+
+            if state == "literal":
+                if char in ",}" or char.isspace():
+                    self.finish_value()
+                    # (Let the comma or brace be handled by the next state)
+                    continue
+                self.buffer += char
+                i += 1
+                continue
+
+            # Everything else is structure, between which whitespace doesn't matter
+            i += 1
+            if char.isspace():
+                continue
+
+            if state == "start":
+                self.expect(char == "{", "key_or_end")
+            elif state in ("key_or_end", "key_start"):
+                if char == "}" and state == "key_or_end":
+                    self.state = "done"
+                else:
+                    self.expect(char == '"', "key")
+            elif state == "colon":
+                self.expect(char == ":", "value")
+            elif state == "value":
+                if char == '"':
+                    self.partial[self.key] = ""
+                    self.state = "string"
+                elif char in "{[":
+                    self.buffer = char
+                    self.depth = 1
+                    self.state = "nested"
+                else:
+                    self.buffer = char
+                    self.state = "literal"
+            elif state == "comma":
+                if char == ",":
+                    self.state = "key_start"
+                else:
+                    self.expect(char == "}", "done")
+
+        return deltas
+
+    def emit(self, text, deltas):
+        if self.high_surrogate:
+            # A lone high surrogate. Keep it, like json.loads would
+            text = self.high_surrogate + text
+            self.high_surrogate = None
+        self.partial[self.key] += text
+        deltas.append((self.key, text))
+
+    def read_escape(self, chunk, i, deltas):
+        """
+        Continues the escape sequence at chunk[i]. Returns the index of the next character to read.
+        """
+        self.escape += chunk[i]
+        i += 1
+
+        if self.escape[0] == "u":
+            if len(self.escape) < 5:
+                return i
+            try:
+                code = int(self.escape[1:], 16)
+            except ValueError:
+                self.failed = True
+                return i
+            char = chr(code)
+        elif self.escape in escapes:
+            char = escapes[self.escape]
+        else:
+            self.failed = True
+            return i
+
+        self.escape = None
+
+        if self.state == "key":
+            self.buffer += char
+        elif 0xD800 <= ord(char) <= 0xDBFF:
+            # Half of a surrogate pair. Wait for the other half
+            if self.high_surrogate:
+                self.emit("", deltas)
+            self.high_surrogate = char
+        elif 0xDC00 <= ord(char) <= 0xDFFF and self.high_surrogate:
+            high = ord(self.high_surrogate)
+            self.high_surrogate = None
+            self.emit(chr(0x10000 + ((high - 0xD800) << 10) + (ord(char) - 0xDC00)), deltas)
+        else:
+            self.emit(char, deltas)
+        return i
+
+    def finish_value(self):
+        try:
+            self.values[self.key] = json.loads(self.buffer)
+        except ValueError:
+            self.failed = True
+        self.buffer = ""
+        self.state = "comma"
+
+    def expect(self, condition, next_state):
+        if condition:
+            self.state = next_state
+        else:
+            self.failed = True
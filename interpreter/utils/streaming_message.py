@@ -0,0 +1,107 @@
+from .merge_deltas import merge_deltas
+
+class StreamingMessage(dict):
+    """
+    A message dict that deltas can be merged into in linear time.
+
+    `merge_deltas` does `original[key] += value`, which copies the whole string for every token.
+    This appends string deltas to a list per field instead, and only joins them when the field is read,
+    so it still behaves like the plain dict it's standing in for (and `materialize` gives you one).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = {}
+
+    def merge(self, delta):
+        """
+        Same as `merge_deltas(self, delta)`.
+        """
+        for key, value in delta.items():
+            if isinstance(value, str) and isinstance(dict.get(self, key, ""), str):
+                dict.setdefault(self, key, "")
+                self._pending.setdefault(key, []).append(value)
+            elif isinstance(value, dict) and key not in self:
+                dict.__setitem__(self, key, StreamingMessage())
+                dict.__getitem__(self, key).merge(value)
+            elif isinstance(value, dict) and isinstance(dict.__getitem__(self, key), StreamingMessage):
+                dict.__getitem__(self, key).merge(value)
+            else:
+                self._flush()
+                merge_deltas(self, {key: value})
+        return self
+
+    def materialize(self):
+        """
+        Returns the message as a plain dict (nested messages too).
+        """
+        return {key: value.materialize() if isinstance(value, StreamingMessage) else value
+                for key, value in self.items()}
+
+    def _flush(self):
+        for key, parts in self._pending.items():
+            dict.__setitem__(self, key, dict.__getitem__(self, key) + "".join(parts))
+        self._pending = {}
+
+    # Everything that reads values joins the pending deltas first
+
+    def __getitem__(self, key):
+        self._flush()
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._flush()
+        super().__setitem__(key, value)
+
+    def __eq__(self, other):
+        self._flush()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._flush()
+        return super().__repr__()
+
+    # (Overriding __iter__ also stops dict(message) and {**message} from copying the values straight out of the dict,
+    # which would skip the pending deltas. They go through keys() and __getitem__ instead)
+    def __iter__(self):
+        self._flush()
+        return super().__iter__()
+
+    def keys(self):
+        self._flush()
+        return super().keys()
+
+    def get(self, key, default=None):
+        self._flush()
+        return super().get(key, default)
+
+    def items(self):
+        self._flush()
+        return super().items()
+
+    def values(self):
+        self._flush()
+        return super().values()
+
+    def pop(self, *args):
+        self._flush()
+        return super().pop(*args)
+
+    def copy(self):
+        self._flush()
+        return StreamingMessage(super().copy())
+
+    def update(self, *args, **kwargs):
+        self._flush()
+        super().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._flush()
+        return super().setdefault(key, default)
+
+    def __reduce__(self):
+        # (For pickle and copy.deepcopy. By default they'd set our items before __init__ had made _pending)
+        return (StreamingMessage, (dict(self.items()),))
@@ -0,0 +1,205 @@
+"""
+A drop-in replacement for `tokentrim.trim` that remembers token counts.
+
+tokentrim re-tokenizes every message each time it's called, and re-counts the messages it's kept
+for every message it considers, so each turn costs more than the last.
+Here each distinct string is tokenized once per encoding, and trimming is a single pass over running totals.
+It makes the same decisions tokentrim does.
+"""
+
+import tiktoken
+from collections import OrderedDict
+from tokentrim.model_map import MODEL_MAX_TOKENS
+
+MAX_ITERATIONS = 12
+
+# (encoding name, string) -> number of tokens, least recently used first
+token_counts = OrderedDict()
+max_cached_strings = 10000
+
+
+def get_encoding(model):
+    if model is None:
+        return tiktoken.get_encoding("cl100k_base")
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_string_tokens(string, encoding):
+    key = (encoding.name, string)
+    if key in token_counts:
+        token_counts.move_to_end(key)
+        return token_counts[key]
+
+    count = len(encoding.encode(string))
+    token_counts[key] = count
+    if len(token_counts) > max_cached_strings:
+        token_counts.popitem(last=False)
+    return count
+
+
+snapshot_models = {"gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k-0613", "gpt-4-0314", "gpt-4-32k-0314", "gpt-4-0613", "gpt-4-32k-0613"}
+
+def message_overhead(model):
+    """
+    Returns the model we count for, the tokens every message costs, and the tokens a `name` costs (like tokentrim).
+    """
+    if model in snapshot_models:
+        return model, 3, 1
+    if model == "gpt-3.5-turbo-0301":
+        return model, 4, -1
+    if model is not None and "gpt-3.5-turbo" in model:
+        return message_overhead("gpt-3.5-turbo-0613")
+    if model is not None and "gpt-4" in model:
+        return message_overhead("gpt-4-0613")
+    # (Unknown models, and no model at all)
+    return model, 4, 2
+
+
+def count_message_tokens(message, model):
+    """
+    The tokens `message` adds to a list of messages.
+    """
+    model, tokens_per_message, tokens_per_name = message_overhead(model)
+    encoding = get_encoding(model)
+
+    tokens = tokens_per_message
+    for key, value in message.items():
+        tokens += count_string_tokens(str(value), encoding)
+        if key == "name":
+            tokens += tokens_per_name
+    return tokens
+
+
+def count_tokens(messages, model=None):
+    """
+    Same as `tokentrim.num_tokens_from_messages`.
+    """
+    return sum(count_message_tokens(message, model) for message in messages) + 3
+
+
+def shorten_message(message, tokens_needed, model):
+    """
+    Shortens `message["content"]` to about `tokens_needed` tokens by cutting out the middle, in place (like tokentrim).
+    """
+    encoding = get_encoding(model)
+    content = message["content"]
+
+    for _ in range(MAX_ITERATIONS):
+        total_tokens = count_tokens([message], model)
+        if total_tokens <= tokens_needed:
+            break
+
+        ratio = tokens_needed / total_tokens
+        half_length = int(count_string_tokens(content, encoding) * ratio) // 2
+        left_half = encoding.decode(encoding.encode(content[:half_length]))
+        right_half = encoding.decode(encoding.encode(content[-half_length:]))
+
+        content = left_half + '...' + right_half
+        message["content"] = content
+
+
+def trim_messages(messages, model=None, system_message=None, trim_ratio=0.75, max_tokens=None):
+    """
+    Same as `tokentrim.trim`: keeps the newest messages that fit, and the system message.
+    """
+    if max_tokens is None:
+        if model not in MODEL_MAX_TOKENS:
+            raise ValueError(f"Invalid model: {model}. Specify max_tokens instead")
+        max_tokens = int(MODEL_MAX_TOKENS[model] * trim_ratio)
+
+    if system_message:
+        system_message_event = {"role": "system", "content": system_message}
+        system_message_tokens = count_tokens([system_message_event], model)
+
+        if system_message_tokens > max_tokens:
+            print("`tokentrim`: Warning, system message exceeds token limit, which is probably undesired. Trimming...")
+            shorten_message(system_message_event, max_tokens, model)
+            system_message_tokens = count_tokens([system_message_event], model)
+
+        # (tokentrim subtracts this twice. We do too, so we keep exactly the messages it would)
+        max_tokens -= 2 * system_message_tokens
+
+    final_messages = []
+    final_messages_tokens = 3 # Every list of messages costs 3 tokens
+
+    # Walk back from the newest message, keeping each one that fits
+    for message in reversed(messages):
+        message_tokens = count_message_tokens(message, model)
+
+        if final_messages_tokens + message_tokens <= max_tokens:
+            final_messages.append(message)
+            final_messages_tokens += message_tokens
+            continue
+
+        # The first one that doesn't fit is the last one we look at. Cut it down if we can
+        # (This only works for non-function call messages)
+        if "function_call" not in message:
+            shorten_message(message, max_tokens - final_messages_tokens, model)
+
+        # (tokentrim counts the list overhead twice here)
+        if count_message_tokens(message, model) + 3 + final_messages_tokens <= max_tokens:
+            final_messages.append(message)
+        break
+
+    final_messages.reverse()
+
+    if system_message:
+        final_messages = [system_message_event] + final_messages
+
+    return final_messages
+
+
+def fits(messages, model=None, system_message=None, max_tokens=None):
+    """
+    Whether `trim_messages` would keep all of `messages` as they are.
+    """
+    if system_message:
+        max_tokens -= 2 * count_tokens([{"role": "system", "content": system_message}], model)
+    return count_tokens(messages, model) <= max_tokens
+
+
+class PrefixStableTrimmer:
+    """
+    Trims like `trim_messages`, but keeps starting the conversation at the same message for as long as it fits.
+
+    `trim_messages` drops the oldest message whenever a new one doesn't fit, so once a conversation is long,
+    its start moves every turn, and a backend that caches the prompt's prefix (like llama.cpp) has to evaluate all of it again.
+    Instead, when we have to trim, we trim to `1 - headroom` of `max_tokens`, which leaves room for the next few turns.
+    """
+
+    def __init__(self, headroom=0.25):
+        self.headroom = headroom
+        # The oldest message we kept last time, and where it was.
+        # (By position, as the same message can come up more than once, like "No output". We check it's still there)
+        self.start = None
+        self.start_index = None
+
+    def trim(self, messages, model=None, system_message=None, max_tokens=None):
+        if max_tokens is None:
+            max_tokens = int(MODEL_MAX_TOKENS[model] * 0.75)
+
+        candidates = messages
+        if self.start is not None and self.start_index < len(messages) and messages[self.start_index] == self.start:
+            candidates = messages[self.start_index:]
+
+        if fits(candidates, model, system_message, max_tokens):
+            return trim_messages(candidates, model, system_message, max_tokens=max_tokens)
+
+        # (Trimming may shorten messages in place, so we trim copies)
+        trimmed = trim_messages([dict(message) for message in messages], model, system_message,
+                                max_tokens=int(max_tokens * (1 - self.headroom)))
+        first = 1 if system_message else 0
+        kept = len(trimmed) - first
+
+        # If the oldest message we kept was shortened, drop it instead (unless it's all we kept).
+        # Next turn it'd fit whole again, and moving back to it would change the prefix a second time
+        if kept > 1 and trimmed[first] != messages[len(messages) - kept]:
+            del trimmed[first]
+            kept -= 1
+
+        self.start_index = len(messages) - kept if kept else None
+        self.start = messages[self.start_index] if kept else None
+        return trimmed
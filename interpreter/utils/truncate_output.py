@@ -1,7 +1,7 @@
 def truncate_output(data, max_output_chars=2000):
   needs_truncation = False
 
-  message = f'Output truncated. Showing the last {max_output_chars} characters.\n\n'
+  message = truncation_message(max_output_chars)
 
   # Remove previous truncation message if it exists
   if data.startswith(message):
@@ -12,4 +12,7 @@ def truncate_output(data, max_output_chars=2000):
   if len(data) > max_output_chars or needs_truncation:
     data = message + data[-max_output_chars:]
 
-  return data
\ No newline at end of file
+  return data
+
+def truncation_message(max_output_chars=2000):
+  return f'Output truncated. Showing the last {max_output_chars} characters.\n\n'
\ No newline at end of file
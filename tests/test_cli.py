@@ -0,0 +1,190 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.skipif(not hasattr(socket, "send_fds"), reason="needs SCM_RIGHTS")
+def test_cli_daemon(monkeypatch, capfd, tmp_path):
+    from interpreter.cli import daemon_client
+
+    socket_path = str(tmp_path / "cli.sock")
+    monkeypatch.setenv("OPEN_INTERPRETER_NO_UPDATE_CHECK", "1")
+    daemon = subprocess.Popen(daemon_client.daemon_command(socket_path), cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while not os.path.exists(socket_path):
+            assert time.time() < deadline and daemon.poll() is None, "The daemon didn't start"
+            time.sleep(0.1)
+
+        # The session runs the CLI on our stdout, and we get its exit code
+        capfd.readouterr()
+        assert daemon_client.attach(["--help"], socket_path) == 0
+        assert "usage: interpreter" in capfd.readouterr().out
+        assert daemon_client.attach(["--not_an_argument"], socket_path) == 2
+        assert "unrecognized arguments: --not_an_argument" in capfd.readouterr().err
+
+        # A client whose API keys differ gets a fresh daemon (we'd start one), and this one exits
+        started = []
+        monkeypatch.setattr(daemon_client, "start_daemon", started.append)
+        monkeypatch.setenv("OPENAI_API_KEY", "a different key")
+        assert daemon_client.attach(["--help"], socket_path) is None
+        assert started == [socket_path]
+        assert daemon.wait(timeout=10) == 0
+        assert not os.path.exists(socket_path)
+
+        # No daemon: run it here (and start one for next time)
+        assert daemon_client.attach(["--help"], socket_path) is None
+        assert started == [socket_path, socket_path]
+    finally:
+        daemon.kill()
+        daemon.wait()
+
+def test_daemon_client_starts_nothing(monkeypatch):
+    from interpreter.core import core
+
+    warmed, checked = [], []
+    monkeypatch.setattr(core, "get_config", lambda: {"use_daemon": True, "warm_languages": ["python"]})
+    monkeypatch.setattr(core.code_interpreter_pool, "warm", lambda languages, size=1: warmed.append(languages))
+    monkeypatch.setattr(core, "check_for_update_in_background", lambda: checked.append(1))
+    monkeypatch.delenv("OPEN_INTERPRETER_NO_UPDATE_CHECK", raising=False)
+
+    # `interpreter` only attaches to the daemon, so it mustn't start code interpreters or an update check
+    interpreter = core.Interpreter()
+    assert (warmed, checked) == ([], [])
+
+    # If it runs the chat itself after all, it starts them then
+    interpreter._warm_code_interpreters()
+    interpreter._start_update_check()
+    assert (warmed, checked) == ([["python"]], [1])
+
+def test_approval_shows_the_code_it_runs(monkeypatch):
+    from interpreter.terminal_interface import terminal_interface as ui
+
+    shown = []
+    class Block:
+        def __init__(self):
+            self.code, self.message, self.language, self.active_line, self.output = "", "", None, None, ""
+            self.margin_top = True
+            self.ended = False
+            shown.append(self)
+        def refresh(self, cursor=True):
+            pass
+        def end(self):
+            self.ended = True
+    class CodeBlock(Block):
+        type = "code"
+    class MessageBlock(Block):
+        type = "message"
+    monkeypatch.setattr(ui, "CodeBlock", CodeBlock)
+    monkeypatch.setattr(ui, "MessageBlock", MessageBlock)
+    monkeypatch.setattr(ui, "display_markdown_message", lambda message: None)
+
+    # Approving each block shows the code it's about to run, even after prose or output
+    approved = []
+    def approve(prompt):
+        # (What's above the prompt: the last block drawn, which was ended so the prompt goes below it)
+        assert shown[-1].ended
+        approved.append(shown[-1].code)
+        return "y"
+    monkeypatch.setattr("builtins.input", approve)
+
+    class FakeInterpreter:
+        auto_run = False
+        debug_mode = False
+        max_output = 2000
+        messages = []
+        def chat(self, message, display, stream):
+            yield {"language": "python"}
+            yield {"code": "print(1)"}
+            yield {"executing": {"code": "print(1)", "language": "python"}}
+            yield {"output": "1"}
+            yield {"message": "And now the second one:"}
+            yield {"executing": {"code": "print(2)", "language": "python"}}
+            yield {"output": "2"}
+
+    list(ui.terminal_interface(FakeInterpreter(), "Run two blocks"))
+    assert approved == ["print(1)", "print(2)"]
+
+@pytest.mark.skipif(not hasattr(socket, "send_fds"), reason="needs SCM_RIGHTS")
+def test_session_cleans_up_when_the_client_goes_away(tmp_path):
+    from interpreter.cli import daemon
+    from interpreter.code_interpreters.create_code_interpreter import create_code_interpreter
+
+    pid_path = tmp_path / "background.pid"
+
+    class FakeInterpreter:
+        preload_modules = []
+        warm_languages = ["shell"]
+        warm_pool_size = 1
+        def __init__(self):
+            self._code_interpreters = {}
+        def _start_update_check(self):
+            pass
+
+    def cli(interpreter):
+        # Code that started a program in the background, then a chat that waits for the user
+        shell = interpreter._code_interpreters["shell"] = create_code_interpreter("shell")
+        list(shell.run(f"sleep 60 & echo $! > {pid_path}"))
+        time.sleep(60)
+
+    client, session = socket.socketpair()
+    null = [os.open(os.devnull, os.O_RDWR) for _ in range(3)]
+    pid = os.fork()
+    if pid == 0:
+        # (The session, in a fork like the daemon's. os._exit, so it never returns into pytest)
+        try:
+            client.close()
+            from interpreter.cli import cli as cli_module
+            cli_module.cli = cli
+            daemon.get_config = lambda: {}
+            daemon.run_session(FakeInterpreter(), session, null, {"cwd": str(tmp_path), "env": dict(os.environ), "argv": []})
+        finally:
+            os._exit(1)
+
+    session.close()
+    for fd in null:
+        os.close(fd)
+    try:
+        stream = client.makefile("rb")
+        assert json.loads(stream.readline()) == {"attached": True}
+        deadline = time.time() + 30
+        while not pid_path.exists() or not pid_path.read_text().strip():
+            assert time.time() < deadline, "The session didn't run the code"
+            time.sleep(0.05)
+        background = int(pid_path.read_text())
+
+        # The client goes away (like its terminal closed). The session exits through its cleanup, and takes what it started with it
+        stream.close()
+        client.close()
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 128 + signal.SIGHUP
+        deadline = time.time() + 10
+        while process_is_running(background):
+            assert time.time() < deadline, "The session left its background program running"
+            time.sleep(0.05)
+    finally:
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (OSError, ChildProcessError):
+            pass
+
+def process_is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # (No /proc, like on macOS)
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
@@ -0,0 +1,247 @@
+import threading
+import time
+from interpreter.code_interpreters.create_code_interpreter import create_code_interpreter
+
+def measure_run_latency(language, code, runs=20):
+    code_interpreter = create_code_interpreter(language)
+    try:
+        # The first run pays for process startup, which isn't what we're measuring
+        list(code_interpreter.run(code))
+
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            list(code_interpreter.run(code))
+            timings.append(time.perf_counter() - start)
+    finally:
+        code_interpreter.terminate()
+
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def test_end_of_execution_latency():
+    # There are no polling sleeps between the code finishing and `run()` returning,
+    # so a trivial block should round trip in a few milliseconds
+    for language, code in [("python", "print(1)"), ("shell", "echo 1")]:
+        latency = measure_run_latency(language, code)
+        print(f"\n{language}: median run() latency {latency * 1000:.2f} ms")
+        assert latency < 0.05
+
+def test_output_order_and_completion():
+    code_interpreter = create_code_interpreter("python")
+    try:
+        output = list(code_interpreter.run("import time\nprint(1)\ntime.sleep(0.2)\nprint(2)"))
+    finally:
+        code_interpreter.terminate()
+
+    printed = [chunk["output"].strip() for chunk in output if "output" in chunk]
+    assert printed == ["1", "2"]
+    assert output[-1] == {"active_line": None}
+
+def test_long_lines_stay_in_order():
+    # A line longer than max_line_chars is passed on in pieces, after the lines written before it
+    code_interpreter = create_code_interpreter("shell")
+    code_interpreter.max_line_chars = 10
+    try:
+        output = list(code_interpreter.run('printf "one\\ntwo\\nabcdefghijklmnopqrstuvwxyz"'))
+    finally:
+        code_interpreter.terminate()
+
+    printed = "".join(chunk["output"] for chunk in output if "output" in chunk)
+    assert printed.replace("\n", "") == "onetwoabcdefghijklmnopqrstuvwxyz"
+
+def test_sentinel_text_and_missing_newline():
+    # Markers travel on their own pipe, so printing them (or not ending with a newline) is just output
+    for language, code in [("python", 'print("## end_of_execution ##")\nprint("no newline", end="")'),
+                           ("shell", 'echo "## end_of_execution ##"\nprintf "no newline"'),
+                           ("javascript", 'console.log("## end_of_execution ##")\nvar written = process.stdout.write("no newline")')]:
+        code_interpreter = create_code_interpreter(language)
+        try:
+            output = list(code_interpreter.run(code))
+        finally:
+            code_interpreter.terminate()
+
+        # (And for JavaScript, none of the REPL's prompts or echoes)
+        printed = [chunk["output"] for chunk in output if "output" in chunk]
+        assert [text.strip() for text in printed] == ["## end_of_execution ##", "no newline"]
+
+def test_javascript_syntax_errors_and_await():
+    code_interpreter = create_code_interpreter("javascript")
+    try:
+        def run(code):
+            # (In a thread, so a run that never ends fails the test instead of hanging it)
+            output = []
+            thread = threading.Thread(target=lambda: output.extend(code_interpreter.run(code)), daemon=True)
+            thread.start()
+            thread.join(15)
+            assert not thread.is_alive(), f"{code!r} never finished"
+            return "".join(chunk["output"] for chunk in output if "output" in chunk)
+
+        # Code that doesn't compile still finishes, with the error
+        assert "SyntaxError: Unexpected token ';'" in run("let x = ;")
+
+        # Top-level await works (in an async function)
+        assert run("const value = await new Promise(resolve => setTimeout(() => resolve(5), 100))\nconsole.log(value)").strip() == "5"
+        assert "Error: later" in run("await Promise.reject(new Error('later'))")
+
+        # And the REPL is still fine afterwards
+        assert run("1 + 1").strip() == "2"
+    finally:
+        code_interpreter.terminate()
+
+def test_sampled_tracing_throughput():
+    # "statement" reports every line a tight loop runs, "sampled" reports the active line every 50ms
+    code = "total = 0\nfor i in range(100000):\n    total += i\nprint(total)"
+    timings = {}
+
+    for mode in ["statement", "sampled"]:
+        code_interpreter = create_code_interpreter("python")
+        code_interpreter.active_line_tracing = mode
+        try:
+            list(code_interpreter.run("pass"))
+            start = time.perf_counter()
+            output = list(code_interpreter.run(code))
+            timings[mode] = time.perf_counter() - start
+        finally:
+            code_interpreter.terminate()
+
+        assert {"output": "4999950000\n"} in output
+        print(f"\n{mode}: 100k iterations in {timings[mode] * 1000:.1f} ms")
+
+    assert timings["sampled"] * 5 < timings["statement"]
+
+def test_python_kernel_persistence_results_and_errors():
+    code_interpreter = create_code_interpreter("python")
+    try:
+        # Blank lines inside an indented block used to end the block early in the interactive interpreter
+        list(code_interpreter.run("def double(x):\n\n    y = x * 2\n\n    return y\n"))
+        output = list(code_interpreter.run("double(21)"))
+        assert {"output": "42"} in output
+
+        output = list(code_interpreter.run("print('before')\nraise ValueError('oops')"))
+        printed = "".join(chunk["output"] for chunk in output if "output" in chunk)
+        assert printed.startswith("before\nTraceback")
+        assert "ValueError: oops" in printed
+        assert output[-1] == {"active_line": None}
+
+        # input() must not swallow the next block
+        output = list(code_interpreter.run("input()"))
+        assert "EOFError" in "".join(chunk.get("output", "") for chunk in output)
+        assert {"output": "4"} in list(code_interpreter.run("2 + 2"))
+
+        # Output that didn't end a line comes before the result (which is sent on the control pipe)
+        output = list(code_interpreter.run('import sys\nsys.stdout.write("no newline")'))
+        printed = [chunk["output"] for chunk in output if "output" in chunk]
+        assert printed == ["no newline", "10"]
+    finally:
+        code_interpreter.terminate()
+
+def test_code_interpreter_pool():
+    from interpreter.code_interpreters.code_interpreter_pool import CodeInterpreterPool
+
+    pool = CodeInterpreterPool()
+    try:
+        pool.warm(["python"], size=1)
+        deadline = time.time() + 10
+        while not pool.ready["python"] and time.time() < deadline:
+            time.sleep(0.01)
+
+        # We get the process that was already started, and the pool starts another one behind it
+        warmed = pool.ready["python"][0]
+        code_interpreter = pool.get("python")
+        assert code_interpreter is warmed and code_interpreter.process
+        try:
+            output = list(code_interpreter.run("print('warm')"))
+            assert {"output": "warm\n"} in output
+        finally:
+            code_interpreter.terminate()
+
+        while not pool.ready["python"] and time.time() < deadline:
+            time.sleep(0.01)
+        assert pool.ready["python"] and pool.ready["python"][0] is not warmed
+    finally:
+        pool.terminate()
+
+def test_python_zygote_preloads_modules():
+    from interpreter.code_interpreters.languages import python
+
+    python.set_preload_modules(["fractions"])
+    code_interpreters = [create_code_interpreter("python") for _ in range(2)]
+    try:
+        # Already imported, without the code importing it
+        output = list(code_interpreters[0].run("import sys\n'fractions' in sys.modules"))
+        assert {"output": "True"} in output
+
+        # Each interpreter is its own process, with its own namespace
+        list(code_interpreters[0].run("x = 1"))
+        output = list(code_interpreters[1].run("print(x)"))
+        assert "NameError" in "".join(chunk.get("output", "") for chunk in output)
+        assert code_interpreters[0].process.pid != code_interpreters[1].process.pid
+    finally:
+        for code_interpreter in code_interpreters:
+            code_interpreter.terminate()
+        python.set_preload_modules([])
+
+def test_prestart_overlaps_with_run():
+    code_interpreter = create_code_interpreter("python")
+    try:
+        code_interpreter.prestart()
+        # run() waits for the process prestart() is starting, instead of starting another
+        output = list(code_interpreter.run("import os\nprint(os.getpid())"))
+        assert {"output": f"{code_interpreter.process.pid}\n"} in output
+    finally:
+        code_interpreter.terminate()
+
+def test_prestart_failure_is_reported_by_run(capfd):
+    code_interpreter = create_code_interpreter("shell")
+    code_interpreter.start_cmd = "not-a-real-shell-for-open-interpreter"
+    spawned = []
+    spawn_process = code_interpreter.spawn_process
+    code_interpreter.spawn_process = lambda *args: spawned.append(1) or spawn_process(*args)
+
+    code_interpreter.prestart()
+    deadline = time.time() + 10
+    while not code_interpreter.start_error:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    # Nothing's printed from the background, and run() reports the error instead of starting it again
+    assert capfd.readouterr() == ("", "")
+    output = list(code_interpreter.run("echo hi"))
+    assert len(output) == 1 and "FileNotFoundError" in output[0]["output"]
+    assert len(spawned) == 1
+
+    # Once. The next run tries again
+    code_interpreter.start_cmd = "bash"
+    try:
+        assert {"output": "hi\n"} in list(code_interpreter.run("echo hi"))
+    finally:
+        code_interpreter.terminate()
+
+def test_bounded_output_queue():
+    code = "for i in range(200000):\n    print(i)"
+
+    for backpressure in [False, True]:
+        code_interpreter = create_code_interpreter("python")
+        code_interpreter.max_queued_output_chars = 10_000
+        code_interpreter.max_queued_tail_chars = 1_000
+        code_interpreter.output_backpressure = backpressure
+        try:
+            list(code_interpreter.run("pass"))
+            output = code_interpreter.run(code)
+            first = next(output)
+            # Let the program get far ahead of us
+            time.sleep(1)
+            queue = code_interpreter.output_queue
+            assert queue.head_chars + queue.tail_chars <= 10_000 + 1_000 + 100
+            printed = [chunk["output"] for chunk in [first, *output] if "output" in chunk]
+        finally:
+            code_interpreter.terminate()
+
+        assert printed[-1] == "199999\n"
+        if backpressure:
+            # Nothing lost, the program just had to wait for us
+            assert len(printed) == 200000
+        else:
+            assert any(line.startswith("[Output truncated: skipped") for line in printed)
+            assert len(printed) < 200000
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+# How long a cold `import interpreter` (in a new process) may take, in milliseconds
+IMPORT_TIME_BUDGET = float(os.environ.get("OI_IMPORT_TIME_BUDGET_MS", 250))
+
+# These are only needed for the LLMs, the terminal interface or --local, so `import interpreter` shouldn't load them
+LAZY_MODULES = ["litellm", "openai", "rich", "inquirer", "tokentrim", "tiktoken", "huggingface_hub", "requests", "pkg_resources", "packaging", "importlib.metadata"]
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_interpreter(env=None, code="import interpreter"):
+    """
+    Imports interpreter in a new process. Returns how long it took (in milliseconds) and every module it imported.
+    """
+    # (No update check by default, because it imports requests in a thread, and we'd be timing PyPI)
+    env = env or {**os.environ, "OPEN_INTERPRETER_NO_UPDATE_CHECK": "1"}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=root, env=env, capture_output=True, text=True, check=True)
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative) / 1000
+    return modules["interpreter"], set(modules)
+
+def check_import_time(**kwargs):
+    # The first import compiles the .pyc files, which we don't want to time
+    import_interpreter(**kwargs)
+
+    # (The best of three, so a busy machine doesn't fail it)
+    times = []
+    for _ in range(3):
+        import_time, modules = import_interpreter(**kwargs)
+        times.append(import_time)
+
+    loaded = [module for module in LAZY_MODULES if module in modules]
+    assert not loaded, f"`import interpreter` imported {loaded}. Import them where they're used instead"
+    assert min(times) < IMPORT_TIME_BUDGET, f"`import interpreter` took {min(times):.0f}ms (the budget is {IMPORT_TIME_BUDGET:.0f}ms)"
+
+def test_import_time():
+    check_import_time()
+
+def test_import_time_with_cached_update_check(tmp_path):
+    # Most starts find today's update check in the cache (here, one that found an update), which mustn't cost anything either
+    data_dir = tmp_path / "Open Interpreter"
+    data_dir.mkdir()
+    (data_dir / "update_check.json").write_text(json.dumps({"checked": time.time(), "latest_version": "999.0.0"}))
+
+    env = {name: value for name, value in os.environ.items() if name != "OPEN_INTERPRETER_NO_UPDATE_CHECK"}
+    env["XDG_DATA_HOME"] = str(tmp_path)
+    # (Asserts the cache was used, so we know we timed the update check)
+    check_import_time(env=env, code="import interpreter\nassert interpreter._update_check.result(0) == '999.0.0'")
+
+def test_lazy_imports_still_work():
+    # (`import interpreter` replaces the package with an Interpreter, so these must be importable after that.
+    # find_spec finds them without running them, as litellm wants the network to import)
+    code = "import interpreter, importlib.util\n" + "\n".join(f"assert importlib.util.find_spec({module!r})" for module in [
+        "interpreter.cli.cli",
+        "interpreter.core.respond",
+        "interpreter.llm.setup_llm",
+        "interpreter.terminal_interface.terminal_interface",
+        "interpreter.terminal_interface.validate_llm_settings",
+    ])
+    env = {**os.environ, "OPEN_INTERPRETER_NO_UPDATE_CHECK": "1"}
+    subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, check=True)
@@ -0,0 +1,281 @@
+import os
+import time
+import pytest
+from interpreter.llm.fence_tokenizer import FenceTokenizer
+
+def tokenize(chunks, stop_after_block=False):
+    fences = FenceTokenizer(stop_after_block=stop_after_block)
+    deltas = [delta for chunk in chunks for delta in fences.feed(chunk)] + fences.finish()
+
+    # Merge the deltas into segments, starting a new one for each code block
+    segments = []
+    for delta in deltas:
+        if "language" in delta or not segments or ("message" in delta) != ("message" in segments[-1]):
+            segments.append({})
+        for key, value in delta.items():
+            segments[-1][key] = segments[-1].get(key, "") + value
+    return segments
+
+def test_fence_tokenizer():
+    response = "Install it:\n```shell\npip install x\n```\nThen run `it`:\n```python\nif x:\n    print('``')\n```\nDone."
+    expected = [{"message": "Install it:\n"},
+                {"language": "shell", "code": "pip install x\n"},
+                {"message": "Then run `it`:\n"},
+                {"language": "python", "code": "if x:\n    print('``')\n"},
+                {"message": "Done."}]
+
+    assert tokenize([response]) == expected
+
+    # Fences split across chunks, down to one character per chunk
+    assert tokenize(list(response)) == expected
+    assert tokenize([response[i:i + 3] for i in range(0, len(response), 3)]) == expected
+
+    # Like before, we can stop at the end of the first block
+    assert tokenize(list(response), stop_after_block=True) == expected[:2]
+
+    # Backticks that aren't a fence are just text, and an unfinished block is still code
+    assert tokenize(["no code ``"]) == [{"message": "no code ``"}]
+    assert tokenize(["```\nprint(1)"]) == [{"language": "python", "code": "print(1)"}]
+
+@pytest.mark.skipif(not os.environ.get("OI_BENCHMARK_GGUF"), reason="Set OI_BENCHMARK_GGUF to a .gguf model to run this")
+def test_local_llm_time_to_first_token_benchmark():
+    # Time to first token shouldn't grow with the conversation, because llama.cpp reuses the prompt prefix it already evaluated
+    from llama_cpp import Llama
+    from interpreter.llm.setup_local_text_llm import create_local_text_llm
+
+    class FakeInterpreter:
+        model = "huggingface/TheBloke/CodeLlama-7B-Instruct-GGUF"
+        context_window = 4096
+        max_tokens = 16
+        temperature = 0
+        debug_mode = False
+
+    llm = create_local_text_llm(FakeInterpreter, Llama(model_path=os.environ["OI_BENCHMARK_GGUF"], n_ctx=4096, verbose=False))
+
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    times = []
+    for turn in range(12):
+        messages.append({"role": "user", "content": f"Turn {turn}. Tell me one fact about the number {turn}."})
+        start = time.perf_counter()
+        response = ""
+        for chunk in llm(messages):
+            if not response:
+                times.append(time.perf_counter() - start)
+            response += chunk["choices"][0]["delta"].get("content", "")
+        messages.append({"role": "assistant", "content": response})
+
+    print()
+    for turn, seconds in enumerate(times):
+        print(f"Turn {turn + 1}: {seconds * 1000:.0f}ms to first token")
+    assert times[-1] < 3 * max(times[1:3])
+
+class FakeEngine:
+    """
+    Stands in for LlamaEngine, so the server runs without a model.
+    Tokens are characters, and it always predicts the letter after the last one (so "abc" continues "defg...").
+    Each step takes `step_seconds`, however many sequences are in it, like a CPU that's limited by reading the weights.
+    """
+    eos = 0
+
+    def __init__(self, model_path, n_ctx, n_gpu_layers, max_batch_size, max_batch_tokens, step_seconds=0):
+        self.step_seconds = step_seconds
+        self.evaluated = 0
+        self.loads = FakeEngine.loads = getattr(FakeEngine, "loads", 0) + 1
+
+    def tokenize(self, text):
+        return [ord(c) for c in text]
+
+    def detokenize(self, token):
+        return chr(token).encode("utf-8")
+
+    def forget(self, slot, start):
+        pass
+
+    def decode(self, entries):
+        time.sleep(self.step_seconds)
+        self.evaluated += sum(len(tokens) for slot, tokens, start, want_logits in entries)
+        return [ord("a") + (tokens[-1] - ord("a") + 1) % 26 if want_logits else None for slot, tokens, start, want_logits in entries]
+
+    def sample(self, row, temperature):
+        return row
+
+def run_server(tmp_path, models):
+    import threading
+    from interpreter.llm import local_model_server
+
+    socket_path = str(tmp_path / "local_models.sock")
+    server = local_model_server.create_server(socket_path, models)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, socket_path
+
+def test_local_model_server(tmp_path):
+    from interpreter.llm.local_model_client import connect_to_local_model_server
+    from interpreter.llm.local_model_server import ModelCache
+
+    assert connect_to_local_model_server("model.gguf", 2048, 0, str(tmp_path / "local_models.sock")) is None
+
+    FakeEngine.loads = 0
+    server, socket_path = run_server(tmp_path, ModelCache(create_engine=FakeEngine, max_batch_size=4))
+    try:
+        client = connect_to_local_model_server("model.gguf", 2048, 0, socket_path)
+        assert client
+
+        # Every session gets the same copy of the model, loaded in the server
+        for session in range(3):
+            chunks = list(client(prompt="abc", stream=True, temperature=0, stop=["</s>"], max_tokens=5))
+            assert "".join(chunk["choices"][0]["text"] for chunk in chunks) == "defgh"
+            assert chunks[-1]["choices"][0]["finish_reason"] == "length"
+        assert FakeEngine.loads == 1
+
+        # Stop strings end the completion, and aren't streamed
+        chunks = list(client(prompt="abc", stream=True, temperature=0, stop=["fg"], max_tokens=10))
+        assert "".join(chunk["choices"][0]["text"] for chunk in chunks) == "de"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class FakeLlama:
+    """
+    Stands in for a llama_cpp.Llama, for the SerialScheduler. It continues "abc" with "defg...", like FakeEngine.
+    """
+
+    def __call__(self, prompt, stream=True, temperature=0, stop=[], max_tokens=1000):
+        text = "".join(chr(ord("a") + (ord(prompt[-1]) - ord("a") + 1 + i) % 26) for i in range(max_tokens))
+        for c in text:
+            yield {"object": "text_completion", "choices": [{"text": c, "index": 0, "logprobs": None, "finish_reason": None}]}
+        yield {"object": "text_completion", "choices": [{"text": "", "index": 0, "logprobs": None, "finish_reason": "length"}]}
+
+def test_local_model_server_runs_one_completion_at_a_time_by_default(tmp_path):
+    from interpreter.llm.local_model_client import connect_to_local_model_server
+    from interpreter.llm.local_model_server import ModelCache, SerialScheduler
+
+    def create_engine(*args):
+        raise AssertionError("Batching is only used with max_batch_size above 1")
+
+    models = ModelCache(create_engine=create_engine, create_llama=lambda model_path, n_ctx, n_gpu_layers: FakeLlama())
+    server, socket_path = run_server(tmp_path, models)
+    try:
+        client = connect_to_local_model_server("model.gguf", 2048, 0, socket_path)
+        chunks = list(client(prompt="abc", stream=True, temperature=0, stop=[], max_tokens=5))
+        assert "".join(chunk["choices"][0]["text"] for chunk in chunks) == "defgh"
+        assert chunks[-1]["choices"][0]["finish_reason"] == "length"
+        assert isinstance(models.get("model.gguf", 2048, 0), SerialScheduler)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_server_command_passes_batching_options():
+    from interpreter.llm.local_model_client import server_command
+
+    assert "--max_batch_size" not in server_command("models.sock")
+    assert server_command("models.sock", max_batch_size=8, batch_wait=5.0)[-4:] == ["--max_batch_size", "8", "--batch_wait", "5.0"]
+
+def test_batch_scheduler_reuses_prompt_prefix():
+    from interpreter.llm.local_model_server import BatchScheduler
+
+    engine = FakeEngine(None, None, None, None, None)
+    scheduler = BatchScheduler(engine, n_ctx=1000, max_batch_size=2)
+
+    conversation = "hello there"
+    response = "".join(chunk["choices"][0]["text"] for chunk in scheduler.submit(conversation, max_tokens=3))
+    assert engine.evaluated == len(conversation) + 2
+
+    # The next turn starts with the last one, so only the new part is evaluated
+    # (and the response's last token, which was sampled but never evaluated)
+    engine.evaluated = 0
+    conversation += response + " and more"
+    list(scheduler.submit(conversation, max_tokens=3))
+    assert engine.evaluated == len(response[-1] + " and more") + 2
+
+def measure_throughput(create_scheduler, tokens_per_session=20):
+    import threading
+
+    throughput = {}
+    print()
+    for sessions in [1, 2, 4, 8, 16]:
+        scheduler = create_scheduler()
+
+        def session(i):
+            chunks = scheduler.submit(f"Session {i}. Count to a hundred:", max_tokens=tokens_per_session)
+            assert "".join(chunk["choices"][0]["text"] for chunk in chunks)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throughput[sessions] = sessions * tokens_per_session / (time.perf_counter() - start)
+        print(f"{sessions} sessions: {throughput[sessions]:.0f} tokens/s in {scheduler.steps} steps")
+    return throughput
+
+def test_batch_scheduler_throughput_benchmark():
+    # Concurrent sessions share each step, so throughput grows with them
+    from interpreter.llm.local_model_server import BatchScheduler
+
+    throughput = measure_throughput(lambda: BatchScheduler(FakeEngine(None, None, None, None, None, step_seconds=0.002), n_ctx=1000, max_batch_size=16))
+    assert throughput[16] > 4 * throughput[1]
+
+needs_gguf = pytest.mark.skipif(not os.environ.get("OI_TEST_GGUF"), reason="Set OI_TEST_GGUF to a (small) .gguf model to run this")
+
+@needs_gguf
+@pytest.mark.parametrize("max_batch_size", [1, 4])
+def test_local_model_server_with_a_real_model(tmp_path, max_batch_size):
+    from interpreter.llm.local_model_client import connect_to_local_model_server
+    from interpreter.llm.local_model_server import ModelCache
+
+    server, socket_path = run_server(tmp_path, ModelCache(max_batch_size=max_batch_size))
+    try:
+        client = connect_to_local_model_server(os.environ["OI_TEST_GGUF"], 512, 0, socket_path)
+        for turn in range(2):
+            chunks = list(client(prompt="The first three letters of the alphabet are", temperature=0, stop=[], max_tokens=8))
+            assert "".join(chunk["choices"][0]["text"] for chunk in chunks)
+            assert chunks[-1]["choices"][0]["finish_reason"] in ["stop", "length"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@needs_gguf
+def test_local_model_server_throughput_benchmark():
+    from interpreter.llm.local_model_server import BatchScheduler, LlamaEngine
+
+    engine = LlamaEngine(os.environ["OI_TEST_GGUF"], 512, 0, 16, 512)
+    throughput = measure_throughput(lambda: BatchScheduler(engine, n_ctx=512, max_batch_size=16), tokens_per_session=32)
+    assert throughput[16] > throughput[1]
+
+def test_combine_split_files(tmp_path, monkeypatch):
+    import hashlib
+    from interpreter.llm import setup_local_text_llm as local
+
+    # Small chunks, so every split takes several
+    monkeypatch.setattr(local, "COMBINE_CHUNK_SIZE", 1000)
+
+    def write_splits():
+        splits = {}
+        for i in range(3):
+            name = f"model.gguf-split-{'abc'[i]}"
+            data = bytes([i]) * (2500 + i)
+            (tmp_path / name).write_bytes(data)
+            splits[name] = {"bytes": len(data), "sha256": hashlib.sha256(data).hexdigest(), "data": data}
+        return splits
+
+    # Without checksums, the kernel copies the data
+    splits = write_splits()
+    local.actually_combine_files(str(tmp_path), "model.gguf", list(splits))
+    assert (tmp_path / "model.gguf").read_bytes() == b"".join(split["data"] for split in splits.values())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["model.gguf"]
+
+    # With them, a corrupt split stops it, after keeping the splits before it
+    splits = write_splits()
+    (tmp_path / "model.gguf").unlink()
+    (tmp_path / "model.gguf-split-b").write_bytes(b"x" * 2501)
+    with pytest.raises(ValueError):
+        local.actually_combine_files(str(tmp_path), "model.gguf", list(splits), expected=splits)
+    assert not (tmp_path / "model.gguf").exists()
+    assert local.combined_splits(str(tmp_path), "model.gguf") == ["model.gguf-split-a"]
+
+    # Then it resumes from there
+    (tmp_path / "model.gguf-split-b").write_bytes(splits["model.gguf-split-b"]["data"])
+    local.actually_combine_files(str(tmp_path), "model.gguf", list(splits), expected=splits)
+    assert (tmp_path / "model.gguf").read_bytes() == b"".join(split["data"] for split in splits.values())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["model.gguf"]
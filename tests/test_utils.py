@@ -0,0 +1,437 @@
+import os
+import re
+import copy
+import pickle
+import time
+import random
+import collections
+import threading
+import concurrent.futures
+from interpreter.utils.output_accumulator import OutputAccumulator
+from interpreter.utils.truncate_output import truncation_message
+
+def test_output_accumulator():
+    output = OutputAccumulator(max_output_chars=12)
+    for line in ["  first\n", "\n", "second  \n"]:
+        output.append(line)
+    assert output.text == "first\nsecond"
+
+    output.append("third\n")
+    assert output.text == truncation_message(12) + "second\nthird"
+
+def test_output_accumulator_is_linear():
+    # 200k lines used to mean 200k copies of the whole output
+    output = OutputAccumulator(max_output_chars=2000)
+    start = time.perf_counter()
+    for i in range(200000):
+        output.append(f"{i}\n")
+    assert output.text.endswith("199998\n199999")
+    assert len(output.lines) < 400
+    assert time.perf_counter() - start < 2
+
+def test_streaming_message_matches_merge_deltas():
+    from interpreter.utils.merge_deltas import merge_deltas
+    from interpreter.utils.streaming_message import StreamingMessage
+
+    deltas = [{"message": "Hi"}, {"message": " there"}, {"language": "python"},
+              {"code": "print("}, {"function_call": {"name": "run_code"}},
+              {"function_call": {"arguments": '{"code'}}, {"code": "1)"}, {"function_call": {"arguments": '": 1}'}}]
+
+    expected = {"role": "assistant"}
+    message = StreamingMessage({"role": "assistant"})
+    for delta in deltas:
+        merge_deltas(expected, delta)
+        message.merge(delta)
+        # Copies made mid-stream (like a library user reading interpreter.messages) see the deltas too
+        assert dict(message) == expected
+        message.merge({"message": ""})
+        assert {**message} == expected
+        assert message == expected
+        # Pickled (like a saved conversation) or deep-copied, too
+        message.merge({"message": ""})
+        assert pickle.loads(pickle.dumps(message)) == expected
+        assert copy.deepcopy(message) == expected
+
+    assert message["code"] == "print(1)"
+    assert type(message.materialize()["function_call"]) is dict
+
+def test_streaming_message_benchmark():
+    from interpreter.utils.merge_deltas import merge_deltas
+    from interpreter.utils.streaming_message import StreamingMessage
+
+    # A long answer: 50k chunks of a few characters each
+    chunks = [{"message": "token "}] * 50000
+    timings = {}
+
+    start = time.perf_counter()
+    message = {"role": "assistant"}
+    for chunk in chunks:
+        message = merge_deltas(message, chunk)
+    timings["merge_deltas"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streaming_message = StreamingMessage({"role": "assistant"})
+    for chunk in chunks:
+        streaming_message.merge(chunk)
+    streaming_message = streaming_message.materialize()
+    timings["StreamingMessage"] = time.perf_counter() - start
+
+    for name, timing in timings.items():
+        print(f"\n{name}: 50k chunks in {timing * 1000:.1f} ms")
+
+    assert streaming_message == message
+    assert timings["StreamingMessage"] < timings["merge_deltas"]
+
+def test_streaming_json_parser_benchmark():
+    import json
+    from interpreter.utils.parse_partial_json import parse_partial_json
+    from interpreter.utils.streaming_json_parser import StreamingJsonParser
+
+    # A 300 line code block, streamed in small chunks like function call arguments are
+    code = "\n".join(f'    print("line {i}", value["key"] / 2)  # \\ comment é' for i in range(300))
+    arguments = json.dumps({"language": "python", "code": code})
+    chunks = [arguments[i:i + 16] for i in range(0, len(arguments), 16)]
+    timings = {}
+
+    # What setup_openai_coding_llm used to do
+    start = time.perf_counter()
+    accumulated = ""
+    for chunk in chunks:
+        accumulated += chunk
+        parsed = parse_partial_json(accumulated)
+    timings["parse_partial_json"] = time.perf_counter() - start
+    assert parsed["code"] == code
+
+    start = time.perf_counter()
+    parser = StreamingJsonParser()
+    streamed = "".join(text for chunk in chunks for key, text in parser.feed(chunk) if key == "code")
+    timings["StreamingJsonParser"] = time.perf_counter() - start
+    assert streamed == code
+    assert parser.values == {"language": "python", "code": code}
+
+    for name, timing in timings.items():
+        print(f"\n{name}: {len(chunks)} chunks in {timing * 1000:.1f} ms")
+
+    assert timings["StreamingJsonParser"] * 10 < timings["parse_partial_json"]
+
+def test_streaming_json_parser_split_escapes():
+    from interpreter.utils.streaming_json_parser import StreamingJsonParser
+
+    # Escapes (and surrogate pairs) split across chunks, raw newlines, and values we don't stream
+    arguments = '{"n": [1, {"a": "}"}], "code": "a\\\\b\\ud83d\\ude00\nc\\"", "language": "python"}'
+    parser = StreamingJsonParser()
+    streamed = "".join(text for char in arguments for key, text in parser.feed(char) if key == "code")
+    assert streamed == 'a\\b\U0001F600\nc"'
+    assert parser.values == {"n": [1, {"a": "}"}], "code": streamed, "language": "python"}
+    assert not parser.failed
+
+    parser = StreamingJsonParser()
+    parser.feed("print('not json')")
+    assert parser.failed and parser.values == {}
+
+class WordEncoding:
+    # Stands in for tiktoken's encodings, which have to be downloaded
+    name = "words"
+    def encode(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+    def decode(self, tokens):
+        return "".join(tokens)
+
+def test_trim_messages_matches_tokentrim(monkeypatch):
+    import tiktoken
+    import tokentrim as tt
+    from interpreter.utils import trim_messages as trim_module
+
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordEncoding())
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: WordEncoding())
+    monkeypatch.setattr(trim_module, "token_counts", collections.OrderedDict())
+
+    random.seed(0)
+    words = ["hello ", "world. ", "print(x)\n", "a", "\n"]
+    for _ in range(300):
+        messages = []
+        for i in range(random.randint(0, 12)):
+            message = {"role": random.choice(["user", "assistant"]), "content": "".join(random.choices(words, k=random.randint(0, 80)))}
+            if random.random() < 0.2:
+                message["function_call"] = {"name": "execute", "arguments": "{}"}
+            messages.append(message)
+        system_message = "You are Open Interpreter. " * random.randint(1, 40)
+        model = random.choice(["gpt-4", "gpt-3.5-turbo", "claude-2"])
+        max_tokens = random.choice([60, 300, 1000])
+
+        expected = tt.trim(copy.deepcopy(messages), model=model, system_message=system_message, max_tokens=max_tokens)
+        trimmed = trim_module.trim_messages(copy.deepcopy(messages), model=model, system_message=system_message, max_tokens=max_tokens)
+        assert trimmed == expected
+
+def test_trim_messages_benchmark(monkeypatch):
+    import tiktoken
+    import tokentrim as tt
+    from interpreter.utils import trim_messages as trim_module
+
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordEncoding())
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: WordEncoding())
+    monkeypatch.setattr(trim_module, "token_counts", collections.OrderedDict())
+
+    # A long conversation, trimmed again after every message like respond() does
+    messages = [{"role": "user", "content": f"message {i} " * 50} for i in range(300)]
+
+    def trim_every_turn(trim):
+        start = time.perf_counter()
+        for turn in range(1, len(messages), 20):
+            trim(messages[:turn], system_message="You are Open Interpreter.", max_tokens=8000)
+        return time.perf_counter() - start
+
+    old = trim_every_turn(tt.trim)
+    new = trim_every_turn(trim_module.trim_messages)
+    print(f"\ntokentrim: {old:.3f}s, trim_messages: {new:.3f}s")
+    assert new * 5 < old
+
+def test_openai_message_cache(monkeypatch):
+    from interpreter.utils import convert_to_openai_messages as conversion
+
+    converted = []
+    convert_message = conversion.convert_message
+    monkeypatch.setattr(conversion, "convert_message", lambda message: converted.append(message) or convert_message(message))
+
+    messages = [
+        {"role": "user", "message": "Plot something"},
+        {"role": "assistant", "message": "Sure.", "language": "python", "code": "plot()", "output": ""},
+    ]
+    cache = conversion.OpenAIMessageCache()
+
+    expected = conversion.convert_to_openai_messages(messages)
+    assert expected[-1]["content"] == "No output"
+    assert cache.convert(messages) == expected
+    assert messages[1]["output"] == ""
+
+    # Only new and changed messages are converted again
+    converted.clear()
+    messages.append({"role": "user", "message": "Thanks"})
+    messages[1]["output"] = "A plot"
+    assert cache.convert(messages) == conversion.convert_to_openai_messages(messages)
+    assert converted[:2] == [messages[1], messages[2]]
+
+    # What we return can be edited without changing the cache
+    converted.clear()
+    cache.convert(messages)[0]["content"] += "!"
+    assert cache.convert(messages)[0]["content"] == "Plot something"
+    assert converted == []
+
+def test_system_message_prefix_is_stable(monkeypatch, tmp_path):
+    from interpreter.utils import build_system_message as builder
+    from interpreter.utils.prompt_prefix_metrics import PromptPrefixMetrics
+    from interpreter.rag import procedures_retriever
+
+    procedures = iter(["[Recommended Procedures]\nUse pandas", "[Recommended Procedures]\nUse requests"])
+    monkeypatch.setattr(procedures_retriever, "get_relevant_procedures", lambda messages, procedures_dir: next(procedures))
+
+    class FakeInterpreter:
+        system_message = "You are Open Interpreter."
+        local = False
+        debug_mode = False
+        messages = [{"role": "user", "message": "Hi"}]
+        procedures_dir = None
+        procedures_deadline = 5
+        remote_procedures_deadline = 5
+        _procedures = procedures_retriever.ProceduresRetriever()
+
+    def prompt():
+        # (Like respond() puts it together)
+        system_message = builder.build_system_message(FakeInterpreter)
+        return system_message, FakeInterpreter.messages + [builder.build_turn_context(FakeInterpreter)]
+
+    metrics = PromptPrefixMetrics()
+    first_system, first = prompt()
+    metrics.record(first_system, first)
+    assert metrics.last_reused_chars == 0
+    assert "Use pandas" in first[-1]["message"]
+
+    # The next turn has new procedures and a new CWD, but they're in the turn context, after the conversation
+    FakeInterpreter.messages = FakeInterpreter.messages + [{"role": "user", "message": "Now fetch a URL"}]
+    monkeypatch.chdir(tmp_path)
+    second_system, second = prompt()
+    assert second_system == first_system
+    assert second[-1]["role"] == "system"
+    assert "Use requests" in second[-1]["message"] and str(tmp_path) in second[-1]["message"]
+    assert not any("Use" in message["message"] for message in second[:-1])
+
+    # So the system message and the earlier conversation are reused
+    metrics.record(second_system, second)
+    assert metrics.last_reused_chars == len(first_system) + len("user") + len("Hi")
+    assert 0 < metrics.reuse_ratio < 1
+
+    # LLMs with one system message get the turn context at the end of the latest message
+    converted = [{"role": message["role"], "content": message["message"]} for message in second]
+    folded = builder.fold_turn_context(converted)
+    assert folded[:-1] == converted[:-2]
+    assert folded[-1]["content"] == "Now fetch a URL\n\n" + converted[-1]["content"]
+    assert converted[-2]["content"] == "Now fetch a URL"
+    assert builder.fold_turn_context(converted[:-1]) == converted[:-1]
+
+def test_prefix_stable_trimmer(monkeypatch):
+    import tiktoken
+    from interpreter.utils import trim_messages as trim_module
+
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordEncoding())
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: WordEncoding())
+
+    random.seed(0)
+    trimmer = trim_module.PrefixStableTrimmer()
+    messages = []
+    starts = []
+    for turn in range(200):
+        messages.append({"role": "user" if turn % 2 else "assistant", "content": f"turn {turn} " + "word " * random.randint(5, 30)})
+        trimmed = trimmer.trim([dict(message) for message in messages], system_message="You are Open Interpreter.", max_tokens=1000)
+        assert trim_module.count_tokens(trimmed) <= 1000
+        assert trimmed[-1] == messages[-1]
+        starts.append(trimmed[1]["content"])
+
+    # trim_messages would move the start on almost every turn once the conversation is full
+    assert starts[0] == messages[0]["content"]
+    assert len(set(starts)) < 25
+
+    # The same message over and over (like code with no output) doesn't send it back to the first copy
+    trimmer = trim_module.PrefixStableTrimmer()
+    messages = []
+    starts = []
+    for turn in range(200):
+        messages.append({"role": "function", "content": "No output"} if turn % 2 else
+                        {"role": "assistant", "content": f"turn {turn} " + "word " * random.randint(5, 30)})
+        trimmed = trimmer.trim([dict(message) for message in messages], system_message="You are Open Interpreter.", max_tokens=1000)
+        starts.append(tuple(message["content"] for message in trimmed[1:3]))
+    assert len(set(starts)) < 15
+
+def test_local_procedures_index(tmp_path):
+    from interpreter.rag.get_relevant_procedures import get_relevant_procedures
+    from interpreter.rag.procedures_index import get_index, has_procedures
+
+    # (Until there are procedures here, we ask Open Procedures, which gets a longer deadline)
+    assert not has_procedures(str(tmp_path)) and not has_procedures(None)
+
+    (tmp_path / "ffmpeg.md").write_text("To convert a video to a gif, use ffmpeg:\n```shell\nffmpeg -i in.mp4 out.gif\n```")
+    (tmp_path / "openai.md").write_text("The OpenAI python package changed. Use `openai.ChatCompletion.create` to chat.")
+    for i in range(200):
+        (tmp_path / f"filler_{i}.md").write_text(f"Procedure {i} is about topic number {i} and nothing else.")
+
+    assert has_procedures(str(tmp_path))
+
+    messages = [{"role": "user", "message": "Can you make this video a gif?"}, {"role": "assistant", "message": "Sure, with ffmpeg."}]
+    procedures = get_relevant_procedures(messages, str(tmp_path))
+    assert procedures.startswith("[Recommended Procedures]\nTo convert a video to a gif")
+
+    # It's rebuilt when procedures change
+    (tmp_path / "gif.md").write_text("To make a gif smaller, lower its frame rate.")
+    assert "lower its frame rate" in get_relevant_procedures(messages, str(tmp_path))
+
+    # Nothing relevant, nothing added
+    assert get_relevant_procedures([{"role": "user", "message": "xyzzy"}], str(tmp_path)) == ""
+
+    index = get_index(str(tmp_path))
+
+    # Retrievers look procedures up on background threads. They share one (re)built index, and an index that's replaced keeps working
+    (tmp_path / "webp.md").write_text("To convert an image to webp, use cwebp.")
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        indexes = list(pool.map(get_index, [str(tmp_path)] * 8))
+    assert all(rebuilt is indexes[0] for rebuilt in indexes)
+    assert indexes[0].search("webp")[0].startswith("To convert an image to webp")
+    assert index.search("gif")
+    assert not [path for path in os.listdir(tmp_path) if path.endswith(".tmp")]
+
+    index = indexes[0]
+    start = time.perf_counter()
+    for _ in range(100):
+        index.search("Can you make this video a gif? Sure, with ffmpeg.")
+    assert (time.perf_counter() - start) / 100 < 0.005
+
+def test_procedures_retriever(monkeypatch):
+    from interpreter.rag import procedures_retriever
+
+    lookups = []
+    release = threading.Event()
+    def get_relevant_procedures(messages, procedures_dir):
+        lookups.append(messages[-1]["message"])
+        if "slow" in messages[-1]["message"]:
+            release.wait(5)
+        return "[Recommended Procedures]\n" + messages[-1]["message"]
+    monkeypatch.setattr(procedures_retriever, "get_relevant_procedures", get_relevant_procedures)
+
+    retriever = procedures_retriever.ProceduresRetriever(ttl=60, max_cached=2)
+    messages = [{"role": "user", "message": "Plot  a CSV"}]
+
+    # Prefetched, then waited for. The same query (give or take case and whitespace) is a cache hit
+    retriever.prefetch(messages).result(timeout=5)
+    assert retriever.get(messages) == "[Recommended Procedures]\nPlot  a CSV"
+    assert retriever.get([{"role": "user", "message": "plot a\ncsv "}]) == "[Recommended Procedures]\nPlot  a CSV"
+    assert (retriever.hits, retriever.misses, len(lookups)) == (2, 0, 1)
+
+    # Late procedures are skipped (the turn only waits for the deadline), and cached for next time
+    slow = [{"role": "user", "message": "Something slow"}]
+    start = time.perf_counter()
+    assert retriever.get(slow, deadline=0.05) == ""
+    assert time.perf_counter() - start < 1
+    assert (retriever.misses, retriever.timeouts) == (1, 1)
+    release.set()
+    retriever.prefetch(slow).result(timeout=5)
+    assert retriever.get(slow) == "[Recommended Procedures]\nSomething slow"
+    assert "3 cache hits, 1 misses (1 past the 150ms deadline)" in str(retriever)
+
+    # Every response in a turn asks for the user's latest message (and the one before it),
+    # so a lookup that was late for the first response is there for the next, after the code ran
+    turn = [{"role": "assistant", "message": "Done."}, {"role": "user", "message": "Now something slow again"}]
+    release.clear()
+    assert retriever.get(procedures_retriever.query_messages(turn), deadline=0.05) == ""
+    turn += [{"role": "assistant", "message": "", "language": "python", "code": "1 + 1", "output": "2"}]
+    assert procedures_retriever.query_messages(turn) == turn[:2]
+    release.set()
+    retriever.prefetch(procedures_retriever.query_messages(turn)).result(timeout=5)
+    assert retriever.get(procedures_retriever.query_messages(turn)) == "[Recommended Procedures]\nNow something slow again"
+    assert lookups.count("Now something slow again") == 1
+
+    # Least recently used queries are dropped past max_cached, and stale ones after the TTL
+    retriever.get([{"role": "user", "message": "Third"}], deadline=5)
+    assert retriever.get(messages, deadline=5)
+    assert lookups.count("Plot  a CSV") == 2
+    monkeypatch.setattr(retriever, "ttl", 0)
+    retriever.get(messages, deadline=5)
+    assert lookups.count("Plot  a CSV") == 3
+
+def test_update_check_is_cached(monkeypatch, tmp_path):
+    from importlib import metadata
+    from interpreter.utils import check_for_update as updates
+
+    fetches = []
+    monkeypatch.setattr(updates, "fetch_latest_version", lambda: fetches.append(1) or "999.0.0")
+    monkeypatch.setattr(metadata, "version", lambda name: "0.1.7")
+    path = str(tmp_path / "update_check.json")
+
+    # Asks PyPI once, in the background, then remembers the answer for a day
+    assert updates.check_for_update_in_background(path).result(timeout=5) == "999.0.0"
+    future = updates.check_for_update_in_background(path)
+    assert future.done() and updates.newer(future.result()) is True
+    assert len(fetches) == 1
+
+    monkeypatch.setattr(updates, "update_check_interval", 0)
+    assert updates.check_for_update(path) is True
+    assert len(fetches) == 2
+
+    # Offline, it's just no update, and we don't try again (on every start) for an hour
+    def offline():
+        fetches.append(1)
+        raise OSError("No network")
+    monkeypatch.setattr(updates, "fetch_latest_version", offline)
+    monkeypatch.setattr(updates, "update_check_interval", 24 * 60 * 60)
+    with open(path, "w") as f:
+        f.write('{"checked": 0, "latest_version": "999.0.0"}')
+    assert updates.check_for_update_in_background(path).result(timeout=5) is None
+    future = updates.check_for_update_in_background(path)
+    assert future.done() and updates.newer(future.result()) is False
+    assert len(fetches) == 3
+
+    monkeypatch.setattr(updates, "failed_update_check_interval", 0)
+    assert updates.check_for_update(path) is False
+    assert len(fetches) == 4
+
+    monkeypatch.setenv("OPEN_INTERPRETER_NO_UPDATE_CHECK", "1")
+    assert updates.update_checks_disabled()
+    monkeypatch.setenv("OPEN_INTERPRETER_NO_UPDATE_CHECK", "0")
+    assert not updates.update_checks_disabled()